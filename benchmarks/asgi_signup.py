@@ -0,0 +1,150 @@
+"""Concurrent signups: threaded WSGI versus the ASGI handler.
+
+    python benchmarks/asgi_signup.py --signups 200 --threads 10 --fast-hasher
+
+``--signups`` clients POST /register at once, with Stripe customers created
+inline by a local stub that takes ``--stripe-latency`` seconds per call.
+'wsgi' serves them as a threaded WSGI server would, ``--threads`` at a time,
+each thread waiting out its Stripe call; 'asgi' serves them through
+``django_ecommerce.asgi_handler.ASGIHandler`` with the same number of
+threads, but makes the Stripe calls on its event loop.  Latency is measured
+from the moment all clients connect, so it includes time spent queued.
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import StripeStub, report, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--signups', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=10)
+    parser.add_argument('--stripe-latency', type=float, default=0.3)
+    parser.add_argument(
+        '--fast-hasher', action='store_true',
+        help='Hash passwords with MD5 to isolate the cost of the Stripe call.',
+    )
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {
+        'STRIPE_CUSTOMER_PROVISIONING': 'inline',
+        'ASGI': {'THREADS': args.threads,
+                 'STRIPE_CONNECTIONS': args.signups},
+        'STRIPE_HTTP': {'POOL_SIZE': args.threads},
+    }
+    if args.fast_hasher:
+        overrides['PASSWORD_HASHERS'] = [
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]
+    setup_django(**overrides)
+    stub = StripeStub(latency=args.stripe_latency).start()
+
+    import asyncio
+
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.http import HttpRequest
+    from django.middleware.csrf import get_token
+    from django.utils.http import urlencode
+    from django_ecommerce.asgi_handler import ASGIHandler
+    from payments.models import User
+
+    csrf_request = HttpRequest()
+    token = get_token(csrf_request)
+    cookie = 'csrftoken=%s' % csrf_request.META['CSRF_COOKIE']
+
+    def body(mode, i):
+        return urlencode({
+            'csrfmiddlewaretoken': token, 'name': 'bench user',
+            'email': 'bench-%s-%d@example.com' % (mode, i),
+            'password': 'correct horse', 'ver_password': 'correct horse',
+            'last_4_digits': '4242', 'stripe_token': 'tok_visa',
+        }).encode('ascii')
+
+    def run_wsgi():
+        app = WSGIHandler()
+
+        def signup(i):
+            data = body('wsgi', i)
+            statuses = []
+            app({
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': '/register',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie,
+                'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                'CONTENT_LENGTH': str(len(data)),
+                'wsgi.input': io.BytesIO(data), 'wsgi.errors': sys.stderr,
+                'wsgi.url_scheme': 'http',
+            }, lambda status, headers: statuses.append(status)).close()
+            return statuses[0].startswith('302'), time.time()
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            outcomes = list(pool.map(signup, range(args.signups)))
+        return outcomes, start
+
+    def run_asgi():
+        app = ASGIHandler()
+
+        async def signup(i):
+            data = body('asgi', i)
+            messages = [{'type': 'http.request', 'body': data}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            await app({
+                'type': 'http', 'method': 'POST', 'path': '/register',
+                'query_string': b'', 'server': ('testserver', 80),
+                'headers': [
+                    (b'host', b'testserver'),
+                    (b'cookie', cookie.encode('ascii')),
+                    (b'content-type', b'application/x-www-form-urlencoded'),
+                ],
+            }, receive, send)
+            return sent[0]['status'] == 302, time.time()
+
+        async def signups():
+            return await asyncio.gather(
+                *[signup(i) for i in range(args.signups)])
+
+        loop = asyncio.new_event_loop()
+        start = time.time()
+        try:
+            outcomes = loop.run_until_complete(signups())
+        finally:
+            app.executor().shutdown(wait=True)
+            app.stripe().close()
+            loop.close()
+        return outcomes, start
+
+    results = []
+    for mode, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+        calls = stub.requests
+        outcomes, start = run()
+        latencies = [done - start for ok, done in outcomes if ok]
+        elapsed = max(done for _, done in outcomes) - start
+        results.append(summarize(
+            '%s, %d threads' % (mode, args.threads), latencies, elapsed,
+            len(outcomes) - len(latencies),
+            stripe_calls=stub.requests - calls,
+            users=User.objects.filter(
+                email__startswith='bench-%s-' % mode).count(),
+        ))
+
+    stub.stop()
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
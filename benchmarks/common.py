@@ -0,0 +1,125 @@
+"""Helpers shared by the benchmark scripts in this directory.
+
+Each script is run from the project root, e.g. ``python benchmarks/signup.py``.
+They configure Django against a throwaway SQLite file (``db.sqlite3`` is never
+touched), and anything that would talk to Stripe is pointed at ``StripeStub``
+(payments/stripe_stub.py), a local HTTP server, so no network access is
+needed.
+"""
+from __future__ import print_function
+
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from payments.stripe_stub import StripeStub  # noqa: E402, re-exported
+
+
+# Benchmarks sign in from one address far faster than a person would.
+UNLIMITED_SIGN_IN = {
+    'PER_IP': {'CAPACITY': 10 ** 9, 'REFILL_PER_MINUTE': 10 ** 9},
+    'PER_EMAIL': {'CAPACITY': 10 ** 9, 'REFILL_PER_MINUTE': 10 ** 9},
+}
+
+
+def setup_django(**overrides):
+    """Configure Django on a fresh, migrated temporary database.
+
+    ``overrides`` are applied to ``django.conf.settings`` before the app
+    registry is populated.  Returns the temporary directory holding the
+    database; it is removed at interpreter exit.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_ecommerce.settings')
+    from django.conf import settings
+
+    tmp_dir = tempfile.mkdtemp(prefix='ecommerce-bench-')
+    settings.DATABASES['default']['NAME'] = os.path.join(tmp_dir, 'db.sqlite3')
+    settings.DEBUG = False
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+    import atexit
+    import django
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    atexit.register(shutil.rmtree, tmp_dir, True)
+    django.setup()
+    setup_test_environment()
+    call_command('migrate', verbosity=0, interactive=False)
+    return tmp_dir
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(label, latencies, elapsed, errors=0, **extra):
+    result = {
+        'label': label,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+    result.update(extra)
+    return result
+
+
+def report(results, as_json=False):
+    if as_json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    standard = ['label', 'requests', 'errors', 'throughput_rps',
+                'p50_ms', 'p95_ms', 'p99_ms']
+    keys = set(itertools.chain.from_iterable(results))
+    columns = [c for c in standard if c in keys]
+    columns += [c for c in sorted(keys - set(standard) - {'elapsed_s'})]
+    widths = [max(len(c), *(len(str(r.get(c, ''))) for r in results))
+              for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print('  '.join(str(r.get(c, '')).ljust(w)
+                        for c, w in zip(columns, widths)))
+
+
+def run_concurrently(func, count, concurrency=1):
+    """Call ``func(i)`` for ``i`` in ``range(count)`` on a thread pool.
+
+    Returns ``(latencies, elapsed, errors)`` where ``func`` counts as an error
+    if it raises or returns ``False``.
+    """
+    def timed(i):
+        start = time.time()
+        try:
+            ok = func(i) is not False
+        except Exception:
+            ok = False
+        return ok, time.time() - start
+
+    start = time.time()
+    if concurrency <= 1:
+        outcomes = [timed(i) for i in range(count)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(timed, range(count)))
+    elapsed = time.time() - start
+    latencies = [t for ok, t in outcomes if ok]
+    errors = sum(1 for ok, _ in outcomes if not ok)
+    return latencies, elapsed, errors
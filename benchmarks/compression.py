@@ -0,0 +1,107 @@
+"""Bytes on the wire and time to last byte for the HTML pages.
+
+    python benchmarks/compression.py --requests 200 --mbps 10
+
+Each route is fetched ``--requests`` times in three ways: with
+``Accept-Encoding: identity`` ('plain'), as a browser that accepts gzip and
+brotli would ('compressed'), and as that browser does when it revalidates a
+page it has, sending back the ETag and Last-Modified of its first response
+('repeat').  /register and /edit use the CSRF token, so they are gzipped
+with padding and never answered with a 304.
+
+The test client has no network, so ``ttlb_ms`` adds to each median server
+time the time to send the response body over a ``--mbps`` link; ``bytes`` is
+the body of one response.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from common import report, setup_django, summarize
+
+BROWSER = 'gzip, deflate, br'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--mbps', type=float, default=10.0,
+                        help='Link speed for ttlb_ms, in megabits/second.')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.flatpages.models import FlatPage
+    from django.test import Client
+    from payments.models import User
+
+    page = FlatPage.objects.create(
+        url='/pages/about/', title='About',
+        content='<p>About us.</p>' * 200,
+    )
+    page.sites.add(1)
+    user = User(name='bench', email='bench@example.com')
+    user.save()
+
+    anonymous = Client()
+    signed_in = Client()
+    session = signed_in.session
+    session['user'] = user.pk
+    session.save()
+
+    routes = [
+        ('/', anonymous, '/'),
+        ('/ (signed in)', signed_in, '/'),
+        ('/register', anonymous, '/register'),
+        ('/pages/about/', anonymous, '/pages/about/'),
+        ('/edit', signed_in, '/edit'),
+    ]
+
+    def body(resp):
+        if resp.streaming:
+            return b''.join(resp.streaming_content)
+        return resp.content
+
+    results = []
+    for label, client, path in routes:
+        first = client.get(path, HTTP_ACCEPT_ENCODING=BROWSER)
+        validators = {}
+        if first.has_header('ETag'):
+            validators['HTTP_IF_NONE_MATCH'] = first['ETag']
+        if first.has_header('Last-Modified'):
+            validators['HTTP_IF_MODIFIED_SINCE'] = first['Last-Modified']
+        modes = [
+            ('plain', {'HTTP_ACCEPT_ENCODING': 'identity'}),
+            ('compressed', {'HTTP_ACCEPT_ENCODING': BROWSER}),
+            ('repeat', dict(validators, HTTP_ACCEPT_ENCODING=BROWSER)),
+        ]
+        for mode, headers in modes:
+            latencies = []
+            errors = 0
+            size = 0
+            status = None
+            start = time.time()
+            for _ in range(args.requests):
+                began = time.time()
+                resp = client.get(path, **headers)
+                size = len(body(resp))
+                status = resp.status_code
+                if status in (200, 304):
+                    latencies.append(time.time() - began)
+                else:
+                    errors += 1
+            result = summarize('%s, %s' % (label, mode), latencies,
+                               time.time() - start, errors,
+                               status=status, bytes=size,
+                               encoding=resp.get('Content-Encoding', '-'))
+            result['ttlb_ms'] = round(
+                result['p50_ms'] + size * 8 / (args.mbps * 1000.0), 2)
+            results.append(result)
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""ContactForm admin changelist and export on a large table.
+
+    python benchmarks/contact_admin.py --rows 5000000
+
+Seeds ``--rows`` messages, then times the changelist at its first page and
+half way through the table, rendered by a stock ModelAdmin (OFFSET pages and
+COUNT(*)) and by ContactFormAdmin (keyset pages and an estimated count), and
+finally a full ``export_contacts`` run to /dev/null.  ``peak_mb`` is the
+export's peak Python memory, from a second run under tracemalloc where that
+is available.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import time
+
+from common import report, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib import admin
+    from django.contrib.auth.models import User as AdminUser
+    from django.core.management import call_command
+    from django.db import connection, transaction
+    from django.test import RequestFactory
+    from django.utils import timezone
+    from contact.admin import ContactFormAdmin, OLDER_VAR, encode_cursor
+    from contact.models import ContactForm
+
+    start = time.time()
+    table = ContactForm._meta.db_table
+    sql = ('INSERT INTO %s (name, email, topic, message, timestamp) '
+           'VALUES (%%s, %%s, %%s, %%s, %%s)' % table)
+    epoch = timezone.now() - datetime.timedelta(seconds=args.rows)
+    batch = 50000
+    for offset in range(0, args.rows, batch):
+        rows = [
+            ('Visitor %d' % i, 'visitor%d@example.com' % (i % 100000),
+             'Question', 'Message number %d' % i,
+             epoch + datetime.timedelta(seconds=i))
+            for i in range(offset, min(offset + batch, args.rows))
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+    print('seeded %d messages in %.1fs' % (args.rows, time.time() - start))
+
+    superuser = AdminUser.objects.create_superuser(
+        'bench', 'bench@example.com', 'bench'
+    )
+    factory = RequestFactory()
+
+    class StockAdmin(admin.ModelAdmin):
+        list_display = ContactFormAdmin.list_display
+
+    stock = StockAdmin(ContactForm, admin.site)
+    keyset = ContactFormAdmin(ContactForm, admin.site)
+    per_page = keyset.list_per_page
+    middle = args.rows // 2
+    middle_row = ContactForm.objects.order_by('-timestamp', '-pk')[middle]
+
+    pages = [
+        ('offset first page', stock, {}),
+        ('offset middle page', stock, {'p': middle // per_page}),
+        ('keyset first page', keyset, {}),
+        ('keyset middle page', keyset,
+         {OLDER_VAR: encode_cursor(middle_row)}),
+    ]
+    results = []
+    for label, model_admin, params in pages:
+        latencies = []
+        started = time.time()
+        for _ in range(args.repeats):
+            request = factory.get('/admin/contact/contactform/', params)
+            request.user = superuser
+            t = time.time()
+            response = model_admin.changelist_view(request)
+            response.render()
+            latencies.append(time.time() - t)
+            assert response.status_code == 200, label
+        results.append(summarize(label, latencies, time.time() - started))
+
+    def export():
+        with open(os.devnull, 'w') as devnull:
+            call_command('export_contacts', stdout=devnull)
+
+    started = time.time()
+    export()
+    elapsed = time.time() - started
+    extra = {'rows_per_s': int(args.rows / elapsed)}
+    try:
+        import tracemalloc
+    except ImportError:  # Python 2
+        pass
+    else:
+        # a second, slower, run just to measure memory
+        tracemalloc.start()
+        export()
+        extra['peak_mb'] = round(
+            tracemalloc.get_traced_memory()[1] / 1024.0 / 1024, 1)
+        tracemalloc.stop()
+    results.append(summarize('export csv', [elapsed], elapsed, **extra))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
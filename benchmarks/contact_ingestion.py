@@ -0,0 +1,76 @@
+"""Contact form submission throughput, direct versus spooled.
+
+    python benchmarks/contact_ingestion.py --submissions 10000 --concurrency 32
+
+Posts ``--submissions`` contact forms through the full middleware stack from
+``--concurrency`` threads, each with its own client.  'direct' saves every
+submission in its request, one SQLite write transaction each; 'spooled'
+appends it to the fsynced spool, and ``flush_s`` is the time the flusher
+then takes to bulk-load the lot.  A tenth of the submissions repeat an
+earlier one, as a spam wave would.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import threading
+import time
+
+from common import report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--submissions', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    tmp_dir = setup_django()
+
+    from django.test import Client
+    from django.test.utils import override_settings
+    from contact import spool
+    from contact.models import ContactForm
+
+    def form(i):
+        n = i if i % 10 else i // 10
+        return {
+            'name': 'Visitor %d' % n, 'email': 'visitor%d@example.com' % n,
+            'topic': 'Question', 'message': 'Message number %d' % n,
+        }
+
+    results = []
+    for mode in ('direct', 'spooled'):
+        ContactForm.objects.all().delete()
+        conf = {'MODE': mode, 'SPOOL_DIR': os.path.join(tmp_dir, 'spool')}
+        with override_settings(CONTACT_INGESTION=conf):
+            spool.reset()
+            local = threading.local()
+
+            def submit(i):
+                client = getattr(local, 'client', None)
+                if client is None:
+                    client = local.client = Client()
+                return client.post('/contact/', form(i)).status_code == 302
+
+            latencies, elapsed, errors = run_concurrently(
+                submit, args.submissions, args.concurrency
+            )
+            extra = {}
+            if mode == 'spooled':
+                start = time.time()
+                stored, duplicates = spool.get_spool().flush()
+                extra['flush_s'] = round(time.time() - start, 3)
+                extra['duplicates_dropped'] = duplicates
+            spool.reset()
+        results.append(summarize(
+            mode, latencies, elapsed, errors,
+            rows=ContactForm.objects.count(), **extra
+        ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
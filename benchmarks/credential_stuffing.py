@@ -0,0 +1,113 @@
+"""Cost of a credential-stuffing replay against sign_in.
+
+    python benchmarks/credential_stuffing.py --attempts 100000 --ips 50
+
+Replays a synthetic credential list (mostly unknown emails, some real ones
+with wrong passwords) from a pool of client addresses straight through the
+``sign_in`` view.  'unprotected' disables the rate limiter and, because every
+attempt there pays for a password hash, only replays the first
+``--unprotected-sample`` attempts.  'protected' uses the configured
+SIGN_IN_RATE_LIMIT for the whole list.  The table splits SQL queries and CPU
+time between attempts that were rejected by the limiter and those that
+reached the database and hasher.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from common import UNLIMITED_SIGN_IN, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--attempts', type=int, default=100000)
+    parser.add_argument('--ips', type=int, default=50)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--unprotected-sample', type=int, default=500)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from payments import ratelimit
+    from payments.models import User
+    from payments.views import sign_in
+
+    for i in range(args.users):
+        user = User(name='user %d' % i, email='user%d@example.com' % i)
+        user.set_password('seed password')
+        user.save()
+
+    rng = random.Random(42)
+    attempts = []
+    for i in range(args.attempts):
+        if rng.random() < 0.1:
+            email = 'user%d@example.com' % rng.randrange(args.users)
+        else:
+            email = 'leaked%d@example.net' % rng.randrange(10 ** 7)
+        ip = '10.0.%d.%d' % divmod(rng.randrange(args.ips), 256)
+        attempts.append((ip, email, 'hunter%d' % rng.randrange(1000)))
+
+    factory = RequestFactory()
+
+    def replay(label, attempts):
+        ratelimit.reset()
+        totals = {'rejected': [0, 0, 0.0], 'checked': [0, 0, 0.0]}
+        with CaptureQueriesContext(connection) as queries:
+            for ip, email, password in attempts:
+                request = factory.post(
+                    '/sign_in', {'email': email, 'password': password},
+                    REMOTE_ADDR=ip,
+                )
+                request.session = {}
+                seen = len(queries)
+                cpu = time.process_time()
+                resp = sign_in(request)
+                cpu = time.process_time() - cpu
+                bucket = totals['rejected' if resp.status_code == 429
+                                else 'checked']
+                bucket[0] += 1
+                bucket[1] += len(queries) - seen
+                bucket[2] += cpu
+
+        def per(bucket, index, scale=1):
+            if not bucket[0]:
+                return ''
+            return round(bucket[index] * scale / bucket[0], 3)
+
+        rejected, checked = totals['rejected'], totals['checked']
+        return {
+            'label': label,
+            'attempts': len(attempts),
+            'rejected': rejected[0],
+            'queries_per_rejected': per(rejected, 1),
+            'cpu_ms_per_rejected': per(rejected, 2, 1000),
+            'checked': checked[0],
+            'queries_per_checked': per(checked, 1),
+            'cpu_ms_per_checked': per(checked, 2, 1000),
+            'total_queries': rejected[1] + checked[1],
+            'total_cpu_s': round(rejected[2] + checked[2], 2),
+        }
+
+    # sign_in reports each form error on stdout; keep the table readable
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        with override_settings(SIGN_IN_RATE_LIMIT=UNLIMITED_SIGN_IN):
+            unprotected = replay('unprotected',
+                                 attempts[:args.unprotected_sample])
+        protected = replay('protected', attempts)
+    finally:
+        sys.stdout = stdout
+
+    report([unprotected, protected], args.json)
+
+
+if __name__ == '__main__':
+    main()
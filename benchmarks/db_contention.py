@@ -0,0 +1,91 @@
+"""Write contention on POST /contact/ for each database profile.
+
+    python benchmarks/db_contention.py --requests 2000 --concurrency 16
+
+Concurrent clients submit the contact form, each submission being one
+INSERT.  'sqlite-untuned' is the project's original setup: rollback journal,
+the driver's default lock wait and a new connection per request.
+'sqlite-tuned' is the default 'sqlite' profile (WAL, busy_timeout,
+synchronous=NORMAL, persistent connections).  A 'postgres' row is added when
+the benchmark is started with DATABASE_PROFILE=postgres and the usual
+DATABASE_* variables pointing at a scratch database.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+
+from common import report, run_concurrently, setup_django, summarize
+
+PROFILES = [
+    ('sqlite-untuned', {'journal_mode': 'DELETE'}, 0),
+    ('sqlite-tuned', None, None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    postgres = os.environ.get('DATABASE_PROFILE') == 'postgres'
+    if postgres:
+        import django
+        from django.core.management import call_command
+        from django.test.utils import setup_test_environment
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                              'django_ecommerce.settings')
+        django.setup()
+        setup_test_environment()
+        call_command('migrate', verbosity=0, interactive=False)
+        profiles = [('postgres', None, None)]
+    else:
+        setup_django()
+        profiles = PROFILES
+
+    from django.conf import settings
+    from django.db import connections
+    from django.test import Client
+    from contact.models import ContactForm
+
+    tuned_pragmas = settings.SQLITE_PRAGMAS
+    tuned_max_age = settings.DATABASES['default']['CONN_MAX_AGE']
+
+    results = []
+    for label, pragmas, max_age in profiles:
+        connections.close_all()
+        settings.SQLITE_PRAGMAS = tuned_pragmas if pragmas is None else pragmas
+        settings.DATABASES['default']['CONN_MAX_AGE'] = (
+            tuned_max_age if max_age is None else max_age
+        )
+        for conn in connections.all():
+            conn.settings_dict['CONN_MAX_AGE'] = (
+                settings.DATABASES['default']['CONN_MAX_AGE']
+            )
+        before = ContactForm.objects.count()
+
+        def submit(i):
+            resp = Client().post('/contact/', {
+                'name': 'bench',
+                'email': 'bench-%d@example.com' % i,
+                'topic': 'load test',
+                'message': 'message %d' % i,
+            })
+            return resp.status_code == 302
+
+        latencies, elapsed, errors = run_concurrently(
+            submit, args.requests, args.concurrency
+        )
+        results.append(summarize(
+            label, latencies, elapsed, errors,
+            error_rate=round(errors / float(args.requests), 4),
+            rows_written=ContactForm.objects.count() - before,
+        ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Reminder notices per second sent by the dunning workers.
+
+    python benchmarks/dunning.py --rows 1000000 --workers 1 4 8
+
+Seeds ``--rows`` overdue ``UnpaidUsers`` rows, then for each worker count
+runs that many threads, each calling ``payments.dunning.run_once`` (what
+``manage.py send_dunning_notices`` loops over) until nothing is left, with
+emails built as usual but handed to the dummy backend.  ``lost`` counts rows
+a worker selected but another claimed first; ``claim_p99_ms`` is the slowest
+claims, which is where workers would wait on each other.  The rows are made
+overdue again between runs.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import threading
+import time
+
+from common import percentile, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from payments import dunning
+    from payments.models import UnpaidUsers
+
+    # setup_test_environment() swapped in locmem, which would keep every
+    # message in memory
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
+
+    overdue = timezone.now() - datetime.timedelta(days=30)
+    table = UnpaidUsers._meta.db_table
+    sql = ('INSERT INTO %s (email, last_notification, notices_sent, claim) '
+           'VALUES (%%s, %%s, 0, %%s)' % table)
+    start = time.time()
+    batch = 50000
+    for offset in range(0, args.rows, batch):
+        rows = [('unpaid%d@example.com' % i, overdue, '')
+                for i in range(offset, min(offset + batch, args.rows))]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+    print('seeded %d rows in %.1fs' % (args.rows, time.time() - start))
+
+    claim = dunning.claim
+
+    results = []
+    for workers in args.workers:
+        UnpaidUsers.objects.update(last_notification=overdue, notices_sent=0,
+                                   locked_until=None, claim='')
+        lock = threading.Lock()
+        totals = {'sent': 0, 'lost': 0}
+        claims = []
+
+        def timed_claim(limit, now=None):
+            t = time.time()
+            try:
+                return claim(limit, now)
+            finally:
+                with lock:
+                    claims.append(time.time() - t)
+
+        def work():
+            from django.db import connection
+            try:
+                while True:
+                    sent, lost = dunning.run_once(args.batch_size)
+                    with lock:
+                        totals['sent'] += sent
+                        totals['lost'] += lost
+                    if not sent and not lost:
+                        return
+            finally:
+                connection.close()
+
+        dunning.claim = timed_claim
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        dunning.claim = claim
+
+        assert totals['sent'] == args.rows, totals
+        results.append({
+            'label': '%d worker(s)' % workers,
+            'sent': totals['sent'],
+            'seconds': round(elapsed, 2),
+            'rows_per_s': int(totals['sent'] / elapsed),
+            'lost': totals['lost'],
+            'claim_p99_ms': round(percentile(claims, 99) * 1000, 1),
+        })
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""/edit latency reading Stripe live versus the local customer mirror.
+
+    python benchmarks/edit_page.py --users 200 --stripe-latency 0.25
+
+Every user has a customer in a local Stripe stub that delays each call by
+``--stripe-latency`` seconds.  Each user loads /edit and then submits a new
+card.  'live' re-reads the customer from Stripe on every page view
+(``STRIPE_MIRROR['MAX_AGE'] = 0``), as the page would without the mirror;
+'mirror' reads the rows ``sync_stripe_mirror`` stored, so only the card
+update itself calls Stripe.  The 'sync' rows time a full mirror sync of
+``--customers`` customers at 1 and ``--workers`` fetching threads.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from common import (
+    UNLIMITED_SIGN_IN, StripeStub, report, run_concurrently, setup_django,
+    summarize,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--stripe-latency', type=float, default=0.25)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django(
+        SIGN_IN_RATE_LIMIT=UNLIMITED_SIGN_IN,
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    )
+    stub = StripeStub(latency=args.stripe_latency).start()
+
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password
+    from django.test import Client
+    from payments import stripe_mirror
+    from payments.models import StripeCustomer, User
+
+    # customers signed up over the last five years
+    now = int(time.time())
+    since = now - 5 * 365 * 86400
+    rng = random.Random(0)
+    customers = []
+    for i in range(max(args.customers, args.users)):
+        customer = stub.create_customer({
+            'email': 'customer%d@example.com' % i, 'card': 'tok_visa',
+        })
+        customer['created'] = rng.randrange(since, now)
+        customers.append(customer)
+    password = make_password('correct horse')
+    User.objects.bulk_create([
+        User(name='Customer %d' % i, email=c['email'], email_key=c['email'],
+             stripe_id=c['id'], password=password)
+        for i, c in enumerate(customers[:args.users])
+    ])
+
+    results = []
+    for workers in (1, args.workers):
+        StripeCustomer.objects.all().delete()
+        start = time.time()
+        synced = stripe_mirror.sync(full=True, workers=workers, since=since)
+        elapsed = time.time() - start
+        results.append({
+            'label': 'sync, %d worker(s)' % workers,
+            'requests': synced,
+            'seconds': round(elapsed, 2),
+            'customers_per_s': int(synced / elapsed),
+        })
+
+    clients = []
+    for c in customers[:args.users]:
+        client = Client()
+        client.post('/sign_in', {'email': c['email'],
+                                 'password': 'correct horse'})
+        clients.append(client)
+
+    for label, max_age in (('live', 0), ('mirror', None)):
+        settings.STRIPE_MIRROR = dict(settings.STRIPE_MIRROR,
+                                      MAX_AGE=max_age)
+        stub_requests = stub.requests
+
+        def view(i):
+            resp = clients[i].get('/edit')
+            return resp.status_code == 200 and b'ends in 4242' in resp.content
+
+        def update(i):
+            resp = clients[i].post('/edit', {'stripe_token': 'tok_visa',
+                                             'last_4_digits': '4242'})
+            return resp.status_code == 302
+
+        for action, func in (('GET', view), ('POST', update)):
+            latencies, elapsed, errors = run_concurrently(
+                func, args.users, args.concurrency
+            )
+            results.append(summarize('%s %s /edit' % (label, action),
+                                     latencies, elapsed, errors))
+        results[-1]['stripe_calls'] = stub.requests - stub_requests
+
+    stub.stop()
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
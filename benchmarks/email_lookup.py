@@ -0,0 +1,77 @@
+"""Case-insensitive email lookup latency on a large user table.
+
+    python benchmarks/email_lookup.py --users 1000000
+
+Seeds ``--users`` rows, then times three ways of finding a user by an email
+typed with different capitalisation:
+
+* 'iexact scan': ``email__iexact``, what a case-insensitive lookup costs
+  without a normalized column (a full table scan),
+* 'exact email': the original case-sensitive ``email=`` lookup, for
+  reference,
+* 'email_key': ``User.by_email``, served by the unique index on email_key.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from common import report, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--scan-lookups', type=int, default=20)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from payments.models import User
+
+    password = make_password('seed password')
+    start = time.time()
+    batch = 10000
+    for offset in range(0, args.users, batch):
+        users = []
+        for i in range(offset, min(offset + batch, args.users)):
+            email = 'Customer%d@Example.com' % i
+            users.append(User(name='customer %d' % i, email=email,
+                              email_key=email.lower(), password=password))
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+    print('seeded %d users in %.1fs' % (args.users, time.time() - start))
+
+    rng = random.Random(7)
+
+    def timed(lookup, count):
+        latencies = []
+        start = time.time()
+        for _ in range(count):
+            i = rng.randrange(args.users)
+            t = time.time()
+            found = lookup(i)
+            latencies.append(time.time() - t)
+            assert found, i
+        return latencies, time.time() - start
+
+    lookups = [
+        ('iexact scan', args.scan_lookups, lambda i: User.objects.filter(
+            email__iexact='customer%d@example.com' % i).exists()),
+        ('exact email', args.lookups, lambda i: User.objects.filter(
+            email='Customer%d@Example.com' % i).exists()),
+        ('email_key', args.lookups, lambda i: User.by_email(
+            'customer%d@example.com' % i).exists()),
+    ]
+    results = [summarize(label, *timed(lookup, count))
+               for label, count, lookup in lookups]
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
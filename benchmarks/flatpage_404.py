@@ -0,0 +1,79 @@
+"""A 404-heavy scanner log against both flatpage fallback middlewares.
+
+    python benchmarks/flatpage_404.py --requests 5000 --pages 50
+
+Replays a synthetic scanner log (probes for admin panels, dotfiles and
+backups, plus an occasional real flatpage) through the full middleware stack.
+'contrib' is django.contrib.flatpages' FlatpageFallbackMiddleware, which runs
+a flatpage query for every 404; 'indexed' is main.middleware's, which answers
+from the in-memory index in main/flatpages.py.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+
+from common import report, run_concurrently, setup_django, summarize
+
+PROBES = [
+    '/wp-login.php', '/wp-admin/', '/.env', '/.git/config', '/phpmyadmin/',
+    '/admin.php', '/backup.zip', '/config.php.bak', '/xmlrpc.php',
+    '/cgi-bin/test.cgi', '/server-status', '/.aws/credentials',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+    from django.contrib.flatpages.models import FlatPage
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from main import flatpages
+
+    for i in range(args.pages):
+        page = FlatPage.objects.create(
+            url='/page-%d/' % i, title='Page %d' % i, content='Page %d' % i,
+        )
+        page.sites.add(settings.SITE_ID)
+
+    rng = random.Random(3)
+    log = []
+    for i in range(args.requests):
+        if rng.random() < 0.05:
+            log.append('/page-%d/' % rng.randrange(args.pages))
+        else:
+            log.append('%s?%d' % (rng.choice(PROBES), rng.randrange(10 ** 6)))
+
+    indexed = 'main.middleware.FlatpageFallbackMiddleware'
+    contrib = 'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware'
+    results = []
+    for label, middleware in (('contrib', contrib), ('indexed', indexed)):
+        stack = [middleware if m == indexed else m
+                 for m in settings.MIDDLEWARE]
+        with override_settings(MIDDLEWARE=stack):
+            flatpages.reset()
+            client = Client()
+            with CaptureQueriesContext(connection) as queries:
+                latencies, elapsed, errors = run_concurrently(
+                    lambda i: client.get(log[i]).status_code in (200, 404),
+                    len(log),
+                )
+        results.append(summarize(
+            label, latencies, elapsed, errors,
+            queries=len(queries),
+            queries_per_request=round(len(queries) / float(len(log)), 3),
+        ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Logged-in home page with and without the user profile cache.
+
+    python benchmarks/home_page.py --requests 2000
+
+Drives GET / through the full middleware stack with a signed-in session and
+reports latency and SQL queries per request.  With the cache disabled every
+request re-reads the ``payments_user`` row; with it enabled only the session
+lookup is left.
+"""
+from __future__ import print_function
+
+import argparse
+
+from common import report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from payments import user_cache
+    from payments.models import User
+
+    user = User(name='bench', email='bench@example.com')
+    user.set_password('correct horse')
+    user.save()
+    session = SessionStore()
+    session['user'] = user.pk
+    session.save()
+
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    results = []
+    for label, size in (('uncached', 0), ('cached', 1024)):
+        settings.USER_PROFILE_CACHE = dict(settings.USER_PROFILE_CACHE,
+                                           SIZE=size)
+        user_cache.reset()
+        client.get('/')
+
+        with CaptureQueriesContext(connection) as queries:
+            latencies, elapsed, errors = run_concurrently(
+                lambda i: client.get('/').status_code == 200, args.requests
+            )
+        results.append(summarize(
+            label, latencies, elapsed, errors,
+            queries_per_request=round(len(queries) / float(args.requests), 2),
+        ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
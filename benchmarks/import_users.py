@@ -0,0 +1,90 @@
+"""Users per second imported by import_users versus a save() loop.
+
+    python benchmarks/import_users.py --rows 1000000 --pbkdf2-iterations 1000
+
+Writes ``--rows`` users to a CSV file and imports it with
+``payments.importer`` (what ``manage.py import_users`` runs), hashing across
+``--workers`` processes.  'save loop' is the one-at-a-time alternative,
+``User(...).set_password(...)`` and ``save()`` per user, timed on the first
+``--loop-sample`` rows only since at the configured cost it would take
+hours over a million.  Hashing dominates both, so lower
+``--pbkdf2-iterations`` for a quick run; the ratio is what matters.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import time
+
+from common import report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--loop-sample', type=int, default=2000)
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--pbkdf2-iterations', type=int, default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.pbkdf2_iterations:
+        from django_ecommerce import settings as project_settings
+        overrides['PASSWORD_HASHING'] = dict(
+            project_settings.PASSWORD_HASHING,
+            PBKDF2_ITERATIONS=args.pbkdf2_iterations,
+        )
+    tmp_dir = setup_django(**overrides)
+
+    from payments import importer
+    from payments.models import User
+
+    path = os.path.join(tmp_dir, 'users.csv')
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'email', 'password'])
+        for i in range(args.rows):
+            writer.writerow(['User %d' % i, 'user%d@example.com' % i,
+                             'password %d' % i])
+
+    sample = min(args.loop_sample, args.rows)
+    start = time.time()
+    for record in importer.read_records(path):
+        if sample == 0:
+            break
+        sample -= 1
+        user = User(name=record['name'], email=record['email'])
+        user.set_password(record['password'])
+        user.save()
+    loop_elapsed = time.time() - start
+    loop_rows = User.objects.count()
+    User.objects.all().delete()
+
+    start = time.time()
+    result = importer.import_users(
+        importer.read_records(path), chunk_size=args.chunk_size,
+        workers=args.workers,
+    )
+    elapsed = time.time() - start
+    assert result.created == args.rows, result
+
+    results = [
+        {'label': 'save loop', 'rows': loop_rows,
+         'seconds': round(loop_elapsed, 2),
+         'users_per_s': int(loop_rows / loop_elapsed)},
+        {'label': 'import_users', 'rows': result.created,
+         'seconds': round(elapsed, 2),
+         'users_per_s': int(result.created / elapsed),
+         'workers': args.workers},
+    ]
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
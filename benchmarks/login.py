@@ -0,0 +1,83 @@
+"""Sign-in throughput per CPU core for each password hasher configuration.
+
+    python benchmarks/login.py --logins 200 --pbkdf2-iterations 30000,10000
+
+Runs successful POST /sign_in requests on a single thread and divides by the
+process CPU time, so the result is logins per second per core.  The first
+login after switching configuration re-hashes the stored password and is not
+counted.  Argon2 rows are included when argon2-cffi is installed.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from common import (
+    UNLIMITED_SIGN_IN, report, run_concurrently, setup_django, summarize,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--pbkdf2-iterations', default='30000,10000')
+    parser.add_argument('--argon2-time-cost', default='2,1')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django(SIGN_IN_RATE_LIMIT=UNLIMITED_SIGN_IN)
+
+    from django.conf import settings
+    from django.test import Client
+    from django.test.utils import override_settings
+    from payments.models import User
+
+    configs = [
+        ('pbkdf2 i=%s' % n, 'pbkdf2', {'PBKDF2_ITERATIONS': int(n)})
+        for n in args.pbkdf2_iterations.split(',')
+    ]
+    try:
+        import argon2  # noqa
+    except ImportError:
+        pass
+    else:
+        configs += [
+            ('argon2 t=%s' % t, 'argon2', {'ARGON2_TIME_COST': int(t)})
+            for t in args.argon2_time_cost.split(',')
+        ]
+
+    user = User(name='bench', email='bench@example.com')
+    user.set_password('correct horse')
+    user.save()
+    credentials = {'email': user.email, 'password': 'correct horse'}
+    client = Client()
+
+    results = []
+    for label, hasher, params in configs:
+        preferred = settings.PASSWORD_HASHER_CHOICES[hasher]
+        with override_settings(
+            PASSWORD_HASHERS=[preferred] + [
+                h for h in settings.PASSWORD_HASHERS if h != preferred
+            ],
+            PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, **params),
+        ):
+            # re-hashes the stored password with this configuration
+            client.post('/sign_in', credentials)
+
+            cpu = time.process_time()
+            latencies, elapsed, errors = run_concurrently(
+                lambda i: client.post('/sign_in', credentials).status_code
+                == 302,
+                args.logins,
+            )
+            cpu = time.process_time() - cpu
+        results.append(summarize(
+            label, latencies, elapsed, errors,
+            logins_per_core_s=round(len(latencies) / cpu, 1),
+        ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Throughput of 1 to N worker processes sharing state in multi-node mode.
+
+    python benchmarks/multi_node.py --workers 4 --requests 300
+
+Each round forks ``n`` worker processes, standing in for ``n`` nodes, that
+share the database and, with DEPLOYMENT_MODE=multi, one SHARED_STATE store:
+a FileBasedCache directory (``--store file``, the default) or the memcached
+server at ``--memcached`` (``--store memcached``).  Only once they are
+running does the parent sign in ``--clients`` visitors, so those sessions
+exist nowhere but the shared store, and every worker then makes
+``--requests`` requests on them, alternating GET /edit (which needs the
+session) and GET /.  ``--store local`` runs the same rounds in single-node
+mode, where each process has caches of its own: the workers find none of
+the sessions, and every GET /edit is sent to sign in and counts as an error.
+
+Throughput counts all workers' requests over the time from the common start
+to the last one finishing; ``scaling`` divides it by the throughput of one
+worker, so it stays close to ``n`` for as long as there are idle cores
+(``cores`` below) and the shared store keeps up.
+"""
+from __future__ import print_function
+
+import argparse
+import atexit
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from common import UNLIMITED_SIGN_IN, report, setup_django, summarize
+
+
+def serve(jobs, ready, go, results):
+    """A worker: make the requests it is handed once ``go`` is set."""
+    from django.conf import settings
+    from django.db import connections
+    from django.test import Client
+
+    cookies, count = jobs.get()
+    clients = []
+    for value in cookies:
+        client = Client()
+        client.cookies[settings.SESSION_COOKIE_NAME] = value
+        clients.append(client)
+    ready.put(True)
+    go.wait()
+
+    latencies = []
+    errors = 0
+    for i in range(count):
+        client = clients[i % len(clients)]
+        start = time.time()
+        resp = client.get('/edit' if i % 2 else '/')
+        if resp.status_code == 200:
+            latencies.append(time.time() - start)
+        else:
+            errors += 1
+    connections.close_all()
+    results.put((latencies, errors, time.time()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=300,
+                        help='Requests made by each worker.')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--store', default='file',
+                        choices=['file', 'memcached', 'local'])
+    parser.add_argument('--memcached', default='127.0.0.1:11211')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    # read by settings.py, which setup_django() loads
+    # sessions only in the cache, not written through to the database
+    os.environ['SESSION_MODE'] = 'cache'
+    if args.store == 'local':
+        os.environ['DEPLOYMENT_MODE'] = 'single'
+    else:
+        os.environ['DEPLOYMENT_MODE'] = 'multi'
+    if args.store == 'memcached':
+        os.environ['SHARED_STATE_BACKEND'] = \
+            'django.core.cache.backends.memcached.MemcachedCache'
+        os.environ['SHARED_STATE_LOCATION'] = args.memcached
+    elif args.store == 'file':
+        # FileBasedCache is shared by every process on the host
+        os.environ['SHARED_STATE_BACKEND'] = \
+            'django.core.cache.backends.filebased.FileBasedCache'
+        location = tempfile.mkdtemp(prefix='ecommerce-bench-shared-')
+        atexit.register(shutil.rmtree, location, True)
+        os.environ['SHARED_STATE_LOCATION'] = location
+    setup_django(
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    )
+
+    from django.conf import settings
+    from django.db import connections
+    from django.test import Client
+    from payments.models import User
+
+    settings.SIGN_IN_RATE_LIMIT = dict(settings.SIGN_IN_RATE_LIMIT,
+                                       **UNLIMITED_SIGN_IN)
+    for i in range(args.clients):
+        user = User(name='bench %d' % i, email='bench-%d@example.com' % i)
+        user.set_password('correct horse')
+        user.save()
+
+    context = multiprocessing.get_context('fork')
+    results = []
+    baseline = None
+    for n in range(1, args.workers + 1):
+        # children must open connections of their own
+        connections.close_all()
+        jobs, ready, outcomes = (context.Queue(), context.Queue(),
+                                 context.Queue())
+        go = context.Event()
+        workers = [context.Process(target=serve,
+                                   args=(jobs, ready, go, outcomes))
+                   for _ in range(n)]
+        for worker in workers:
+            worker.start()
+
+        cookies = []
+        for i in range(args.clients):
+            client = Client()
+            client.post('/sign_in', {'email': 'bench-%d@example.com' % i,
+                                     'password': 'correct horse'})
+            cookies.append(
+                client.cookies[settings.SESSION_COOKIE_NAME].value)
+        for _ in workers:
+            jobs.put((cookies, args.requests))
+        for _ in workers:
+            ready.get()
+
+        start = time.time()
+        go.set()
+        latencies, errors, finished = [], 0, start
+        for _ in workers:
+            done, failed, end = outcomes.get()
+            latencies.extend(done)
+            errors += failed
+            finished = max(finished, end)
+        for worker in workers:
+            worker.join()
+
+        result = summarize('%d worker%s, %s store' % (
+            n, '' if n == 1 else 's', args.store),
+            latencies, finished - start, errors,
+            cores=multiprocessing.cpu_count())
+        if baseline is None:
+            baseline = result['throughput_rps']
+        result['scaling'] = round(
+            result['throughput_rps'] / baseline, 2) if baseline else 0
+        results.append(result)
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Anonymous home page throughput with the page cache off and on.
+
+    python benchmarks/page_cache.py --requests 5000
+
+Drives GET / through the full middleware stack as a visitor with no session,
+pinned to a single CPU where the platform allows it.  'off' renders
+index.html on every request; 'locmem' and 'filebased' serve it from the
+'pages' cache with each backend.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+
+from common import report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    tmp_dir = setup_django()
+
+    from django.conf import settings
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    def pages_cache(backend, location):
+        return dict(settings.CACHES, pages={
+            'BACKEND': backend, 'LOCATION': location,
+        })
+
+    configurations = [
+        ('off', settings.CACHES, dict(settings.PAGE_CACHE, PATHS=[])),
+        ('locmem', pages_cache(
+            'django.core.cache.backends.locmem.LocMemCache', 'pages',
+        ), settings.PAGE_CACHE),
+        ('filebased', pages_cache(
+            'django.core.cache.backends.filebased.FileBasedCache',
+            tempfile.mkdtemp(dir=tmp_dir),
+        ), settings.PAGE_CACHE),
+    ]
+    results = []
+    for label, caches, page_cache in configurations:
+        with override_settings(CACHES=caches, PAGE_CACHE=page_cache):
+            client = Client()
+            client.get('/')
+            latencies, elapsed, errors = run_concurrently(
+                lambda i: client.get('/').status_code == 200, args.requests
+            )
+        results.append(summarize(label, latencies, elapsed, errors))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Anonymous GET /register with and without template caching.
+
+    python benchmarks/register_page.py --requests 2000
+
+'uncached' parses every template from disk and renders every fragment on
+each request.  'cached loader' keeps compiled templates in memory (the
+production TEMPLATES setting); 'cached loader + fragments' also serves the
+form fields and card widgets from the 'template_fragments' cache.
+"""
+from __future__ import print_function
+
+import argparse
+import copy
+
+from common import report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    loaders = [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]
+    uncached = copy.deepcopy(settings.TEMPLATES)
+    uncached[0]['APP_DIRS'] = False
+    uncached[0]['OPTIONS']['loaders'] = loaders
+    cached = copy.deepcopy(uncached)
+    cached[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', loaders),
+    ]
+    no_fragments = dict(settings.CACHES, template_fragments={
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    })
+
+    configurations = [
+        ('uncached', uncached, no_fragments),
+        ('cached loader', cached, no_fragments),
+        ('cached loader + fragments', cached, settings.CACHES),
+    ]
+    results = []
+    for label, templates, caches in configurations:
+        with override_settings(TEMPLATES=templates, CACHES=caches):
+            client = Client()
+            client.get('/register')
+            latencies, elapsed, errors = run_concurrently(
+                lambda i: client.get('/register').status_code == 200,
+                args.requests, args.concurrency,
+            )
+        results.append(summarize(label, latencies, elapsed, errors))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Session throughput for each SESSION_MODE under concurrent clients.
+
+    python benchmarks/sessions.py --requests 2000 --concurrency 8
+
+Each worker thread keeps its own signed-in client and alternates between a
+session read (GET /) and a session write (POST /sign_in).  Passwords are
+hashed with MD5 here so that session storage, not the hasher, is what the
+numbers measure.  The database is a SQLite file, so the 'db' mode shows the
+cost of its single writer lock.
+"""
+from __future__ import print_function
+
+import argparse
+import threading
+
+from common import (
+    UNLIMITED_SIGN_IN, report, run_concurrently, setup_django, summarize,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django(
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        SIGN_IN_RATE_LIMIT=UNLIMITED_SIGN_IN,
+    )
+
+    from django.conf import settings
+    from django.test import Client
+    from payments.models import User
+
+    user = User(name='bench', email='bench@example.com')
+    user.set_password('correct horse')
+    user.save()
+    credentials = {'email': user.email, 'password': 'correct horse'}
+
+    results = []
+    for mode, engine in sorted(settings.SESSION_ENGINES.items()):
+        settings.SESSION_MODE = mode
+        settings.SESSION_ENGINE = engine
+        local = threading.local()
+
+        def hit(i):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+                client.post('/sign_in', credentials)
+            if i % 2:
+                return client.get('/').status_code == 200
+            return client.post('/sign_in', credentials).status_code == 302
+
+        latencies, elapsed, errors = run_concurrently(
+            hit, args.requests, args.concurrency
+        )
+        results.append(summarize(mode, latencies, elapsed, errors))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
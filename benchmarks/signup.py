@@ -0,0 +1,77 @@
+"""Signup latency: inline Stripe customer creation vs the provisioning queue.
+
+    python benchmarks/signup.py --requests 200 --concurrency 8 --stripe-latency 0.25
+
+Every POST /register goes through the real view, form and password hasher;
+only Stripe is replaced by a local stub with ``--stripe-latency`` seconds of
+delay per call.  For the queued mode the time the worker needs to drain the
+backlog is reported separately, since it no longer sits on the request path.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from common import StripeStub, report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--stripe-latency', type=float, default=0.25)
+    parser.add_argument(
+        '--fast-hasher', action='store_true',
+        help='Hash passwords with MD5 to isolate the cost of the Stripe call.',
+    )
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.fast_hasher:
+        overrides['PASSWORD_HASHERS'] = [
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]
+    setup_django(**overrides)
+    stub = StripeStub(latency=args.stripe_latency).start()
+
+    from django.conf import settings
+    from django.test import Client
+    from payments import provisioning
+    from payments.models import CustomerJob
+
+    results = []
+    for mode in (provisioning.INLINE, provisioning.QUEUED):
+        settings.STRIPE_CUSTOMER_PROVISIONING = mode
+
+        def signup(i):
+            resp = Client().post('/register', {
+                'name': 'bench user',
+                'email': 'bench-%s-%d@example.com' % (mode, i),
+                'password': 'correct horse',
+                'ver_password': 'correct horse',
+                'last_4_digits': '4242',
+                'stripe_token': 'tok_visa',
+            })
+            return resp.status_code == 302
+
+        latencies, elapsed, errors = run_concurrently(
+            signup, args.requests, args.concurrency
+        )
+        extra = {}
+        if mode == provisioning.QUEUED:
+            start = time.time()
+            while provisioning.run_pending(50):
+                pass
+            extra['drain_s'] = round(time.time() - start, 3)
+            extra['jobs_done'] = CustomerJob.objects.filter(
+                status=CustomerJob.DONE
+            ).count()
+        results.append(summarize(mode, latencies, elapsed, errors, **extra))
+
+    stub.stop()
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
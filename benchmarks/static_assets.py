@@ -0,0 +1,103 @@
+"""/register first and repeat loads with and without the asset pipeline.
+
+    python benchmarks/static_assets.py --loads 50
+
+A load fetches /register and then every local script it references, as a
+browser that accepts gzip and brotli would.  'without' is the page before
+``manage.py build_assets``: jquery.js and application.js are served
+uncompressed from STATIC_URL, and a repeat load revalidates each with
+If-Modified-Since.  'with' serves the built bundle precompressed, and a
+repeat load requests nothing but the page, since the bundle is immutable.
+``bytes`` counts the response bodies of one load.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import time
+
+from common import report, setup_django, summarize
+
+SCRIPT = re.compile(br'<script src="(/(?:static|assets)/[^"]+)"')
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--loads', type=int, default=50)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    tmp_dir = setup_django()
+
+    from django.conf import settings
+    from django.contrib.staticfiles.views import serve
+    from django.test import Client, RequestFactory
+    from main import assets
+
+    factory = RequestFactory()
+
+    def fetch(client, url, headers):
+        if url.startswith(settings.STATIC_URL):
+            # what runserver (or a plain file server) does for /static/
+            return serve(factory.get(url, **headers),
+                         url[len(settings.STATIC_URL):], insecure=True)
+        return client.get(url, **headers)
+
+    def page_load(client, cache):
+        """One visit; ``cache`` maps URL -> Last-Modified, or None for an
+        immutable response the browser will not ask for again."""
+        resp = client.get('/register')
+        size, requests = len(resp.content), 1
+        for url in SCRIPT.findall(resp.content):
+            url = url.decode('ascii')
+            if url in cache and cache[url] is None:
+                continue
+            headers = {'HTTP_ACCEPT_ENCODING': ACCEPT_ENCODING}
+            if cache.get(url):
+                headers['HTTP_IF_MODIFIED_SINCE'] = cache[url]
+            asset = fetch(client, url, headers)
+            requests += 1
+            if asset.streaming:
+                size += len(b''.join(asset.streaming_content))
+            else:
+                size += len(asset.content)
+            if 'immutable' in asset.get('Cache-Control', ''):
+                cache[url] = None
+            elif asset.status_code == 200:
+                cache[url] = asset.get('Last-Modified')
+        return size, requests
+
+    results = []
+    for mode in ('without', 'with'):
+        settings.STATIC_ASSETS = dict(
+            settings.STATIC_ASSETS, ROOT=os.path.join(tmp_dir, mode))
+        assets.reset()
+        if mode == 'with':
+            assets.build()
+        for visit in ('first', 'repeat'):
+            latencies = []
+            sizes = []
+            requests = []
+            for _ in range(args.loads):
+                client = Client()
+                cache = {}
+                if visit == 'repeat':
+                    page_load(client, cache)
+                start = time.time()
+                size, count = page_load(client, cache)
+                latencies.append(time.time() - start)
+                sizes.append(size)
+                requests.append(count)
+            results.append(summarize(
+                '%s pipeline, %s load' % (mode, visit), latencies,
+                sum(latencies), bytes=sizes[-1],
+                requests_per_load=requests[-1],
+            ))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Per-call Stripe latency: library default transport vs payments.stripe_client.
+
+    python benchmarks/stripe_transport.py --calls 500 --concurrency 16
+
+Both transports retrieve customers from a local Stripe stub.  The stock
+``stripe`` client builds a new session, and so a new connection, for every
+call; the pooled client reuses keep-alive connections from a bounded pool.
+The stub speaks plain HTTP, so the numbers understate the saving against the
+real API, where each new connection also costs a TLS handshake.
+
+A third run points the pooled client at a stub that is slower than the read
+timeout, to show the circuit breaker failing calls fast once it opens.
+"""
+from __future__ import print_function
+
+import argparse
+
+from common import StripeStub, report, run_concurrently, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--stripe-latency', type=float, default=0.005)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    setup_django(STRIPE_HTTP={
+        'POOL_SIZE': args.concurrency,
+        'READ_TIMEOUT': 0.5,
+        'FAILURE_THRESHOLD': 5,
+        'RECOVERY_TIMEOUT': 60,
+    })
+    import stripe
+    from payments import stripe_client
+
+    stub = StripeStub(latency=args.stripe_latency).start()
+    customer_id = stub.create_customer({'email': 'bench@example.com'})['id']
+
+    def retrieve(i):
+        stripe.Customer.retrieve(customer_id)
+
+    results = []
+
+    stripe.api_key = 'sk_test_bench'
+    stripe.default_http_client = None
+    seen = len(stub.connections)
+    results.append(summarize(
+        'default', *run_concurrently(retrieve, args.calls, args.concurrency),
+        connections=len(stub.connections) - seen
+    ))
+
+    stripe_client.api()
+    seen = len(stub.connections)
+    results.append(summarize(
+        'pooled', *run_concurrently(retrieve, args.calls, args.concurrency),
+        connections=len(stub.connections) - seen
+    ))
+    pooled_stats = stripe_client.stats()
+
+    # Stripe degraded: every call would block until the read timeout.
+    stub.latency = 1.0
+    latencies, elapsed, errors = run_concurrently(
+        retrieve, args.calls // 10, 1
+    )
+    stats = stripe_client.stats()
+    results.append(summarize(
+        'pooled-degraded', [], elapsed, errors,
+        mean_ms=round(elapsed / (args.calls // 10) * 1000, 2),
+        short_circuited=stats['circuit_rejected'],
+    ))
+    stub.stop()
+
+    report(results, args.json)
+    if not args.json:
+        print('\npool stats after the pooled run:', pooled_stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Stripe webhook replay: acknowledgement latency and batched apply rate.
+
+    python benchmarks/stripe_webhooks.py --events 100000 --concurrency 4
+
+Replays ``--events`` Stripe events (from ``--recording``, a file with one
+event JSON per line, or generated card, invoice and charge events for
+``--customers`` customers) against POST /payments/webhook, playing Stripe's
+part: every delivery is signed, and ``--redeliver`` of them are sent again,
+as Stripe does when it misses an acknowledgement.  'ingest' is the endpoint
+as Stripe sees it; 'apply' is ``apply_stripe_events`` draining the stored
+events.  ``suppressed_pct`` is the share of redeliveries that were dropped by
+the unique event id instead of being stored twice.
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import random
+import time
+
+from common import report, run_concurrently, setup_django, summarize
+
+SECRET = 'whsec_bench'
+
+
+def generate(count, customers, start):
+    rng = random.Random(0)
+    types = ['customer.source.updated', 'invoice.payment_succeeded',
+             'invoice.payment_failed', 'charge.succeeded']
+    for i in range(count):
+        customer = 'cus_%d' % rng.randrange(customers)
+        type = rng.choice(types)
+        obj = {'customer': customer}
+        if type == 'customer.source.updated':
+            obj.update(object='card', last4='%04d' % rng.randrange(10000))
+        yield {'id': 'evt_%d' % i, 'type': type, 'created': start + i,
+               'data': {'object': obj}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--recording')
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--redeliver', type=float, default=0.1)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    # TOLERANCE 0: a long replay outlives the signature timestamps' window
+    setup_django(STRIPE_WEBHOOK={'SECRET': SECRET, 'TOLERANCE': 0})
+
+    from django.test import Client
+    from payments import webhooks
+    from payments.models import StripeEvent, User
+
+    User.objects.bulk_create([
+        User(name='Customer %d' % i, email='customer%d@example.com' % i,
+             email_key='customer%d@example.com' % i, stripe_id='cus_%d' % i)
+        for i in range(args.customers)
+    ], batch_size=500)
+
+    if args.recording:
+        with io.open(args.recording, encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        events = events[:args.events]
+    else:
+        events = list(generate(args.events, args.customers,
+                               int(time.time()) - args.events))
+    payloads = [json.dumps(e).encode('utf-8') for e in events]
+    rng = random.Random(1)
+    deliveries = payloads + [p for p in payloads
+                             if rng.random() < args.redeliver]
+    rng.shuffle(deliveries)
+    redelivered = len(deliveries) - len(payloads)
+
+    def deliver(i):
+        payload = deliveries[i]
+        resp = Client().post(
+            '/payments/webhook', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=webhooks.sign(payload, SECRET),
+        )
+        return resp.status_code == 200
+
+    latencies, elapsed, errors = run_concurrently(
+        deliver, len(deliveries), args.concurrency
+    )
+    stored = StripeEvent.objects.count()
+    results = [summarize(
+        'ingest', latencies, elapsed, errors,
+        redelivered=redelivered,
+        suppressed_pct=round(
+            100.0 * (len(deliveries) - errors - stored) / redelivered, 1
+        ) if redelivered else 0,
+    )]
+
+    start = time.time()
+    applied = 0
+    while True:
+        count, _ = webhooks.process_batch(args.batch_size)
+        if not count:
+            break
+        applied += count
+    elapsed = time.time() - start
+    results.append({
+        'label': 'apply',
+        'events': applied,
+        'seconds': round(elapsed, 2),
+        'events_per_s': int(applied / elapsed) if elapsed else 0,
+    })
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,143 @@
+from collections import OrderedDict
+
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils.dateparse import parse_datetime
+
 from .models import ContactForm
 
+NEWER_VAR = 'newer'
+OLDER_VAR = 'older'
+
+# filtered changelists count at most this many rows
+COUNT_LIMIT = 1000
+
+
+def estimated_count(queryset):
+	"""Return ``(count, is_estimate)`` without a full ``COUNT(*)``.
+
+	An unfiltered table is sized from the planner's statistics on
+	PostgreSQL and from the id range elsewhere; a filtered queryset is
+	counted exactly, but only up to ``COUNT_LIMIT``.
+	"""
+	if queryset.query.where:
+		count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+		return min(count, COUNT_LIMIT), count > COUNT_LIMIT
+	connection = connections[queryset.db]
+	if connection.vendor == 'postgresql':
+		with connection.cursor() as cursor:
+			cursor.execute(
+				'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+				[queryset.model._meta.db_table]
+			)
+			return max(cursor.fetchone()[0], 0), True
+	# separate queries: SQLite answers a lone MIN or MAX from the index
+	high = queryset.order_by().aggregate(high=Max('pk'))['high']
+	if high is None:
+		return 0, False
+	low = queryset.order_by().aggregate(low=Min('pk'))['low']
+	return high - low + 1, True
+
+
+def encode_cursor(obj):
+	return '%s_%d' % (obj.timestamp.isoformat(), obj.pk)
+
+
+def decode_cursor(value):
+	timestamp, _, pk = value.rpartition('_')
+	timestamp = parse_datetime(timestamp)
+	if timestamp is None or not pk.isdigit():
+		raise IncorrectLookupParameters
+	return timestamp, int(pk)
+
+
+class KeysetChangeList(ChangeList):
+	"""Pages newest first by (timestamp, id) instead of OFFSET.
+
+	Instead of page numbers the changelist links to the rows newer than
+	its first row and older than its last, so every page is an index
+	range scan however deep it is.  The bare range condition on timestamp
+	is what lets the database seek the index; the OR only breaks ties.
+	"""
+
+	def get_filters_params(self, params=None):
+		lookup_params = super(KeysetChangeList, self).get_filters_params(params)
+		lookup_params.pop(NEWER_VAR, None)
+		lookup_params.pop(OLDER_VAR, None)
+		return lookup_params
+
+	def get_ordering(self, request, queryset):
+		return ['-timestamp', '-pk']
+
+	def get_ordering_field_columns(self):
+		columns = OrderedDict()
+		if 'timestamp' in self.list_display:
+			columns[self.list_display.index('timestamp')] = 'desc'
+		return columns
+
+	def get_results(self, request):
+		size = self.list_per_page
+		newer = request.GET.get(NEWER_VAR)
+		older = request.GET.get(OLDER_VAR)
+		if newer:
+			timestamp, pk = decode_cursor(newer)
+			rows = list(self.queryset.filter(timestamp__gte=timestamp).filter(
+				Q(timestamp__gt=timestamp) | Q(pk__gt=pk)
+			).order_by('timestamp', 'pk')[:size + 1])
+			has_newer, has_older = len(rows) > size, True
+			rows = rows[:size][::-1]
+		else:
+			queryset = self.queryset
+			if older:
+				timestamp, pk = decode_cursor(older)
+				queryset = queryset.filter(timestamp__lte=timestamp).filter(
+					Q(timestamp__lt=timestamp) | Q(pk__lt=pk)
+				)
+			rows = list(queryset[:size + 1])
+			has_newer, has_older = bool(older), len(rows) > size
+			rows = rows[:size]
+
+		remove = [NEWER_VAR, OLDER_VAR]
+		self.newer_query = self.older_query = None
+		if rows and has_newer:
+			self.newer_query = self.get_query_string(
+				{NEWER_VAR: encode_cursor(rows[0])}, remove)
+		if rows and has_older:
+			self.older_query = self.get_query_string(
+				{OLDER_VAR: encode_cursor(rows[-1])}, remove)
+
+		self.result_count, estimate = estimated_count(self.queryset)
+		filtered = bool(self.queryset.query.where)
+		self.count_is_lower_bound = estimate and filtered
+		self.count_is_estimate = estimate and not filtered
+		self.show_full_result_count = False
+		self.show_admin_actions = True
+		self.full_result_count = None
+		self.result_list = rows
+		self.can_show_all = False
+		self.multi_page = self.newer_query or self.older_query
+		self.paginator = None
+
 
 class ContactFormAdmin(admin.ModelAdmin):
+	list_display = ('email', 'name', 'topic', 'timestamp')
+	search_fields = ('email',)
+	show_full_result_count = False
+
+	def get_changelist(self, request, **kwargs):
+		return KeysetChangeList
+
+	def get_search_results(self, request, queryset, search_term):
+		# an exact match uses the email index; icontains would scan
+		search_term = search_term.strip()
+		if not search_term:
+			return queryset, False
+		return queryset.filter(email=search_term), False
+
 	class Meta:
 		model = ContactForm
 
-admin.site.register(ContactForm, ContactFormAdmin)
\ No newline at end of file
+admin.site.register(ContactForm, ContactFormAdmin)
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from contact import spool
+
+
+class Command(BaseCommand):
+    help = 'Load contact submissions spooled by the contact view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Rows per bulk_create (default CONTACT_INGESTION BATCH_SIZE).',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to sleep between flushes.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Flush what is currently spooled and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stored, duplicates = spool.get_spool().flush(
+                options['batch_size']
+            )
+            if stored or duplicates:
+                self.stdout.write(
+                    'Stored %d submission(s), dropped %d duplicate(s)'
+                    % (stored, duplicates)
+                )
+            if options['once']:
+                return
+            time.sleep(options['interval'])
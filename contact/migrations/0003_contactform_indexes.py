@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contact', '0002_contactform_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='contactform',
+            index_together=set([('timestamp', 'id'), ('email', 'timestamp')]),
+        ),
+    ]
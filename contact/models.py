@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import datetime
 
 class ContactForm(models.Model):
@@ -6,12 +7,15 @@ class ContactForm(models.Model):
 	email = models.EmailField(max_length=250)
 	topic = models.CharField(max_length=200)
 	message = models.CharField(max_length=1000)
+	# not auto_now_add, so spooled submissions keep the time they were sent
 	timestamp = models.DateTimeField(
-		auto_now_add=True
+		default=timezone.now, editable=False
 	)
 
 	def __unicode__(self):
 		return self.email
 
 	class Meta:
-		ordering = ['-timestamp']
\ No newline at end of file
+		ordering = ['-timestamp']
+		# the admin pages through (timestamp, id) and searches by email
+		index_together = [['timestamp', 'id'], ['email', 'timestamp']]
\ No newline at end of file
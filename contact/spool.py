@@ -0,0 +1,238 @@
+"""Write-behind spool for contact form submissions.
+
+With ``CONTACT_INGESTION['MODE']`` set to 'spooled' the contact view appends
+each validated submission to a JSON-lines file in ``SPOOL_DIR`` instead of
+writing to the database.  An append returns once its line has been fsynced;
+appends that arrive while an fsync is in progress share the next one, so a
+burst of submissions costs a handful of fsyncs rather than one write
+transaction each.
+
+``manage.py flush_contact_spool`` moves the spool aside and loads it into
+``ContactForm`` with ``bulk_create``, dropping submissions whose email and
+message hash are already stored.  Because of that check a segment that was
+loaded but not yet removed (say the flusher died in between) is harmless to
+load again.
+
+Writers in several processes can share one ``SPOOL_DIR``: every append holds
+an flock on the spool file and reopens it if the flusher has moved it away.
+"""
+import errno
+import fcntl
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+DEFAULTS = {
+    'MODE': 'direct',
+    'SPOOL_DIR': 'spool',
+    'BATCH_SIZE': 500,
+}
+
+ACTIVE = 'contact.spool'
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'CONTACT_INGESTION', {}))
+
+
+def is_spooled():
+    return _conf()['MODE'] == 'spooled'
+
+
+def get_spool():
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = Spool(_conf()['SPOOL_DIR'])
+        return _spool
+
+
+def reset():
+    """Close the spool file, e.g. after changing ``CONTACT_INGESTION``."""
+    global _spool
+    with _spool_lock:
+        if _spool is not None:
+            _spool.close()
+        _spool = None
+
+
+def submit(cleaned_data):
+    """Durably spool one validated ``ContactView`` submission."""
+    record = dict(
+        (name, cleaned_data[name])
+        for name in ('name', 'email', 'topic', 'message')
+    )
+    record['timestamp'] = timezone.now().isoformat()
+    get_spool().append(record)
+
+
+def digest(email, message):
+    return (email, hashlib.sha1(message.encode('utf-8')).hexdigest())
+
+
+@contextmanager
+def _flocked(f):
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Spool(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, ACTIVE)
+        self._file = None
+        self._lock = threading.Lock()  # guards _file and _written
+        self._synced_cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+
+    def append(self, record):
+        data = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            while True:
+                if self._file is None or not self._is_current():
+                    self._reopen()
+                with _flocked(self._file):
+                    # the flusher may have moved the file before we locked
+                    if self._is_current():
+                        self._file.write(data)
+                        self._file.flush()
+                        break
+            self._written += 1
+            seq = self._written
+        self._wait_synced(seq)
+
+    def _is_current(self):
+        try:
+            return (os.fstat(self._file.fileno()).st_ino ==
+                    os.stat(self.path).st_ino)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+    def _reopen(self):
+        if self._file is not None:
+            # lines written to a moved file must be durable too
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._file = io.open(self.path, 'ab')
+
+    def _wait_synced(self, seq):
+        with self._synced_cond:
+            while self._synced < seq:
+                if self._syncing:
+                    self._synced_cond.wait()
+                    continue
+                # become the leader: one fsync covers every line written
+                # so far, including those of the threads now waiting
+                self._syncing = True
+                self._synced_cond.release()
+                try:
+                    with self._lock:
+                        target = self._written
+                        if self._file is not None:
+                            os.fsync(self._file.fileno())
+                finally:
+                    self._synced_cond.acquire()
+                    self._syncing = False
+                    self._synced_cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def rotate(self):
+        """Move the spool file aside as a segment for ``flush`` to load."""
+        try:
+            f = io.open(self.path, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        with f, _flocked(f):
+            segment = '%s.%016d' % (self.path, int(time.time() * 1000000))
+            try:
+                os.rename(self.path, segment)
+            except OSError as e:
+                # another flusher got there first
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def segments(self):
+        return sorted(glob.glob(self.path + '.*'))
+
+    def flush(self, batch_size=None):
+        """Load every segment into ``ContactForm``.
+
+        Returns ``(stored, duplicates)``.
+        """
+        batch_size = batch_size or _conf()['BATCH_SIZE']
+        self.rotate()
+        stored = duplicates = 0
+        for segment in self.segments():
+            records = list(_read(segment))
+            for start in range(0, len(records), batch_size):
+                s, d = _store(records[start:start + batch_size])
+                stored += s
+                duplicates += d
+            os.remove(segment)
+        return stored, duplicates
+
+
+def _read(segment):
+    with io.open(segment, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except ValueError:
+                # a line torn by a crash mid-append was never acknowledged
+                continue
+
+
+def _store(records):
+    from contact.models import ContactForm
+
+    emails = set(r['email'] for r in records)
+    seen = set(
+        digest(email, message) for email, message in
+        ContactForm.objects.filter(
+            email__in=emails
+        ).values_list('email', 'message')
+    )
+    rows = []
+    for r in records:
+        key = digest(r['email'], r['message'])
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append(ContactForm(
+            name=r['name'], email=r['email'], topic=r['topic'],
+            message=r['message'], timestamp=parse_datetime(r['timestamp']),
+        ))
+    with transaction.atomic():
+        ContactForm.objects.bulk_create(rows)
+    return len(rows), len(records) - len(rows)
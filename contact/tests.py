@@ -1,3 +1,136 @@
 from django.test import TestCase
 
 # Create your tests here.
+
+import shutil
+import tempfile
+import threading
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.test import RequestFactory, override_settings
+from . import spool
+from .models import ContactForm
+from .views import contact
+import datetime
+import json
+import mock
+from io import StringIO
+from django.contrib.auth.models import User as AdminUser
+from django.core.management import call_command
+from django.utils import timezone
+from .admin import ContactFormAdmin
+
+class SpooledContactTests(TestCase):
+
+	def setUp(self):
+		self.spool_dir = tempfile.mkdtemp()
+		self.settings = override_settings(CONTACT_INGESTION={
+			'MODE': 'spooled', 'SPOOL_DIR': self.spool_dir,
+		})
+		self.settings.enable()
+		spool.reset()
+
+	def tearDown(self):
+		spool.reset()
+		self.settings.disable()
+		shutil.rmtree(self.spool_dir)
+
+	def post(self, email='spam@example.com', message='Buy now'):
+		request = RequestFactory().post('/contact/', {
+			'name': 'Sam', 'email': email, 'topic': 'Hi', 'message': message,
+		})
+		request.session = {}
+		request._messages = FallbackStorage(request)
+		return contact(request)
+
+	def test_submission_is_stored_on_flush(self):
+		self.assertEqual(self.post().status_code, 302)
+		self.assertEqual(ContactForm.objects.count(), 0)
+
+		self.assertEqual(spool.get_spool().flush(), (1, 0))
+		self.assertEqual(ContactForm.objects.get().email, 'spam@example.com')
+		self.assertEqual(spool.get_spool().segments(), [])
+
+	def test_repeated_submissions_are_dropped(self):
+		self.post()
+		self.post()
+		self.post(message='Buy later')
+		self.assertEqual(spool.get_spool().flush(), (2, 1))
+
+		self.post()
+		self.assertEqual(spool.get_spool().flush(), (0, 1))
+		self.assertEqual(ContactForm.objects.count(), 2)
+
+	def test_concurrent_submissions_are_all_spooled(self):
+		threads = [
+			threading.Thread(target=spool.submit, args=({
+				'name': 'Sam', 'email': 'user%d@example.com' % i,
+				'topic': 'Hi', 'message': 'Hello',
+			},))
+			for i in range(20)
+		]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(spool.get_spool().flush(), (20, 0))
+
+	def test_writer_reopens_a_rotated_spool(self):
+		self.post(email='first@example.com')
+		spool.get_spool().rotate()
+		self.post(email='second@example.com')
+
+		self.assertEqual(len(spool.get_spool().segments()), 1)
+		self.assertEqual(spool.get_spool().flush(), (2, 0))
+
+
+class ContactFormPagingTests(TestCase):
+
+	def setUp(self):
+		start = timezone.now()
+		for i in range(5):
+			ContactForm.objects.create(
+				name='Sam', email='user%d@example.com' % i, topic='Hi',
+				message='Message %d' % i,
+				timestamp=start + datetime.timedelta(minutes=i),
+			)
+		admin_user = AdminUser.objects.create_superuser(
+			'admin', 'admin@example.com', 'password'
+		)
+		self.client.force_login(admin_user)
+
+	def emails(self, resp):
+		return [c.email for c in resp.context['cl'].result_list]
+
+	@mock.patch.object(ContactFormAdmin, 'list_per_page', 2)
+	def test_changelist_pages_by_keyset(self):
+		resp = self.client.get('/admin/contact/contactform/')
+		self.assertEqual(self.emails(resp),
+			['user4@example.com', 'user3@example.com'])
+		self.assertContains(resp, 'about 5 contact forms')
+
+		older = resp.context['cl'].older_query
+		resp = self.client.get('/admin/contact/contactform/' + older)
+		self.assertEqual(self.emails(resp),
+			['user2@example.com', 'user1@example.com'])
+
+		newer = resp.context['cl'].newer_query
+		resp = self.client.get('/admin/contact/contactform/' + newer)
+		self.assertEqual(self.emails(resp),
+			['user4@example.com', 'user3@example.com'])
+		self.assertIsNone(resp.context['cl'].newer_query)
+
+	def test_search_matches_exact_email(self):
+		resp = self.client.get('/admin/contact/contactform/',
+			{'q': 'user2@example.com'})
+		self.assertEqual(self.emails(resp), ['user2@example.com'])
+
+	def test_export_streams_in_chunks(self):
+		out = StringIO()
+		with self.assertNumQueries(3):
+			call_command('export_contacts', format='jsonl', chunk_size=2,
+				stdout=out)
+
+		rows = [json.loads(line) for line in out.getvalue().splitlines()]
+		self.assertEqual([r['email'] for r in rows],
+			['user%d@example.com' % i for i in range(5)])
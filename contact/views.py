@@ -1,4 +1,5 @@
 from .forms import ContactView
+from . import spool
 from django.contrib import messages
 from django.shortcuts import render, redirect
 
@@ -8,8 +9,11 @@ def contact(request):
 	if request.method == 'POST':
 		form = ContactView(request.POST)
 		if form.is_valid():
-			our_form = form.save(commit=False)
-			our_form.save()
+			if spool.is_spooled():
+				spool.submit(form.cleaned_data)
+			else:
+				our_form = form.save(commit=False)
+				our_form.save()
 			messages.add_message(
 				request, messages.INFO, 'Your message has been sent. Thank you.'
 			)
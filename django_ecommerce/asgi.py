@@ -0,0 +1,21 @@
+"""
+ASGI config for django_ecommerce project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, for an ASGI 3 server such as uvicorn:
+
+    uvicorn django_ecommerce.asgi:application
+
+See django_ecommerce/asgi_handler.py for how requests are served.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_ecommerce.settings")
+django.setup(set_prefix=False)
+
+from django_ecommerce.asgi_handler import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
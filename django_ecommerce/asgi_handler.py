@@ -0,0 +1,185 @@
+"""An ASGI 3 application serving this project's Django views.
+
+Django 1.10 has no ASGI support of its own, so ``ASGIHandler`` serves each
+request the way a threaded WSGI server would, through a ``WSGIHandler`` on
+a bounded pool of ``ASGI['THREADS']`` threads, with one difference: the
+Stripe calls of views decorated with ``stripe_client.deferrable`` (register
+and edit) are made on the event loop by ``payments.stripe_async``, and no
+thread waits for them.  The view is served once to find its call, which is
+then made asynchronously while the thread serves other requests, and once
+more with Stripe's response; see payments/stripe_client.py.
+
+So the thread pool bounds the requests doing database and template work at
+any moment, not those waiting for Stripe, and one process can hold as many
+signups in flight as ``ASGI['STRIPE_CONNECTIONS']`` allows.  Python 3 only.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+
+from payments import stripe_client
+
+DEFAULTS = {
+    'THREADS': 10,
+    'STRIPE_CONNECTIONS': 100,
+    # requests with a larger body are refused with a 413
+    'MAX_BODY': 10 * 1024 * 1024,
+    # a view making more Stripe calls than this fails with a 500
+    'MAX_STRIPE_CALLS': 4,
+}
+
+# returned by read_body() when the client went away mid-request
+DISCONNECTED = object()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'ASGI', {}))
+
+
+class ASGIHandler(object):
+
+    def __init__(self):
+        self.wsgi = WSGIHandler()
+        self._executor = None
+        self._stripe = None
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=_conf()['THREADS'])
+        return self._executor
+
+    def stripe(self):
+        if self._stripe is None:
+            from payments.stripe_async import AsyncStripeClient
+            http = dict(stripe_client.DEFAULTS,
+                        **getattr(settings, 'STRIPE_HTTP', {}))
+            self._stripe = AsyncStripeClient(
+                _conf()['STRIPE_CONNECTIONS'], http['CONNECT_TIMEOUT'],
+                http['READ_TIMEOUT'])
+        return self._stripe
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Cannot serve %r connections' % scope['type'])
+
+        body = await self.read_body(receive)
+        if body is DISCONNECTED:
+            # nobody to answer, and a truncated form must not be served
+            return
+        if body is None:
+            return await self.send_response(send, 413, [], b'')
+
+        loop = asyncio.get_event_loop()
+        responses = []
+        while True:
+            environ = self.environ(scope, body, responses)
+            status, headers, content, deferred = await loop.run_in_executor(
+                self.executor(), self.serve, environ)
+            if deferred is None:
+                break
+            if len(responses) >= _conf()['MAX_STRIPE_CALLS']:
+                status, headers, content = 500, [], b''
+                break
+            try:
+                responses.append(await self.stripe().request(
+                    deferred.method, deferred.url, deferred.headers,
+                    deferred.post_data))
+            except stripe.error.StripeError as e:
+                # raised by the view's call(), as it would be if threaded
+                responses.append(e)
+        await self.send_response(send, status, headers, content)
+
+    async def read_body(self, receive):
+        limit = _conf()['MAX_BODY']
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return DISCONNECTED
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def send_response(self, send, status, headers, content):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._stripe is not None:
+                    self._stripe.close()
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def environ(self, scope, body, responses):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI carries the path's bytes as latin-1
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            stripe_client.DEFER: True,
+            stripe_client.RESPONSES: responses,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+        # the whole body has been read, whether or not it came chunked
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return environ
+
+    def serve(self, environ):
+        """Run the request through Django; on a pool thread."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (k.encode('latin-1'), v.encode('latin-1'))
+                for k, v in headers]
+
+        response = self.wsgi(environ, start_response)
+        try:
+            deferred = getattr(response, 'deferred', None)
+            content = b'' if deferred else b''.join(response)
+        finally:
+            # sends request_finished, which returns the DB connection
+            response.close()
+        return started['status'], started['headers'], content, deferred
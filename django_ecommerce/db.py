@@ -0,0 +1,59 @@
+"""Runtime side of the database profiles configured in settings.py.
+
+* ``configure_sqlite`` applies ``SQLITE_PRAGMAS`` to every new SQLite
+  connection (WAL journaling, a busy timeout, relaxed fsync).
+* ``check_persistent_connections`` drops reused connections the server has
+  closed underneath us before a request can fail on them.
+* ``PrimaryReplicaRouter`` sends reads to the ``replica`` alias, except that a
+  thread which has written stays on the primary until its request finishes,
+  so users always read their own writes.
+"""
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+_state = threading.local()
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if connection.settings_dict['NAME'] == ':memory:':
+        pragmas = dict(pragmas)
+        pragmas.pop('journal_mode', None)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def check_persistent_connections(**kwargs):
+    if not getattr(settings, 'DATABASE_HEALTH_CHECKS', False):
+        return
+    for conn in connections.all():
+        if conn.connection is not None and not conn.in_atomic_block:
+            if not conn.is_usable():
+                conn.close()
+
+
+def unpin_primary(**kwargs):
+    _state.pinned = False
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'pinned', False):
+            return 'default'
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -1,5 +1,8 @@
 import os
 import sys
+
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -31,21 +34,51 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'main.middleware.MetricsMiddleware',
+    'main.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'payments.middleware.UserProfileMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
+    'main.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware',
+    'main.middleware.FlatpageFallbackMiddleware',
 ]
 
 ROOT_URLCONF = 'django_ecommerce.urls'
 
+# Management commands that cron runs and that never serve a request start
+# with a lean profile: no admin, messages or staticfiles apps, no middleware
+# and a URLconf without views (django_ecommerce/urls_lean.py), so neither
+# they nor the system checks before them import the views, the admin modules
+# or the Stripe SDK.  SETTINGS_PROFILE=full or lean overrides the choice;
+# `manage.py startup_profile` reports what each profile imports.
+LEAN_COMMANDS = [
+    'apply_stripe_events', 'calibrate_hashers', 'export_contacts',
+    'flush_contact_spool', 'import_users', 'provision_customers',
+    'send_dunning_notices', 'sweep_sessions', 'sync_stripe_mirror',
+]
+SETTINGS_PROFILE = os.environ.get('SETTINGS_PROFILE', 'lean' if (
+    os.path.basename(sys.argv[0]) == 'manage.py' and
+    len(sys.argv) > 1 and sys.argv[1] in LEAN_COMMANDS
+) else 'full')
+if SETTINGS_PROFILE == 'lean':
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+        'django.contrib.admin',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    )]
+    MIDDLEWARE = []
+    ROOT_URLCONF = 'django_ecommerce.urls_lean'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for main.metrics
+        'BACKEND': 'main.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,22 +92,242 @@ TEMPLATES = [
     },
 ]
 
+# Outside of development keep compiled templates in memory instead of
+# reading and parsing them again on every render.
+if not DEBUG:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'django_ecommerce.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
+#
+# DATABASE_PROFILE selects 'sqlite' (the default) or 'postgres'.  Both keep
+# connections open for DATABASE_CONN_MAX_AGE seconds.  SQLite connections get
+# SQLITE_PRAGMAS applied as they are opened (see django_ecommerce/db.py);
+# PostgreSQL connections are health-checked at the start of each request, and
+# setting DATABASE_REPLICA_HOST routes reads to that server.
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'ecommerce'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        }
+    }
+    if os.environ.get('DATABASE_REPLICA_HOST'):
+        DATABASES['replica'] = dict(
+            DATABASES['default'],
+            HOST=os.environ['DATABASE_REPLICA_HOST'],
+            PORT=os.environ.get('DATABASE_REPLICA_PORT',
+                                DATABASES['default']['PORT']),
+            TEST={'MIRROR': 'default'},
+        )
+        DATABASE_ROUTERS = ['django_ecommerce.db.PrimaryReplicaRouter']
+    DATABASE_HEALTH_CHECKS = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        }
     }
+    DATABASE_HEALTH_CHECKS = False
+
+# WAL lets readers proceed while a write is in progress, busy_timeout makes
+# writers queue for the lock instead of failing with "database is locked",
+# and synchronous=NORMAL is durable in WAL mode with far fewer fsyncs.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
 }
 
 if 'test' in sys.argv or 'test_coverage' in sys.argv:
     DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
 
+# DEPLOYMENT_MODE 'single' (the default) keeps caches, sign in rate limits
+# and locks in each process's memory.  'multi' runs several nodes behind a
+# load balancer: every alias in CACHES moves onto the SHARED_STATE backend
+# under its own key prefix, sessions are cached there (SESSION_MODE defaults
+# to 'cached_db', so an eviction or a restart signs nobody out), and rate
+# limit buckets, locks (main/locks.py) and user profile and flatpage
+# invalidations go through its 'default' alias.  BACKEND is any Django cache
+# backend every node can reach: memcached in production (through
+# python-memcached), with LOCATION 'host:port' (';' between servers);
+# FileBasedCache and a directory for processes on one host; or LocMemCache
+# as an in-process stand-in for tests.  The nodes must share a database too,
+# so use DATABASE_PROFILE=postgres.
+DEPLOYMENT_MODE = os.environ.get('DEPLOYMENT_MODE', 'single')
+MULTI_NODE = DEPLOYMENT_MODE == 'multi'
+SHARED_STATE = {
+    'BACKEND': os.environ.get(
+        'SHARED_STATE_BACKEND',
+        'django.core.cache.backends.memcached.MemcachedCache'
+    ),
+    'LOCATION': os.environ.get('SHARED_STATE_LOCATION', '127.0.0.1:11211'),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': os.environ.get(
+            'SESSION_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', 'sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # whole pages for anonymous visitors, see PAGE_CACHE below
+    'pages': {
+        'BACKEND': os.environ.get(
+            'PAGE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('PAGE_CACHE_LOCATION', 'pages'),
+    },
+    # rendered {% cache %} fragments, such as the card form on /register
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+    },
+}
+if MULTI_NODE:
+    CACHES = dict(
+        (alias, dict(SHARED_STATE, KEY_PREFIX=alias)) for alias in CACHES
+    )
+
+# Where sessions live.  'db' reads and writes django_session on every
+# session access; 'cached_db' serves reads from the 'sessions' cache and
+# writes through to the database; 'cache' keeps them only in the cache (use a
+# shared backend such as memcached when running more than one process);
+# 'signed_cookies' stores them client-side and needs no server storage.
+# `manage.py sweep_sessions` removes expired sessions for whichever is set.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = os.environ.get('SESSION_MODE',
+                              'cached_db' if MULTI_NODE else 'db')
+if SESSION_MODE not in SESSION_ENGINES:
+    raise ImproperlyConfigured('SESSION_MODE must be one of %s, not %r' % (
+        ', '.join(sorted(SESSION_ENGINES)), SESSION_MODE))
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Messages (such as the contact form's thank you) travel in a cookie and
+# only overflow into the session, so they follow the visitor to any node.
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+# How contact form submissions reach the database.  'direct' saves each one
+# in the request; 'spooled' appends it to a file in SPOOL_DIR and returns once
+# that is fsynced, and `manage.py flush_contact_spool` bulk-loads the spool,
+# dropping repeats of an email and message already stored.
+CONTACT_INGESTION = {
+    'MODE': os.environ.get('CONTACT_INGESTION', 'direct'),
+    'SPOOL_DIR': os.environ.get(
+        'CONTACT_SPOOL_DIR', os.path.join(BASE_DIR, 'spool', 'contact')
+    ),
+    'BATCH_SIZE': 500,
+}
+
+# Rendered flatpages kept in memory per process (see main/flatpages.py).
+# SHARED_CACHE carries changes to pages between processes.
+FLATPAGE_CACHE = {
+    'RENDERED_SIZE': 256,
+    'SHARED_CACHE': 'default' if MULTI_NODE else None,
+}
+
+# Pages served from the 'pages' cache to visitors with no user in their
+# session (see main/middleware.py).  The cache is cleared whenever a FlatPage
+# is saved or deleted.  Set PAGE_CACHE_BACKEND to
+# django.core.cache.backends.filebased.FileBasedCache and PAGE_CACHE_LOCATION
+# to a directory to share cached pages between processes on one host.
+# SHARED_STORE makes clearing retire the cached pages rather than flush a
+# store that also holds sessions.
+PAGE_CACHE = {
+    'CACHE': 'pages',
+    'TIMEOUT': 600,
+    'PATHS': [r'^/$', r'^/pages/'],
+    'SHARED_STORE': MULTI_NODE,
+}
+
+# gzip (or, with the `brotli` package installed, brotli) for responses of
+# TYPES at least MIN_SIZE bytes long (see main/compression.py).  Pages that
+# used the CSRF token are only gzipped, with up to MAX_PADDING random bytes
+# in the gzip header against BREACH; CSRF_PAGES = 'skip' leaves them
+# uncompressed.
+COMPRESSION = {
+    'MIN_SIZE': 200,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'CSRF_PAGES': 'pad',
+    'MAX_PADDING': 64,
+}
+
+# ETags for the index and for flatpages are built from what the page shows
+# and a digest of the templates and asset bundles (see main/conditional.py).
+# Set RELEASE to the deployed version if a deploy can change pages otherwise.
+CONDITIONAL_GET = {
+    'RELEASE': os.environ.get('RELEASE', ''),
+}
+
+# Password hashing.  PASSWORD_HASHER picks the hasher for new passwords;
+# hashes made by the others (or with a different cost) still verify and are
+# upgraded on the user's next successful sign in.  'argon2' needs the
+# argon2-cffi package.  Run `manage.py calibrate_hashers` to size the costs
+# in PASSWORD_HASHING for this machine.
+PASSWORD_HASHER_CHOICES = {
+    'pbkdf2': 'payments.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'payments.hashers.TunedArgon2PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_CHOICES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in sorted(PASSWORD_HASHER_CHOICES.items())
+    if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': 30000,
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 512,  # KiB
+    'ARGON2_PARALLELISM': 2,
+}
+
+# Token buckets guarding sign_in (see payments/ratelimit.py).  Set CACHE to
+# a CACHES alias to share buckets between processes, and LOCK to update them
+# under a lock in that cache.
+SIGN_IN_RATE_LIMIT = {
+    'PER_IP': {'CAPACITY': 30, 'REFILL_PER_MINUTE': 10},
+    'PER_EMAIL': {'CAPACITY': 10, 'REFILL_PER_MINUTE': 2},
+    'CACHE': 'default' if MULTI_NODE else None,
+    'LOCK': MULTI_NODE,
+    'SIZE': 100000,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -112,5 +365,122 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 
 STATIC_URL = '/static/'
 
+# Script bundles built by `manage.py build_assets` (see main/assets.py) into
+# ROOT as content-hashed, precompressed files, served under /assets/ with a
+# far-future immutable Cache-Control.  Until a build exists, {% bundle %}
+# links the source files from STATIC_URL instead.  Install `brotli` for .br
+# copies and `rjsmin` to minify scripts that have no .min.js sibling.
+STATIC_ASSETS = {
+    'ROOT': os.path.join(BASE_DIR, 'assets'),
+    'BUNDLES': {
+        'app.js': ['jquery.js', 'application.js'],
+    },
+    'MAX_AGE': 365 * 24 * 60 * 60,
+}
+
 STRIPE_SECRET = 'sk_test_qpvBp3JttraDkfIGEQo2UmRK'
-STRIPE_PUBLISHABLE = 'pk_test_FQXZZQklPmSZ2V7xxtI0Kh5g'
\ No newline at end of file
+STRIPE_PUBLISHABLE = 'pk_test_FQXZZQklPmSZ2V7xxtI0Kh5g'
+
+# Stripe customer provisioning for new signups: 'inline' creates the customer
+# during the register request, 'queued' saves the user as pending and leaves
+# the Stripe call to `manage.py provision_customers`.
+STRIPE_CUSTOMER_PROVISIONING = os.environ.get(
+    'STRIPE_CUSTOMER_PROVISIONING', 'queued'
+)
+STRIPE_PROVISIONING_MAX_ATTEMPTS = 5
+STRIPE_PROVISIONING_RETRY_DELAY = 30  # seconds, doubled after each failure
+
+# Reminders for UnpaidUsers, sent by `manage.py send_dunning_notices` (see
+# payments/dunning.py) once a row's last notice is INTERVAL seconds old.
+# TRANSPORT is a class with a send(rows) method; the default emails each
+# user through EMAIL_BACKEND.
+DUNNING = {
+    'INTERVAL': 7 * 24 * 60 * 60,
+    'LEASE': 5 * 60,
+    'BATCH_SIZE': 500,
+    'TRANSPORT': 'payments.dunning.EmailTransport',
+    'FROM_EMAIL': 'billing@example.com',
+}
+
+# Stripe webhooks (see payments/webhooks.py). SECRET is the endpoint's
+# signing secret from the Stripe dashboard; POST /payments/webhook refuses
+# every event until it is set. Stored events are applied by
+# `manage.py apply_stripe_events`, BATCH_SIZE at a time.
+STRIPE_WEBHOOK = {
+    'SECRET': os.environ.get('STRIPE_WEBHOOK_SECRET', ''),
+    'TOLERANCE': 300,
+    'LEASE': 5 * 60,
+    'BATCH_SIZE': 500,
+}
+
+# Local mirror of Stripe customers (see payments/stripe_mirror.py), filled
+# by `manage.py sync_stripe_mirror` and kept current by webhooks. With
+# MAX_AGE set, rows older than that many seconds are re-read from Stripe.
+STRIPE_MIRROR = {
+    'MAX_AGE': None,
+    'PAGE_SIZE': 100,
+    'WORKERS': 4,
+}
+
+# Shared transport for Stripe API calls (see payments/stripe_client.py).
+STRIPE_HTTP = {
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 30,
+    'FAILURE_THRESHOLD': 5,
+    'RECOVERY_TIMEOUT': 30,
+}
+
+# The ASGI entry point (django_ecommerce/asgi.py) serves requests on THREADS
+# threads, but makes the Stripe calls of register and edit on its event loop
+# over at most STRIPE_CONNECTIONS keep-alive connections, so waiting for
+# Stripe holds no thread (see django_ecommerce/asgi_handler.py).
+ASGI = {
+    'THREADS': 10,
+    'STRIPE_CONNECTIONS': 100,
+}
+
+# Cache behind User.get_by_id and request.user_profile (payments/user_cache.py).
+# Set SHARED_CACHE to a CACHES alias to share entries and invalidations
+# between processes.
+USER_PROFILE_CACHE = {
+    'SIZE': 1024,
+    'LOCAL_TIMEOUT': 60,
+    'SHARED_CACHE': 'default' if MULTI_NODE else None,
+    'SHARED_TIMEOUT': 300,
+}
+
+# Request metrics served at /metrics (see main/metrics.py) to the addresses
+# in ALLOWED_IPS. TRACE_SAMPLE_RATE of requests keep their queries, and
+# those slower than SLOW_SECONDS are logged on main.metrics.
+METRICS = {
+    'SLOW_SECONDS': 0.5,
+    'TRACE_SAMPLE_RATE': 0.1,
+    'TRACE_QUERIES': 5,
+    'ALLOWED_IPS': os.environ.get(
+        'METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+    ).split(','),
+}
+
+# Log lines are key=value pairs; LOG_LEVEL=DEBUG also logs rejected forms.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'time=%(asctime)s level=%(levelname)s '
+                      'logger=%(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        app: {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False}
+        for app in ('contact', 'main', 'payments')
+    },
+}
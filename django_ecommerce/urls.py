@@ -5,11 +5,11 @@ from main import views as main_views
 from contact import views as contact_views
 from payments import views as payment_views
 
-admin.autodiscover()
-
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^$', main_views.index, name='home'),
+    url(r'^metrics$', main_views.metrics_view, name='metrics'),
+    url(r'^assets/(?P<name>[^/]+)$', main_views.asset, name='asset'),
     url(r'^pages/', include('django.contrib.flatpages.urls')),
     url(r'^contact/', contact_views.contact, name='contact'),
 
@@ -17,4 +17,5 @@ urlpatterns = [
     url(r'^sign_out$', payment_views.sign_out, name='sign_out'),
     url(r'^register$', payment_views.register, name='register'),
     url(r'^edit$', payment_views.edit, name='edit'),
+    url(r'^payments/webhook$', payment_views.webhook, name='stripe_webhook'),
 ]
\ No newline at end of file
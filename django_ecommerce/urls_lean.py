@@ -0,0 +1,3 @@
+"""The URLconf of the lean settings profile, for commands that serve nothing."""
+
+urlpatterns = []
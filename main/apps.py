@@ -3,3 +3,24 @@ from django.apps import AppConfig
 
 class MainConfig(AppConfig):
     name = 'main'
+
+    def ready(self):
+        from django.contrib.flatpages.models import FlatPage
+        from django.core.signals import request_finished, request_started
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import (
+            m2m_changed, post_delete, post_save,
+        )
+        from django_ecommerce import db
+        from main import flatpages, metrics, middleware
+
+        connection_created.connect(metrics.install_query_timer)
+        connection_created.connect(db.configure_sqlite)
+        request_started.connect(db.check_persistent_connections)
+        request_finished.connect(db.unpin_primary)
+        post_save.connect(middleware.clear, sender=FlatPage)
+        post_delete.connect(middleware.clear, sender=FlatPage)
+        post_save.connect(flatpages.page_saved, sender=FlatPage)
+        post_delete.connect(flatpages.page_deleted, sender=FlatPage)
+        m2m_changed.connect(flatpages.sites_changed,
+                            sender=FlatPage.sites.through)
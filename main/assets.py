@@ -0,0 +1,174 @@
+"""Bundled, fingerprinted and precompressed static assets.
+
+``manage.py build_assets`` concatenates the files of each bundle in
+``STATIC_ASSETS['BUNDLES']`` (found through the staticfiles finders), writes
+the result to ``ROOT`` under a name carrying a hash of its content, e.g.
+``app.3f1c0a9b2d4e.js``, next to a gzip and a brotli copy, and records
+``bundle -> hashed name`` in ``manifest.json``.  A source with a ``.min``
+sibling (``jquery.js`` and ``jquery.min.js``) is taken minified; other scripts
+are minified with ``rjsmin``.  The command refuses to build without
+``brotli`` and ``rjsmin`` (both in requirements.txt); ``build()`` itself
+skips what they do, and serving needs neither.
+
+``main.views.asset`` serves those files with the best encoding the client
+accepts and a year-long ``immutable`` cache lifetime, which is safe because a
+changed file gets a new name.  Until the bundles are built, the ``{% bundle %}``
+tag (main/templatetags/assets.py) links each source file from STATIC_URL as
+before.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+from main import compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+DEFAULTS = {
+    # defaults to BASE_DIR/assets
+    'ROOT': None,
+    'URL': '/assets/',
+    'BUNDLES': {},
+    'MAX_AGE': 365 * 24 * 60 * 60,
+}
+
+MANIFEST = 'manifest.json'
+
+# Content-Encoding -> suffix of the precompressed copy, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_manifests = {}  # ROOT -> manifest
+_lock = threading.Lock()
+
+
+def _conf():
+    conf = dict(DEFAULTS, **getattr(settings, 'STATIC_ASSETS', {}))
+    conf['ROOT'] = conf['ROOT'] or os.path.join(settings.BASE_DIR, 'assets')
+    return conf
+
+
+def reset():
+    """Forget the manifests read so far; for tests and after a build."""
+    with _lock:
+        _manifests.clear()
+
+
+def manifest():
+    """The manifest of the last build, or ``{}`` if nothing is built."""
+    root = _conf()['ROOT']
+    with _lock:
+        if root not in _manifests:
+            try:
+                with io.open(os.path.join(root, MANIFEST),
+                             encoding='utf-8') as f:
+                    _manifests[root] = json.load(f)
+            except (IOError, OSError, ValueError):
+                _manifests[root] = {}
+        return _manifests[root]
+
+
+def urls(bundle):
+    """The URLs a page loads for ``bundle``: the built file if there is
+    one, otherwise each of its sources from STATIC_URL."""
+    conf = _conf()
+    built = manifest().get(bundle)
+    if built:
+        return [conf['URL'] + built]
+    return [settings.STATIC_URL + source
+            for source in conf['BUNDLES'][bundle]]
+
+
+def _read(source):
+    """The content of ``source``, minified when we can."""
+    base, ext = os.path.splitext(source)
+    if not base.endswith('.min'):
+        path = finders.find(base + '.min' + ext)
+        if path:
+            with open(path, 'rb') as f:
+                return f.read()
+    path = finders.find(source)
+    if path is None:
+        raise ValueError('Static file %r not found' % source)
+    with open(path, 'rb') as f:
+        content = f.read()
+    if ext == '.js' and rjsmin is not None and not base.endswith('.min'):
+        content = rjsmin.jsmin(content.decode('utf-8')).encode('utf-8')
+    return content
+
+
+def _write(path, content):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.rename(tmp, path)
+
+
+def build():
+    """Build every bundle; returns ``{bundle: {name, size, gzip, br}}``.
+
+    Files from earlier builds are left in place, so pages rendered before a
+    deploy can still load what they reference.
+    """
+    conf = _conf()
+    root = conf['ROOT']
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    built = {}
+    stats = {}
+    for bundle, sources in sorted(conf['BUNDLES'].items()):
+        base, ext = os.path.splitext(bundle)
+        # a script that omits its final semicolon must not run into the next
+        separator = b';\n' if ext == '.js' else b'\n'
+        content = separator.join(_read(source).strip()
+                                 for source in sources) + b'\n'
+        name = '%s.%s%s' % (base, hashlib.md5(content).hexdigest()[:12], ext)
+        path = os.path.join(root, name)
+        compressed = {'gzip': compression.gzip_bytes(content, 9)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(content, quality=11)
+        for encoding, suffix in ENCODINGS:
+            if encoding in compressed:
+                _write(path + suffix, compressed[encoding])
+        _write(path, content)
+        built[bundle] = name
+        stats[bundle] = dict(
+            name=name, size=len(content),
+            **dict((e, len(c)) for e, c in compressed.items())
+        )
+    # written last: a manifest only ever names files that exist
+    _write(os.path.join(root, MANIFEST),
+           json.dumps(built, indent=2, sort_keys=True).encode('utf-8'))
+    reset()
+    return stats
+
+
+def find(name, accept_encoding=''):
+    """``(path, encoding)`` of the best file to send for ``name``.
+
+    ``encoding`` is None for the file as built.  Returns ``(None, None)``
+    for a name that was never built.
+    """
+    if not name or name.startswith('.') or os.path.basename(name) != name \
+            or name == MANIFEST:
+        return None, None
+    path = os.path.join(_conf()['ROOT'], name)
+    if not os.path.isfile(path):
+        return None, None
+    accepted = compression.accepted(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
@@ -0,0 +1,392 @@
+"""Load-test harness behind ``manage.py bench``.
+
+``seed()`` fills the database with a synthetic, reproducible dataset (users,
+contact messages, flatpages and signed-in sessions) and builds the static
+bundles, ``run()`` drives every
+route in ``django_ecommerce.urls`` with concurrent test clients, and
+``compare()`` diffs the results against a saved JSON baseline.  Stripe is
+served by ``payments.stripe_stub`` on a local port, so a run needs no
+network.
+
+Each entry of ``urlpatterns`` is matched to its scenarios by URL name, or by
+regex for ``include()``s; a route with no scenario is reported instead of
+silently left out.  Query counts come from ``main.metrics``.
+"""
+import collections
+import datetime
+import itertools
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.auth.hashers import make_password
+from django.contrib.sites.models import Site
+from django.db import connections
+from django.test import Client
+from django.urls import get_resolver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from contact.models import ContactForm
+from main import assets, metrics
+from payments import webhooks
+from payments.models import User
+
+PASSWORD = 'bench password'
+WEBHOOK_SECRET = 'whsec_bench'
+
+SCALE = collections.OrderedDict([
+    ('users', 1000),
+    ('messages', 10000),
+    ('flatpages', 50),
+    ('sessions', 200),
+])
+
+
+def overrides(assets_root):
+    """Settings for the duration of a run.
+
+    Clients hammering sign_in from one address are not an attack here,
+    webhook deliveries are signed with a known secret, slow requests are
+    not traced, and bundles are built into ``assets_root``.
+    """
+    return {
+        'SIGN_IN_RATE_LIMIT': {
+            'PER_IP': {'CAPACITY': 10 ** 9, 'REFILL_PER_MINUTE': 10 ** 9},
+            'PER_EMAIL': {'CAPACITY': 10 ** 9, 'REFILL_PER_MINUTE': 10 ** 9},
+        },
+        'STRIPE_WEBHOOK': dict(getattr(settings, 'STRIPE_WEBHOOK', {}),
+                               SECRET=WEBHOOK_SECRET),
+        'METRICS': dict(getattr(settings, 'METRICS', {}),
+                        TRACE_SAMPLE_RATE=0),
+        'STATIC_ASSETS': dict(getattr(settings, 'STATIC_ASSETS', {}),
+                              ROOT=assets_root),
+    }
+
+
+class Dataset(object):
+    """What ``seed()`` created, for scenarios to pick from."""
+
+    def __init__(self):
+        self.emails = []
+        self.user_pks = []
+        self.sessions = []
+        self.flatpages = []
+        self.assets = []
+        self.counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def unique(self):
+        with self._lock:
+            return next(self.counter)
+
+
+def seed(scale, stub, rng):
+    """Create the synthetic dataset; returns a ``Dataset``."""
+    data = Dataset()
+    password = make_password(PASSWORD)
+    users = []
+    for i in range(scale['users']):
+        email = 'user%d@example.com' % i
+        stripe_id = ''
+        if i < scale['sessions']:
+            # signed-in users can open /edit, which needs a customer
+            stripe_id = stub.create_customer(
+                {'email': email, 'card': 'tok_visa'})['id']
+        users.append(User(name='User %d' % i, email=email, email_key=email,
+                          password=password, stripe_id=stripe_id,
+                          last_4_digits='4242'))
+        data.emails.append(email)
+    User.objects.bulk_create(users, batch_size=500)
+
+    now = timezone.now()
+    topics = ['Billing', 'Support', 'Feedback']
+    ContactForm.objects.bulk_create([
+        ContactForm(name='Visitor %d' % i,
+                    email='visitor%d@example.com' % rng.randrange(1000),
+                    topic=rng.choice(topics),
+                    message='Message number %d' % i,
+                    timestamp=now - datetime.timedelta(seconds=i))
+        for i in range(scale['messages'])
+    ], batch_size=500)
+
+    site = Site.objects.get_current()
+    for i in range(scale['flatpages']):
+        page = FlatPage.objects.create(
+            url='/page-%d/' % i, title='Page %d' % i,
+            content='<p>%s</p>' % ('Content of page %d. ' % i * 20),
+        )
+        page.sites.add(site)
+        data.flatpages.append(page.url)
+
+    data.user_pks = list(
+        User.objects.order_by('pk').values_list('pk', flat=True))
+    store = import_string(settings.SESSION_ENGINE + '.SessionStore')
+    for pk in data.user_pks[:scale['sessions']]:
+        session = store()
+        session['user'] = pk
+        session.save()
+        data.sessions.append(session.session_key)
+
+    data.assets = sorted(s['name'] for s in assets.build().values())
+    return data
+
+
+def _signed_in(data, i):
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = \
+        data.sessions[i % len(data.sessions)]
+    return client
+
+
+def _fresh_session(data, i):
+    """A new signed-in client, for scenarios that end the session."""
+    store = import_string(settings.SESSION_ENGINE + '.SessionStore')
+    session = store()
+    session['user'] = data.user_pks[i % len(data.user_pks)]
+    session.save()
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return client
+
+
+def _webhook_event(data, i):
+    n = data.unique()
+    payload = json.dumps({
+        'id': 'evt_bench_%d' % n, 'type': 'invoice.payment_succeeded',
+        'created': int(time.time()), 'data': {'object': {'customer': 'x'}},
+    }).encode('utf-8')
+    return payload, webhooks.sign(payload, WEBHOOK_SECRET)
+
+
+# route key -> [(label, prepare(data, i) or None, request(data, i, prepared),
+#               expected status)]; prepared values are made before timing
+SCENARIOS = {
+    'home': [
+        ('GET / anonymous', None,
+         lambda data, i, p: Client().get('/'), 200),
+        ('GET / signed in', None,
+         lambda data, i, p: _signed_in(data, i).get('/'), 200),
+    ],
+    'metrics': [
+        ('GET /metrics', None,
+         lambda data, i, p: Client().get('/metrics'), 200),
+    ],
+    'contact': [
+        ('GET /contact/', None,
+         lambda data, i, p: Client().get('/contact/'), 200),
+        ('POST /contact/', None,
+         lambda data, i, p: Client().post('/contact/', {
+             'name': 'Visitor', 'email': 'visitor%d@example.com' % i,
+             'topic': 'Support', 'message': 'Bench message %d' % i,
+         }), 302),
+    ],
+    'sign_in': [
+        ('GET /sign_in', None,
+         lambda data, i, p: Client().get('/sign_in'), 200),
+        ('POST /sign_in', None,
+         lambda data, i, p: Client().post('/sign_in', {
+             'email': data.emails[i % len(data.emails)],
+             'password': PASSWORD,
+         }), 302),
+    ],
+    'sign_out': [
+        ('GET /sign_out', _fresh_session,
+         lambda data, i, client: client.get('/sign_out'), 302),
+    ],
+    'register': [
+        ('GET /register', None,
+         lambda data, i, p: Client().get('/register'), 200),
+        ('POST /register', None,
+         lambda data, i, p: Client().post('/register', {
+             'name': 'New user', 'password': PASSWORD,
+             'ver_password': PASSWORD, 'last_4_digits': '4242',
+             'stripe_token': 'tok_visa',
+             'email': 'new%d@example.com' % data.unique(),
+         }), 302),
+    ],
+    'edit': [
+        ('GET /edit', None,
+         lambda data, i, p: _signed_in(data, i).get('/edit'), 200),
+        ('POST /edit', None,
+         lambda data, i, p: _signed_in(data, i).post('/edit', {
+             'stripe_token': 'tok_visa', 'last_4_digits': '4242',
+         }), 302),
+    ],
+    'asset': [
+        ('GET /assets/<bundle>', None,
+         lambda data, i, p: Client().get(
+             '/assets/' + data.assets[i % len(data.assets)],
+             HTTP_ACCEPT_ENCODING='gzip, deflate, br'), 200),
+    ],
+    'stripe_webhook': [
+        ('POST /payments/webhook', _webhook_event,
+         lambda data, i, event: Client().post(
+             '/payments/webhook', event[0], content_type='application/json',
+             HTTP_STRIPE_SIGNATURE=event[1]), 200),
+    ],
+    '^admin/': [
+        ('GET /admin/login/', None,
+         lambda data, i, p: Client().get('/admin/login/'), 200),
+    ],
+    '^pages/': [
+        ('GET /pages/<url>', None,
+         lambda data, i, p: Client().get(
+             '/pages' + data.flatpages[i % len(data.flatpages)]), 200),
+    ],
+}
+
+
+def route_keys():
+    """The key of every entry in ROOT_URLCONF's urlpatterns, in order."""
+    keys = []
+    for entry in get_resolver().url_patterns:
+        name = getattr(entry, 'name', None)
+        if name:
+            keys.append(name)
+        else:
+            # Django 2.0 moved the regex onto entry.pattern
+            keys.append(getattr(entry, 'pattern', entry).regex.pattern)
+    return keys
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[int(round(pct / 100.0 * (len(ordered) - 1)))]
+
+
+def _drive(data, prepare, request, expect, count, concurrency):
+    """Send ``count`` requests from ``concurrency`` threads."""
+    prepared = [prepare(data, i) if prepare else None for i in range(count)]
+    indexes = iter(range(count))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def send_all():
+        while True:
+            with lock:
+                i = next(indexes, None)
+            if i is None:
+                return
+            start = time.time()
+            try:
+                ok = request(data, i, prepared[i]).status_code == expect
+            except Exception:
+                ok = False
+            elapsed = time.time() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    def worker():
+        try:
+            send_all()
+        finally:
+            connections.close_all()
+
+    start = time.time()
+    if concurrency <= 1:
+        # on this thread, so the caller's connection (and transaction) is used
+        send_all()
+    else:
+        threads = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, time.time() - start, errors[0]
+
+
+def _queries_per_request():
+    count = total = 0
+    for cumulative, queries in metrics.REQUEST_QUERIES.collect().values():
+        count += cumulative[-1]
+        total += queries
+    return round(float(total) / count, 2) if count else 0.0
+
+
+def run(data, requests=200, concurrency=8, only=None):
+    """Drive every route; returns ``(results, routes without scenarios)``."""
+    results = []
+    missing = []
+    for key in route_keys():
+        scenarios = SCENARIOS.get(key)
+        if scenarios is None:
+            missing.append(key)
+            continue
+        for label, prepare, request, expect in scenarios:
+            if only and not any(o in label for o in only):
+                continue
+            metrics.reset()
+            latencies, elapsed, errors = _drive(
+                data, prepare, request, expect, requests, concurrency)
+            results.append(collections.OrderedDict([
+                ('label', label),
+                ('route', key),
+                ('requests', len(latencies) + errors),
+                ('errors', errors),
+                ('throughput_rps', round(len(latencies) / elapsed, 2)
+                 if elapsed else 0),
+                ('p50_ms', round(percentile(latencies, 50) * 1000, 2)),
+                ('p95_ms', round(percentile(latencies, 95) * 1000, 2)),
+                ('p99_ms', round(percentile(latencies, 99) * 1000, 2)),
+                ('queries_per_request', _queries_per_request()),
+            ]))
+    return results, missing
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Diff ``results`` against a saved run; returns ``(rows, regressions)``.
+
+    A scenario regresses if its p95 latency grew by more than ``tolerance``
+    (a fraction), it makes more queries per request, or it has errors the
+    baseline did not.
+    """
+    before = dict((r['label'], r) for r in baseline['results'])
+    rows = []
+    regressions = []
+    for result in results:
+        old = before.get(result['label'])
+        if old is None:
+            continue
+        row = collections.OrderedDict([
+            ('label', result['label']),
+            ('p95_ms', '%s -> %s' % (old['p95_ms'], result['p95_ms'])),
+            ('throughput_rps', '%s -> %s' % (old['throughput_rps'],
+                                             result['throughput_rps'])),
+            ('queries_per_request', '%s -> %s' % (
+                old['queries_per_request'], result['queries_per_request'])),
+        ])
+        problems = []
+        if result['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            problems.append('slower')
+        if result['queries_per_request'] > old['queries_per_request']:
+            problems.append('more queries')
+        if result['errors'] > old['errors']:
+            problems.append('errors')
+        row['verdict'] = ', '.join(problems) or 'ok'
+        if problems:
+            regressions.append(result['label'])
+        rows.append(row)
+    return rows, regressions
+
+
+def format_table(rows):
+    if not rows:
+        return ''
+    columns = list(rows[0])
+    widths = [max(len(c), *(len(str(r.get(c, ''))) for r in rows))
+              for c in columns]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+    for r in rows:
+        lines.append('  '.join(str(r.get(c, '')).ljust(w)
+                               for c, w in zip(columns, widths)))
+    return '\n'.join(lines)
@@ -0,0 +1,181 @@
+"""Negotiated gzip and brotli compression of responses.
+
+``CompressionMiddleware`` compresses responses of the ``COMPRESSION['TYPES']``
+content types with the best encoding the client accepts: brotli when the
+``brotli`` package is installed, otherwise gzip.  Responses shorter than
+``MIN_SIZE`` are sent as they are, and streaming responses are compressed
+chunk by chunk, each chunk flushed so the browser can start on it.
+
+Pages that used the CSRF token hold a secret next to whatever the page
+reflects from the request, which is what BREACH needs to recover the secret
+from the compressed length.  Django masks the token afresh on every
+response, and these pages are also only ever gzipped, with a file name of
+random length (up to ``MAX_PADDING`` bytes) in the gzip header, so their
+length never settles to measure; ``CSRF_PAGES = 'skip'`` sends them
+uncompressed instead.
+"""
+import gzip
+import io
+import random
+import string
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'MIN_SIZE': 200,
+    'TYPES': [
+        'text/html', 'text/plain', 'text/css', 'text/javascript',
+        'application/javascript', 'application/json',
+    ],
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    # 'pad' or 'skip', for pages that used the CSRF token
+    'CSRF_PAGES': 'pad',
+    'MAX_PADDING': 64,
+}
+
+_random = random.SystemRandom()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'COMPRESSION', {}))
+
+
+def accepted(accept_encoding):
+    """The content codings an Accept-Encoding header allows."""
+    codings = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00',
+                                           'q=0.000'):
+            codings.add(coding.strip().lower())
+    return codings
+
+
+def negotiate(accept_encoding, encodings):
+    """The first of ``encodings`` the client accepts, or None."""
+    codings = accepted(accept_encoding)
+    for encoding in encodings:
+        if encoding in codings:
+            return encoding
+    return None
+
+
+class _Buffer(object):
+    """A file to write to that hands back what was written since the last
+    ``read()``."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def read(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _padding(conf):
+    return ''.join(_random.choice(string.ascii_letters)
+                   for _ in range(_random.randint(1, conf['MAX_PADDING'])))
+
+
+def gzip_bytes(content, level, filename=''):
+    buf = io.BytesIO()
+    # mtime=0 so that identical input compresses to identical bytes
+    with gzip.GzipFile(filename=filename, mode='wb', compresslevel=level,
+                       fileobj=buf, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+def gzip_stream(chunks, level, filename=''):
+    buf = _Buffer()
+    with gzip.GzipFile(filename=filename, mode='wb', compresslevel=level,
+                       fileobj=buf, mtime=0) as f:
+        for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+            data = buf.read()
+            if data:
+                yield data
+    yield buf.read()
+
+
+def brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """Compress responses as described in the module docstring.  Must come
+    before (outside) any middleware that reads or replaces the content."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        conf = _conf()
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if (response.has_header('Content-Encoding') or
+                response.status_code in (204, 304) or
+                'no-transform' in response.get('Cache-Control', '') or
+                content_type.strip().lower() not in conf['TYPES'] or
+                (not response.streaming and
+                 len(response.content) < conf['MIN_SIZE'])):
+            return response
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        secret = request.META.get('CSRF_COOKIE_USED')
+        if secret and conf['CSRF_PAGES'] == 'skip':
+            return response
+        encodings = ['gzip'] if secret or brotli is None else ['br', 'gzip']
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                             encodings)
+        if encoding is None:
+            return response
+        filename = _padding(conf) if secret else ''
+
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = brotli_stream(
+                    response.streaming_content, conf['BROTLI_QUALITY'])
+            else:
+                response.streaming_content = gzip_stream(
+                    response.streaming_content, conf['GZIP_LEVEL'], filename)
+            # unknown until the last chunk is compressed
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                content = brotli.compress(response.content,
+                                          quality=conf['BROTLI_QUALITY'])
+            else:
+                content = gzip_bytes(response.content, conf['GZIP_LEVEL'],
+                                     filename)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # the compressed bytes differ, but mean the same as the original's
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
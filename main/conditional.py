@@ -0,0 +1,94 @@
+"""ETags and Last-Modified for pages that change only with their data.
+
+A page's ETag hashes what it is rendered from (the signed-in ``User``'s
+``updated_at``, a flatpage's modification stamp) together with ``release()``,
+which changes whenever a deploy changes the templates, the built asset
+bundles or ``CONDITIONAL_GET['RELEASE']``.  The view functions here are
+passed to ``django.views.decorators.http.condition``, which answers a
+matching If-None-Match or If-Modified-Since with a 304 before the view
+runs.  ``ConditionalGetMiddleware`` does the same for pages served from the
+anonymous page cache, which keep the headers they were stored with.
+
+A page is left unconditional while the visitor has messages waiting, since
+those are shown once on whichever page renders next.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+
+from main import assets
+from payments.middleware import get_user_profile
+
+DEFAULTS = {
+    # e.g. the deployed commit; only needed if a deploy can change a page
+    # without touching the templates or the asset bundles
+    'RELEASE': '',
+}
+
+_release = None
+_lock = threading.Lock()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'CONDITIONAL_GET', {}))
+
+
+def _template_digest():
+    digest = hashlib.md5()
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for root, dirs, files in sorted(os.walk(directory)):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path[len(directory):].encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def release():
+    """A digest of everything a deploy may change in a page."""
+    global _release
+    with _lock:
+        if _release is None:
+            _release = hashlib.md5(('%s|%s|%s' % (
+                _conf()['RELEASE'], _template_digest(),
+                sorted(assets.manifest().items()),
+            )).encode('utf-8')).hexdigest()
+        return _release
+
+
+def reset():
+    """Forget the release digest; for tests and after a build."""
+    global _release
+    with _lock:
+        _release = None
+
+
+def make_etag(*parts):
+    key = '|'.join([release()] + [str(p) for p in parts])
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def has_messages(request):
+    storage = getattr(request, '_messages', None)
+    return storage is not None and len(storage) > 0
+
+
+def index_etag(request):
+    if has_messages(request):
+        return None
+    user = get_user_profile(request)
+    if user is None:
+        # index.html is the same for every anonymous visitor
+        return make_etag('index')
+    return make_etag('user', user.pk, user.updated_at.isoformat())
+
+
+def index_last_modified(request):
+    if has_messages(request):
+        return None
+    user = get_user_profile(request)
+    return user.updated_at if user is not None else None
@@ -0,0 +1,269 @@
+"""In-process index of the flatpages for ``SITE_ID``.
+
+The URL of every flatpage on the current site is loaded into a dict the
+first time a URL is looked up, so a request for a URL that is not a flatpage
+is answered without touching the database.  Signal receivers connected in
+``main.apps`` keep the index current as pages are saved, deleted or moved
+between sites.  The index is process-local, so other processes only see
+those changes after ``reset()`` or a restart, unless
+``FLATPAGE_CACHE['SHARED_CACHE']`` names an alias in ``CACHES``: then every
+change replaces a version stamp in that cache, once when it is made and again
+when it commits, and a process whose index was loaded under an older stamp
+drops it on its next lookup.
+
+Rendered pages are kept in an LRU of ``FLATPAGE_CACHE['RENDERED_SIZE']``
+entries and dropped whenever their page changes.
+
+``FlatPage`` records no modification time, so the receivers also stamp each
+changed page with the time in the shared cache (or 'default'); pages that
+need no sign in are served with an ETag and Last-Modified from that stamp
+(see main/conditional.py), and a stamp lost from the cache starts again at
+the time it was found missing.
+"""
+import datetime
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.flatpages.models import FlatPage
+from django.db import transaction
+from django.contrib.flatpages.views import render_flatpage
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from main import conditional
+from main.lru import LRUCache
+
+DEFAULTS = {
+    'RENDERED_SIZE': 256,
+    'SHARED_CACHE': None,
+}
+
+VERSION_KEY = 'flatpages-version'
+
+_urls = None  # url -> pk
+_pks = None  # pk -> url
+_private = None  # pks of pages with registration_required
+_rendered = None
+_version = None  # the shared stamp _urls was loaded under
+_lock = threading.Lock()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'FLATPAGE_CACHE', {}))
+
+
+def _rendered_cache():
+    global _rendered
+    if _rendered is None:
+        _rendered = LRUCache(_conf()['RENDERED_SIZE'])
+    return _rendered
+
+
+def _shared_cache():
+    alias = _conf()['SHARED_CACHE']
+    return caches[alias] if alias else None
+
+
+def _load():
+    global _urls, _pks, _private, _rendered, _version
+    shared = _shared_cache()
+    version = shared.get(VERSION_KEY) if shared is not None else None
+    with _lock:
+        if version != _version:
+            # changed by another process since we loaded
+            _urls = _pks = _private = _rendered = None
+            _version = version
+        if _urls is None:
+            pages = list(FlatPage.objects.filter(
+                sites=settings.SITE_ID
+            ).values_list('url', 'pk', 'registration_required'))
+            _pks = dict((pk, url) for url, pk, _ in pages)
+            _urls = dict((url, pk) for pk, url in _pks.items())
+            _private = set(pk for _, pk, private in pages if private)
+    return _urls
+
+
+def lookup(url):
+    """Return the pk of the flatpage at ``url`` on this site, or None."""
+    return _load().get(url)
+
+
+def _after_commit(func, *args):
+    # once now, for the rest of this transaction, and again when the change
+    # is visible to other processes: one that reloaded in between would keep
+    # the old rows under the new stamp
+    func(*args)
+    transaction.on_commit(lambda: func(*args))
+
+
+def _changed():
+    """Retire the index of every other process sharing the cache."""
+    _after_commit(_bump)
+
+
+def _bump():
+    global _version
+    shared = _shared_cache()
+    if shared is None:
+        return
+    previous = shared.get(VERSION_KEY)
+    version = uuid.uuid4().hex
+    shared.set(VERSION_KEY, version, None)
+    with _lock:
+        if _version == previous:
+            # nobody else changed anything; the caller updates our index
+            _version = version
+
+
+def _stamp_cache():
+    return caches[_conf()['SHARED_CACHE'] or 'default']
+
+
+def _stamp_key(pk):
+    return 'flatpage-modified:%s' % pk
+
+
+def touch(pk):
+    """Record that the page ``pk`` changed just now."""
+    _after_commit(_touch, pk)
+
+
+def _touch(pk):
+    _stamp_cache().set(_stamp_key(pk), time.time(), None)
+
+
+def modified(pk):
+    """When the page ``pk`` last changed, as a Unix time."""
+    cache = _stamp_cache()
+    stamp = cache.get(_stamp_key(pk))
+    if stamp is None:
+        # every process agrees on the first stamp written
+        cache.add(_stamp_key(pk), time.time(), None)
+        stamp = cache.get(_stamp_key(pk), time.time())
+    return stamp
+
+
+def _refresh(page):
+    _changed()
+    touch(page.pk)
+    _rendered_cache().delete(page.pk)
+    if _urls is None:
+        # nothing to update; the index is built when it is first used
+        return
+    on_site = page.sites.filter(pk=settings.SITE_ID).exists()
+    with _lock:
+        # reset() or a reload may have dropped the index meanwhile
+        if _urls is None:
+            return
+        old = _pks.pop(page.pk, None)
+        if old is not None:
+            del _urls[old]
+        _private.discard(page.pk)
+        if on_site:
+            _pks[page.pk] = page.url
+            _urls[page.url] = page.pk
+            if page.registration_required:
+                _private.add(page.pk)
+
+
+def page_saved(instance, **kwargs):
+    _refresh(instance)
+
+
+def page_deleted(instance, **kwargs):
+    _changed()
+    _stamp_cache().delete(_stamp_key(instance.pk))
+    _rendered_cache().delete(instance.pk)
+    with _lock:
+        if _urls is None:
+            return
+        old = _pks.pop(instance.pk, None)
+        if old is not None:
+            del _urls[old]
+        _private.discard(instance.pk)
+
+
+def sites_changed(instance, action, reverse, pk_set=None, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # pages were added to or removed from a Site; start over
+        _changed()
+        for pk in pk_set or ():
+            touch(pk)
+        reset()
+    else:
+        _refresh(instance)
+
+
+def reset():
+    """Forget the index and rendered pages; both reload on next use."""
+    global _urls, _pks, _private, _rendered, _version
+    with _lock:
+        _urls = _pks = _private = _rendered = _version = None
+
+
+def serve(request, url):
+    """Respond with the flatpage at ``url``, or raise Http404.
+
+    Behaves like ``django.contrib.flatpages.views.flatpage``, but misses are
+    answered from the index.
+    """
+    if not url.startswith('/'):
+        url = '/' + url
+    pk = lookup(url)
+    if pk is None:
+        if not url.endswith('/') and settings.APPEND_SLASH:
+            if lookup(url + '/') is not None:
+                return HttpResponsePermanentRedirect('%s/' % request.path)
+        raise Http404
+    return _serve_page(request, pk)
+
+
+def _is_conditional(request, pk):
+    private = _private
+    return (private is not None and pk not in private and
+            not conditional.has_messages(request))
+
+
+def _etag(request, pk):
+    if _is_conditional(request, pk):
+        return conditional.make_etag('flatpage', pk, repr(modified(pk)))
+    return None
+
+
+def _last_modified(request, pk):
+    if _is_conditional(request, pk):
+        return datetime.datetime.fromtimestamp(modified(pk), timezone.utc)
+    return None
+
+
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def _serve_page(request, pk):
+    content = _rendered_cache().get(pk)
+    if content is not None:
+        return HttpResponse(content)
+
+    try:
+        page = FlatPage.objects.get(pk=pk)
+    except FlatPage.DoesNotExist:
+        raise Http404
+    response = render_flatpage(request, page)
+    if _is_shareable(request, page, response):
+        _rendered_cache().set(pk, response.content)
+    return response
+
+
+def _is_shareable(request, page, response):
+    # the same for every visitor: no login check, CSRF token or messages
+    messages = getattr(request, '_messages', None)
+    return (
+        response.status_code == 200 and
+        not page.registration_required and
+        not request.META.get('CSRF_COOKIE_USED') and
+        not getattr(messages, 'used', False)
+    )
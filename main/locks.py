@@ -0,0 +1,46 @@
+"""Locks held in a cache, so that every process using it sees them.
+
+``lock(name)`` takes the lock with ``cache.add()``, which memcached (and the
+other Django cache backends) only lets one caller win, and releases it by
+deleting the key.  A holder that dies without releasing only keeps the lock
+for ``timeout`` seconds.  With the default ``LocMemCache`` the lock is as
+local as a ``threading.Lock``; in multi-node mode (see ``SHARED_STATE`` in
+settings.py) the alias is on the shared store and the lock spans nodes.
+"""
+import contextlib
+import time
+import uuid
+
+from django.core.cache import caches
+
+
+class LockTimeout(Exception):
+    """The lock was still held by someone else after ``wait`` seconds."""
+
+
+def _key(name):
+    return 'lock:%s' % name
+
+
+@contextlib.contextmanager
+def lock(name, cache='default', timeout=10, wait=5, poll=0.01):
+    """Hold the lock ``name`` in the ``cache`` alias for the ``with`` block.
+
+    Raises ``LockTimeout`` if it cannot be taken within ``wait`` seconds.
+    The block should finish well within ``timeout``: after that the lock
+    lapses and another caller may take it.
+    """
+    store = caches[cache]
+    key = _key(name)
+    token = uuid.uuid4().hex
+    deadline = time.time() + wait
+    while not store.add(key, token, timeout):
+        if time.time() >= deadline:
+            raise LockTimeout(name)
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        # not if it lapsed and someone else has it now
+        if store.get(key) == token:
+            store.delete(key)
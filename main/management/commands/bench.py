@@ -0,0 +1,143 @@
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment,
+)
+
+from main import bench
+from payments import stripe_client
+from payments.stripe_stub import StripeStub
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database with a synthetic dataset and drive every '
+        'route in ROOT_URLCONF with concurrent clients, reporting '
+        'throughput, latency percentiles and queries per request.  Stripe '
+        'is served by a local stub, so no network is needed.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in bench.SCALE.items():
+            parser.add_argument(
+                '--%s' % name, type=int, default=default,
+                help='Number of %s to seed (default %d).' % (name, default),
+            )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per scenario.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Client threads per scenario.',
+        )
+        parser.add_argument(
+            '--stripe-latency', type=float, default=0.0,
+            help='Seconds the Stripe stub waits before each response.',
+        )
+        parser.add_argument(
+            '--only', action='append', default=[],
+            help='Run only scenarios whose label contains this; repeatable.',
+        )
+        parser.add_argument(
+            '--fast-hasher', action='store_true',
+            help='Hash passwords with MD5 so sign-in and registration '
+                 'measure the rest of the request.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed for the synthetic dataset.',
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='Write the results to this file as a JSON baseline.',
+        )
+        parser.add_argument(
+            '--compare', default=None,
+            help='A JSON baseline to diff against; exits non-zero if any '
+                 'scenario regressed.',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed growth in p95 latency before --compare reports a '
+                 'regression, as a fraction (default 0.2).',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with io.open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        scale = dict((name, options[name]) for name in bench.SCALE)
+
+        tmp_dir = tempfile.mkdtemp(prefix='ecommerce-bench-')
+        overrides = bench.overrides(os.path.join(tmp_dir, 'assets'))
+        if options['fast_hasher']:
+            overrides['PASSWORD_HASHERS'] = [
+                'django.contrib.auth.hashers.MD5PasswordHasher']
+
+        if connection.vendor == 'sqlite':
+            # a file rather than SQLite's shared in-memory database, whose
+            # table locks fail concurrent writers at once
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = \
+                os.path.join(tmp_dir, 'bench.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        stub = StripeStub(latency=options['stripe_latency'])
+        try:
+            with override_settings(**overrides):
+                stub.start()
+                stripe_client.reset()
+                data = bench.seed(scale, stub, random.Random(options['seed']))
+                results, missing = bench.run(
+                    data, options['requests'], options['concurrency'],
+                    options['only'],
+                )
+        finally:
+            stub.stop()
+            stripe_client.reset()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmp_dir, True)
+
+        self.stdout.write(bench.format_table(results))
+        for key in missing:
+            self.stderr.write('No scenario for route %r' % key)
+
+        run_options = dict(
+            (name, options[name]) for name in
+            ('requests', 'concurrency', 'stripe_latency', 'fast_hasher',
+             'only', 'seed'))
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    'scale': scale,
+                    'options': run_options,
+                    'results': results,
+                }, indent=2, sort_keys=True))
+            self.stdout.write('Wrote %s' % options['output'])
+
+        if baseline is not None:
+            if (baseline.get('scale') != scale or
+                    baseline.get('options') != run_options):
+                # warmed caches and data volume change latency and query
+                # counts, so only like-for-like runs compare cleanly
+                self.stderr.write(
+                    'Warning: %s was run with different options'
+                    % options['compare'])
+            rows, regressions = bench.compare(
+                results, baseline, options['tolerance'])
+            self.stdout.write('')
+            self.stdout.write(bench.format_table(rows))
+            if regressions:
+                raise CommandError(
+                    'Regressed against %s: %s' % (
+                        options['compare'], ', '.join(regressions)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import assets
+
+
+class Command(BaseCommand):
+    help = (
+        'Concatenate and minify each STATIC_ASSETS bundle into a '
+        'content-hashed file with gzip and brotli copies, and write the '
+        'manifest the {% bundle %} tag reads.'
+    )
+
+    def handle(self, *args, **options):
+        missing = [name for name in ('brotli', 'rjsmin')
+                   if getattr(assets, name) is None]
+        if missing:
+            raise CommandError(
+                '%s not installed; see requirements.txt' % ' and '.join(
+                    missing))
+        try:
+            built = assets.build()
+        except ValueError as e:
+            raise CommandError(str(e))
+        for bundle, stats in sorted(built.items()):
+            self.stdout.write('%s -> %s (%s)' % (
+                bundle, stats['name'], ', '.join(
+                    '%s %d bytes' % (label, stats[key])
+                    for key, label in (('size', 'raw'), ('gzip', 'gzip'),
+                                       ('br', 'brotli'))
+                    if key in stats)))
+        self.stdout.write('Wrote %s' % assets._conf()['ROOT'])
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Start fresh interpreters the way the WSGI server or a management '
+        'command does and report the time to the first served request (or '
+        'to a command being ready) and what each module took to import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', choices=sorted(startup.TARGETS), default='request',
+            help="'request' loads WSGI_APPLICATION and serves one GET; "
+                 "'command' runs django.setup() and the system checks.",
+        )
+        parser.add_argument(
+            '--profile', choices=['full', 'lean'], default=None,
+            help='SETTINGS_PROFILE for the child (default: full for '
+                 'request, lean for command).',
+        )
+        parser.add_argument(
+            '--runs', type=int, default=5,
+            help='Cold starts to take the median of.',
+        )
+        parser.add_argument('--path', default='/',
+                            help='What the request target GETs.')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument(
+            '--limit', type=int, default=25,
+            help='Rows in the module and package tables.',
+        )
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        if not startup.supported():
+            raise CommandError('python -X importtime needs Python 3.7+')
+        try:
+            report = startup.profile(
+                options['target'], runs=options['runs'],
+                profile=options['profile'], path=options['path'],
+                host=options['host'],
+            )
+        except RuntimeError as e:
+            raise CommandError('The child interpreter failed:\n%s' % e)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(startup.format_report(report, options['limit']))
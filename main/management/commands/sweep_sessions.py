@@ -0,0 +1,87 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+DB_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+CACHE_ENGINE = 'django.contrib.sessions.backends.cache'
+COOKIE_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove expired sessions from the store used by SESSION_ENGINE. '
+        'Database rows are deleted in small batches so the sweep never '
+        'holds the SQLite write lock for long.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Expired session rows to delete per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        engine = settings.SESSION_ENGINE
+        if engine in DB_ENGINES:
+            # cached_db entries carry the session's own expiry as their
+            # cache timeout, so only the rows need sweeping
+            removed = self.sweep_database(options['batch_size'])
+        elif engine == CACHE_ENGINE:
+            removed = self.sweep_cache()
+        elif engine == COOKIE_ENGINE:
+            self.stdout.write(
+                'Signed-cookie sessions are stored by the browser; expired '
+                'cookies are rejected when read, so there is nothing to sweep.'
+            )
+            return
+        else:
+            removed = self.sweep_custom(engine)
+        self.stdout.write('Removed %d expired session(s)' % removed)
+
+    def sweep_database(self, batch_size):
+        removed = 0
+        while True:
+            expired = list(
+                Session.objects.filter(expire_date__lt=timezone.now())
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not expired:
+                return removed
+            Session.objects.filter(pk__in=expired).delete()
+            removed += len(expired)
+
+    def sweep_cache(self):
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        if not isinstance(cache, FileBasedCache):
+            # in-memory and networked caches drop entries at their timeout
+            return 0
+        # FileBasedCache only notices expired files when they are read, so
+        # walk the directory and let it delete the stale ones.  It has no
+        # public API for that: _list_cache_files() and _is_expired() are
+        # private (present from Django 1.6 on), hence the check.
+        if not (hasattr(cache, '_list_cache_files') and
+                hasattr(cache, '_is_expired')):
+            raise CommandError(
+                "This Django's FileBasedCache cannot be swept; expired "
+                "sessions are removed as they are read.")
+        removed = 0
+        for path in cache._list_cache_files():
+            try:
+                with open(path, 'rb') as f:
+                    removed += cache._is_expired(f)
+            except (IOError, OSError):
+                pass  # removed by a concurrent reader
+        return removed
+
+    def sweep_custom(self, engine):
+        store = import_module(engine).SessionStore
+        store.clear_expired()
+        return 0
@@ -0,0 +1,329 @@
+"""In-process request metrics, exposed in Prometheus' text format.
+
+``main.middleware.MetricsMiddleware`` times every request and, through hooks
+installed here, the database queries, template renders and Stripe calls made
+while serving it.  Each request's totals are recorded per view in
+histograms served at ``/metrics``.
+
+Recording never takes a lock: every thread counts into its own shard of each
+histogram, and a scrape adds the shards up.  A scrape may therefore see an
+observation's count before its sum, which Prometheus tolerates.  The shard
+of a thread that exits is folded into a total kept for the histogram.
+
+A ``TRACE_SAMPLE_RATE`` share of requests also keep their individual
+queries; those that take ``SLOW_SECONDS`` or longer are logged as a warning
+on the ``main.metrics`` logger with their breakdown and slowest queries.
+"""
+import bisect
+import logging
+import random
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SLOW_SECONDS': 0.5,
+    'TRACE_SAMPLE_RATE': 0.1,
+    'TRACE_QUERIES': 5,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+REGISTRY = []
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'METRICS', {}))
+
+
+class _Owner(object):
+    """Kept only in one thread's local storage, so it dies with the thread."""
+
+
+class Histogram(object):
+    """A Prometheus histogram whose ``observe`` takes no lock."""
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = {}  # id(shard) -> shard, one per live thread
+        self._retired = {}  # the counts of threads that have exited
+        REGISTRY.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # servers that start a thread per request would otherwise
+            # leave a shard behind for every request
+            owner = self._local.owner = _Owner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards[id(shard)] = shard
+        return shard
+
+    def _retire(self, shard):
+        # its thread has exited, so nothing writes to it any more
+        with self._lock:
+            del self._shards[id(shard)]
+            self._add(self._retired, shard)
+
+    def _add(self, totals, shard):
+        for labels, series in list(shard.items()):
+            total = totals.setdefault(
+                labels, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(list(series)):
+                total[i] += value
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # a count per bucket, one for +Inf, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        """Return ``{labels: (cumulative bucket counts, sum)}``."""
+        totals = {}
+        with self._lock:
+            self._add(totals, self._retired)
+            for shard in self._shards.values():
+                self._add(totals, shard)
+        collected = {}
+        for labels, total in totals.items():
+            cumulative = []
+            running = 0
+            for count in total[:-1]:
+                running += count
+                cumulative.append(running)
+            collected[labels] = (cumulative, total[-1])
+        return collected
+
+    def reset(self):
+        with self._lock:
+            self._retired.clear()
+            for shard in self._shards.values():
+                shard.clear()
+
+    def render(self):
+        def labelset(labels, extra=()):
+            pairs = list(zip(self.labels, labels)) + list(extra)
+            if not pairs:
+                return ''
+            return '{%s}' % ','.join(
+                '%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                             .replace('"', '\\"'))
+                for k, v in pairs)
+
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        for labels, (cumulative, total) in sorted(self.collect().items()):
+            bounds = ['%g' % b for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, cumulative):
+                lines.append('%s_bucket%s %d' % (
+                    self.name, labelset(labels, [('le', bound)]), count))
+            lines.append('%s_sum%s %r' % (self.name, labelset(labels), total))
+            lines.append('%s_count%s %d' % (
+                self.name, labelset(labels), cumulative[-1]))
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Wall time of requests by view.',
+    ('view', 'method', 'status'),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries made per request by view.',
+    ('view',), COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time per request spent in database queries.',
+    ('view',),
+)
+REQUEST_TEMPLATE_SECONDS = Histogram(
+    'http_request_template_seconds', 'Time per request spent rendering '
+    'templates.', ('view',),
+)
+REQUEST_STRIPE_SECONDS = Histogram(
+    'http_request_stripe_seconds', 'Time per request spent waiting for '
+    'Stripe.', ('view',),
+)
+STRIPE_SECONDS = Histogram(
+    'stripe_request_duration_seconds', 'Wall time of Stripe API calls.',
+    ('method', 'status'),
+)
+
+
+def render():
+    return '\n'.join(h.render() for h in REGISTRY) + '\n'
+
+
+def reset():
+    """Zero every histogram; for tests."""
+    for histogram in REGISTRY:
+        histogram.reset()
+
+
+class _Request(object):
+    """What one request has spent so far, kept per thread."""
+
+    def __init__(self, trace):
+        self.view = 'none'
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.stripe_seconds = 0.0
+        # (seconds, sql) of every query, only for traced requests
+        self.trace = [] if trace else None
+
+
+_state = threading.local()
+
+
+def _current():
+    return getattr(_state, 'request', None)
+
+
+def label(view):
+    """Name the view the current request is counted under."""
+    current = _current()
+    if current is not None:
+        current.view = view
+
+
+def record_query(sql, seconds):
+    current = _current()
+    if current is not None:
+        current.queries += 1
+        current.db_seconds += seconds
+        if current.trace is not None:
+            current.trace.append((seconds, sql))
+
+
+def record_template(seconds):
+    current = _current()
+    if current is not None:
+        current.template_seconds += seconds
+
+
+def record_stripe(method, status, seconds):
+    STRIPE_SECONDS.observe(seconds, method, status)
+    current = _current()
+    if current is not None:
+        current.stripe_seconds += seconds
+
+
+class _TimedCursorMixin(object):
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(_TimedCursorMixin, self).execute(sql, params)
+        finally:
+            record_query(sql, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(_TimedCursorMixin, self).executemany(sql, param_list)
+        finally:
+            record_query(sql, time.time() - start)
+
+
+class TimedCursorWrapper(_TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(_TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Time every query on ``connection``; connected to connection_created.
+
+    Django 1.10 has no ``connection.execute_wrapper()``, so the connection's
+    cursor factories are replaced instead.
+    """
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(
+        cursor, connection)
+    connection.make_debug_cursor = lambda cursor: TimedCursorDebugWrapper(
+        cursor, connection)
+
+
+class _TimedTemplate(object):
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.time()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record_template(time.time() - start)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each top-level render."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(
+            super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(
+            super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+def begin():
+    """Start counting for the request this thread is about to serve."""
+    current = _state.request = _Request(
+        trace=random.random() < _conf()['TRACE_SAMPLE_RATE'])
+    return current
+
+
+def discard():
+    """Stop counting without recording the request."""
+    _state.request = None
+
+
+def finish(request, current, status, elapsed):
+    """Record the request ``begin()`` started and stop counting."""
+    _state.request = None
+    conf = _conf()
+    view = current.view
+    REQUEST_SECONDS.observe(elapsed, view, request.method, str(status))
+    REQUEST_QUERIES.observe(current.queries, view)
+    REQUEST_DB_SECONDS.observe(current.db_seconds, view)
+    REQUEST_TEMPLATE_SECONDS.observe(current.template_seconds, view)
+    REQUEST_STRIPE_SECONDS.observe(current.stripe_seconds, view)
+    if current.trace is not None and elapsed >= conf['SLOW_SECONDS']:
+        slowest = sorted(current.trace, reverse=True)
+        logger.warning(
+            'slow request method=%s path=%s view=%s status=%s '
+            'seconds=%.3f queries=%d db_seconds=%.3f '
+            'template_seconds=%.3f stripe_seconds=%.3f slowest=%r',
+            request.method, request.path, view, status, elapsed,
+            current.queries, current.db_seconds,
+            current.template_seconds, current.stripe_seconds,
+            [(round(s, 4), sql) for s, sql in
+             slowest[:conf['TRACE_QUERIES']]],
+        )
@@ -0,0 +1,180 @@
+import hashlib
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+from django.utils import translation
+
+from main import flatpages, metrics
+from payments.stripe_client import DeferredResponse
+
+DEFAULTS = {
+    'CACHE': 'pages',
+    'TIMEOUT': 600,
+    'PATHS': [],
+    # CACHE is on a store that holds other data too (multi-node mode)
+    'SHARED_STORE': False,
+}
+
+GENERATION_KEY = 'page-generation'
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'PAGE_CACHE', {}))
+
+
+def _cache():
+    return caches[_conf()['CACHE']]
+
+
+def clear(**kwargs):
+    """Drop every cached page; connected to FlatPage saves and deletes.
+
+    Clearing a shared store would take everything else in it along (with
+    memcached, every session), so there the pages are retired by starting a
+    new generation of keys instead, and expire in their own time.
+    """
+    if _conf()['SHARED_STORE']:
+        _cache().set(GENERATION_KEY, uuid.uuid4().hex, None)
+    else:
+        _cache().clear()
+
+
+def _cache_key(request):
+    url = request.build_absolute_uri()
+    key = 'page:%s:%s' % (
+        translation.get_language(),
+        hashlib.md5(url.encode('utf-8')).hexdigest(),
+    )
+    if _conf()['SHARED_STORE']:
+        key = '%s:%s' % (key, _cache().get(GENERATION_KEY, ''))
+    return key
+
+
+def _is_anonymous(request):
+    return request.session.get('user') is None
+
+
+def _has_messages(request):
+    # where CookieStorage and SessionStorage keep messages not yet shown
+    cookie = getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages')
+    return cookie in request.COOKIES or '_messages' in request.session
+
+
+class AnonymousPageCacheMiddleware(object):
+    """Serve whole pages from a cache to visitors who are not signed in.
+
+    Only GET requests whose path matches one of ``PAGE_CACHE['PATHS']`` are
+    considered, and only while the session has no ``user`` and there are no
+    messages waiting to be shown, so a signed-in visitor, or one who was just
+    sent a message, always gets a freshly rendered page.  A response is stored only if
+    it is a plain 200 that sets no cookies and did not use the CSRF token:
+    such a page is the same for every anonymous visitor whatever cookies they
+    send.  Must come after SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = [re.compile(p) for p in _conf()['PATHS']]
+
+    def __call__(self, request):
+        cacheable = (
+            request.method == 'GET' and
+            any(p.search(request.path_info) for p in self.paths) and
+            _is_anonymous(request) and
+            not _has_messages(request)
+        )
+        if not cacheable:
+            return self.get_response(request)
+
+        key = _cache_key(request)
+        response = _cache().get(key)
+        if response is not None:
+            metrics.label('page_cache')
+            return response
+
+        response = self.get_response(request)
+        if self._should_store(request, response):
+            if callable(getattr(response, 'render', None)):
+                response.add_post_render_callback(
+                    lambda r: _cache().set(key, r, _conf()['TIMEOUT'])
+                )
+            else:
+                _cache().set(key, response, _conf()['TIMEOUT'])
+        return response
+
+    def _should_store(self, request, response):
+        return (
+            response.status_code == 200 and
+            not response.streaming and
+            not response.cookies and
+            not request.META.get('CSRF_COOKIE_USED') and
+            # signing in during the request makes the page personal
+            _is_anonymous(request)
+        )
+
+
+class FlatpageFallbackMiddleware(object):
+    """Serve flatpages for 404s, like the contrib middleware of that name.
+
+    URLs are checked against ``main.flatpages``' in-memory index, so a 404
+    for anything that is not a flatpage costs no query.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.status_code != 404:
+            return response
+        try:
+            response = flatpages.serve(request, request.path_info)
+        except Http404:
+            return response
+        except Exception:
+            if settings.DEBUG:
+                raise
+            return response
+        metrics.label('flatpage')
+        return response
+
+
+class MetricsMiddleware(object):
+    """Record each request's time, queries, renders and Stripe calls.
+
+    Goes first in MIDDLEWARE so the time spent in other middleware counts.
+    Requests are counted under their view's dotted path; those answered
+    without a view are counted as 'page_cache', 'flatpage' or 'none'; the
+    first pass of a request the ASGI handler defers is not counted.  See
+    main/metrics.py.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current = metrics.begin()
+        start = time.time()
+        status = 500
+        response = None
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            if isinstance(response, DeferredResponse):
+                # the ASGI handler serves the request again once Stripe
+                # has answered; that pass is the one counted
+                metrics.discard()
+            else:
+                metrics.finish(request, current, status, time.time() - start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics.label('%s.%s' % (
+            view_func.__module__,
+            getattr(view_func, '__name__', type(view_func).__name__),
+        ))
@@ -0,0 +1,173 @@
+"""Cold-start measurements for ``manage.py startup_profile``.
+
+Each run starts a fresh interpreter with ``python -X importtime`` (Python
+3.7+) and takes it as far as one of ``TARGETS``:
+
+* ``request``: load ``WSGI_APPLICATION``, as a WSGI server does, and serve
+  one GET through it;
+* ``command``: ``django.setup()`` and the system checks, which is what
+  ``manage.py`` does before any command's ``handle()``.
+
+The child reports how long setup and the whole target took; the import
+times it writes to stderr are parsed into one row per module.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+CHILD = '''
+import io, json, os, sys, time
+start = time.time()
+timings = {}
+%s
+timings['ready'] = time.time() - start
+sys.stdout.write(json.dumps(timings))
+'''
+
+TARGETS = {
+    'request': '''
+from django.core.servers.basehttp import get_internal_wsgi_application
+application = get_internal_wsgi_application()
+timings['setup'] = time.time() - start
+statuses = []
+response = application({
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r, 'QUERY_STRING': '',
+    'SERVER_NAME': %(host)r, 'SERVER_PORT': '80', 'HTTP_HOST': %(host)r,
+    'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+    'wsgi.multithread': True, 'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+}, lambda status, headers, exc_info=None: statuses.append(status))
+b''.join(response)
+response.close()
+timings['status'] = statuses[0]
+''',
+    'command': '''
+import django
+django.setup()
+timings['setup'] = time.time() - start
+from django.core import checks
+checks.run_checks()
+''',
+}
+
+# the settings profile manage.py would pick for each target
+PROFILES = {'request': 'full', 'command': 'lean'}
+
+IMPORT_TIME = re.compile(
+    r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def parse_importtime(output):
+    """``[(module, self_seconds, cumulative_seconds, depth)]`` from the
+    stderr of ``python -X importtime``, in import order."""
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own) / 1e6, int(cumulative) / 1e6,
+                            (len(indent) - 1) // 2))
+    return modules
+
+
+def _median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else 0.0
+
+
+def supported():
+    return sys.version_info >= (3, 7)
+
+
+def run(target, profile=None, path='/', host='localhost'):
+    """Start one interpreter for ``target``; returns its measurements."""
+    if not supported():
+        # older interpreters ignore the option and report no imports
+        raise RuntimeError('python -X importtime needs Python 3.7+')
+    profile = profile or PROFILES[target]
+    env = dict(
+        os.environ,
+        SETTINGS_PROFILE=profile,
+        PYTHONPATH=os.pathsep.join(p for p in sys.path if p),
+    )
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+    script = CHILD % (TARGETS[target] % {'path': path, 'host': host})
+    start = time.time()
+    child = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=settings.BASE_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    out, err = child.communicate()
+    wall = time.time() - start
+    err = err.decode('utf-8', 'replace')
+    if child.returncode:
+        lines = [l for l in err.splitlines() if not IMPORT_TIME.match(l)]
+        raise RuntimeError('\n'.join(lines[-20:]))
+    timings = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    timings['wall'] = wall
+    timings['modules'] = parse_importtime(err)
+    return timings
+
+
+def profile(target, runs=1, **kwargs):
+    """Median timings of ``runs`` cold starts, with per-module and
+    per-package import times."""
+    results = [run(target, **kwargs) for _ in range(runs)]
+    own = {}
+    cumulative = {}
+    for result in results:
+        for name, self_s, cumulative_s, depth in result['modules']:
+            own.setdefault(name, []).append(self_s)
+            cumulative.setdefault(name, []).append(cumulative_s)
+    modules = sorted(
+        ((name, _median(own[name]), _median(cumulative[name]))
+         for name in own), key=lambda m: -m[2])
+    packages = {}
+    for name, self_s, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_s
+    return {
+        'target': target,
+        'profile': kwargs.get('profile') or PROFILES[target],
+        'runs': runs,
+        'status': results[-1].get('status'),
+        'wall': _median([r['wall'] for r in results]),
+        'setup': _median([r['setup'] for r in results]),
+        'ready': _median([r['ready'] for r in results]),
+        'imports': sum(m[1] for m in modules),
+        'module_count': len(modules),
+        'modules': modules,
+        'packages': sorted(packages.items(), key=lambda p: -p[1]),
+    }
+
+
+def ms(seconds):
+    return '%.1f' % (seconds * 1000)
+
+
+def format_report(report, limit=25):
+    lines = [
+        '%s (%s profile), median of %d: process %s ms, setup %s ms, '
+        'ready %s ms%s' % (
+            report['target'], report['profile'], report['runs'],
+            ms(report['wall']), ms(report['setup']), ms(report['ready']),
+            ', %s' % report['status'] if report['status'] else ''),
+        '%d modules imported in %s ms' % (
+            report['module_count'], ms(report['imports'])),
+        '',
+        '%-50s %10s %10s' % ('module', 'self ms', 'cumul ms'),
+    ]
+    for name, self_s, cumulative_s in report['modules'][:limit]:
+        lines.append('%-50s %10s %10s' % (name, ms(self_s), ms(cumulative_s)))
+    lines += ['', '%-50s %10s' % ('package', 'self ms')]
+    for package, self_s in report['packages'][:limit]:
+        lines.append('%-50s %10s' % (package, ms(self_s)))
+    return '\n'.join(lines)
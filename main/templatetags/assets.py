@@ -0,0 +1,17 @@
+from django import template
+from django.utils.html import format_html_join
+
+from main import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def bundle(name):
+    """The tags that load the ``STATIC_ASSETS`` bundle ``name``."""
+    urls = [(url,) for url in assets.urls(name)]
+    if name.endswith('.css'):
+        return format_html_join('\n', '<link href="{}" rel="stylesheet">',
+                                urls)
+    return format_html_join(
+        '\n    ', '<script src="{}" type="text/javascript"></script>', urls)
@@ -5,6 +5,44 @@ from django.shortcuts import render, render_to_response
 from payments.models import User
 import mock
 from django.test import RequestFactory
+import datetime
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from io import StringIO
+from django.db import connection
+from django_ecommerce import db
+from django.contrib.flatpages.models import FlatPage
+from django.core.cache import caches
+from main import flatpages
+import threading
+from main import metrics
+import random
+import shutil
+import tempfile
+from main import bench
+from payments import stripe_client
+from payments.stripe_stub import StripeStub
+import gzip
+import os
+from django.template import Context, Template
+from main import assets
+import runpy
+from django.conf import settings
+from main import locks
+from main import middleware as page_middleware
+import sys
+import unittest
+from django.core.management.base import CommandError
+from main import startup
+import calendar
+import io
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+from main import compression, conditional
 
 class MainPageTests(TestCase):
 
@@ -45,9 +83,10 @@ class MainPageTests(TestCase):
 
 		self.request.session = {"user": "1"}
 
-		with mock.patch('main.views.User') as user_mock:
+		with mock.patch('payments.middleware.User') as user_mock:
 
-			config = {'get.return_value': mock.Mock()}
+			config = {'get_by_id.return_value': mock.Mock(
+				updated_at=timezone.now())}
 
 			user_mock.configure_mock(**config)
 
@@ -55,6 +94,782 @@ class MainPageTests(TestCase):
 
 			self.request.session = {}
 
-			expectedHtml = render_to_response('user.html', {'user': user_mock.get_by_id(1)}).content
+			expected_html = render_to_response('user.html', {'user': user_mock.get_by_id(1)})
 
-			self.assertEquals(resp.content, expected_html.content)
\ No newline at end of file
+			self.assertEquals(resp.content, expected_html.content)
+
+
+class MainPageQueryTests(TestCase):
+
+	def setUp(self):
+		from payments import user_cache
+		user_cache.clear()
+		self.user = User(name='jj', email='j@j.com')
+		self.user.save()
+
+	def tearDown(self):
+		from payments import user_cache
+		user_cache.clear()
+
+	def get_request(self):
+		request = RequestFactory().get('/')
+		request.session = {'user': self.user.pk}
+		return request
+
+	def test_logged_in_index_reuses_cached_user(self):
+		index(self.get_request())
+
+		with self.assertNumQueries(0):
+			resp = index(self.get_request())
+
+		self.assertIn(b'Welcome jj.', resp.content)
+
+
+class SweepSessionsTests(TestCase):
+
+	def create_session(self, expires_in):
+		store = SessionStore()
+		return Session.objects.create(
+			session_key=store._get_new_session_key(),
+			session_data=store.encode({'user': 1}),
+			expire_date=timezone.now() + datetime.timedelta(days=expires_in),
+		).pk
+
+	def test_removes_only_expired_rows_in_batches(self):
+		live = self.create_session(1)
+		for i in range(5):
+			self.create_session(-1)
+
+		out = StringIO()
+		call_command('sweep_sessions', batch_size=2, stdout=out)
+
+		self.assertIn('Removed 5 expired session(s)', out.getvalue())
+		self.assertEqual(
+			list(Session.objects.values_list('pk', flat=True)), [live]
+		)
+
+	@override_settings(
+		SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies'
+	)
+	def test_signed_cookies_have_nothing_to_sweep(self):
+		self.create_session(-1)
+
+		out = StringIO()
+		call_command('sweep_sessions', stdout=out)
+
+		self.assertIn('nothing to sweep', out.getvalue())
+		self.assertEqual(Session.objects.count(), 1)
+
+	def test_unknown_session_mode_is_refused(self):
+		with mock.patch.dict(os.environ, {'SESSION_MODE': 'memcache'}):
+			with self.assertRaisesRegexp(ImproperlyConfigured,
+					'cache, cached_db, db, signed_cookies'):
+				runpy.run_path(os.path.join(
+					settings.BASE_DIR, 'django_ecommerce', 'settings.py'))
+
+
+class DatabaseProfileTests(TestCase):
+
+	def test_sqlite_connections_get_pragmas(self):
+		with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+			db.configure_sqlite(sender=None, connection=connection)
+
+		cursor = connection.cursor()
+		cursor.execute('PRAGMA busy_timeout')
+		self.assertEqual(cursor.fetchone()[0], 1234)
+
+	def test_router_reads_from_replica_until_a_write(self):
+		router = db.PrimaryReplicaRouter()
+		db.unpin_primary()
+
+		self.assertEqual(router.db_for_read(User), 'replica')
+		self.assertEqual(router.db_for_write(User), 'default')
+		self.assertEqual(router.db_for_read(User), 'default')
+
+		db.unpin_primary()
+		self.assertEqual(router.db_for_read(User), 'replica')
+
+	def test_router_only_migrates_primary(self):
+		router = db.PrimaryReplicaRouter()
+
+		self.assertTrue(router.allow_migrate('default', 'payments'))
+		self.assertFalse(router.allow_migrate('replica', 'payments'))
+
+
+class AnonymousPageCacheTests(TestCase):
+
+	def setUp(self):
+		caches['pages'].clear()
+		flatpages.reset()
+		self.page = FlatPage.objects.create(
+			url='/pages/about/', title='About', content='Version one'
+		)
+		self.page.sites.add(1)
+
+	def tearDown(self):
+		caches['pages'].clear()
+		flatpages.reset()
+
+	def test_flatpage_is_served_from_cache(self):
+		self.assertContains(self.client.get('/pages/about/'), 'Version one')
+
+		with self.assertNumQueries(0):
+			resp = self.client.get('/pages/about/')
+		self.assertContains(resp, 'Version one')
+
+	def test_saving_flatpage_invalidates_cache(self):
+		self.client.get('/pages/about/')
+		self.page.content = 'Version two'
+		self.page.save()
+
+		self.assertContains(self.client.get('/pages/about/'), 'Version two')
+
+	def test_signed_in_user_bypasses_cache(self):
+		self.client.get('/')
+		user = User(name='jj', email='j@j.com')
+		user.save()
+		session = self.client.session
+		session['user'] = user.pk
+		session.save()
+
+		self.assertContains(self.client.get('/'), 'Welcome jj.')
+
+	def test_waiting_messages_bypass_cache(self):
+		self.client.get('/')
+		resp = self.client.post('/contact/', {
+			'name': 'Sam', 'email': 'sam@example.com', 'topic': 'Hi',
+			'message': 'Hello',
+		}, follow=True)
+
+		self.assertContains(resp, 'has been sent')
+		# shown once, then the cached page is served again
+		with self.assertNumQueries(0):
+			self.assertNotContains(self.client.get('/'), 'has been sent')
+
+	@override_settings(PAGE_CACHE={'PATHS': [r'^/register$']})
+	def test_pages_using_csrf_token_are_not_stored(self):
+		# the first response sets the CSRF cookie, later ones reuse it
+		self.client.get('/register')
+		first = self.client.get('/register')
+		second = self.client.get('/register')
+
+		self.assertNotEqual(first.content, second.content)
+
+
+class FlatpageIndexTests(TestCase):
+
+	def setUp(self):
+		flatpages.reset()
+		self.page = FlatPage.objects.create(
+			url='/about/', title='About', content='All about us'
+		)
+		self.page.sites.add(1)
+
+	def tearDown(self):
+		flatpages.reset()
+
+	def test_unknown_url_costs_no_query(self):
+		self.client.get('/no-such-page/')
+
+		with self.assertNumQueries(0):
+			resp = self.client.get('/wp-login.php')
+		self.assertEqual(resp.status_code, 404)
+
+	def test_page_is_rendered_once(self):
+		self.assertContains(self.client.get('/about/'), 'All about us')
+
+		with self.assertNumQueries(0):
+			resp = self.client.get('/about/')
+		self.assertContains(resp, 'All about us')
+
+	def test_missing_slash_redirects(self):
+		resp = self.client.get('/about')
+		self.assertEqual(resp.status_code, 301)
+		self.assertTrue(resp['Location'].endswith('/about/'))
+
+	def test_index_follows_page_changes(self):
+		self.client.get('/about/')
+
+		self.page.url = '/about-us/'
+		self.page.content = 'Moved'
+		self.page.save()
+		self.assertEqual(self.client.get('/about/').status_code, 404)
+		self.assertContains(self.client.get('/about-us/'), 'Moved')
+
+		self.page.sites.clear()
+		self.assertEqual(self.client.get('/about-us/').status_code, 404)
+
+		self.page.sites.add(1)
+		self.page.delete()
+		self.assertEqual(self.client.get('/about-us/').status_code, 404)
+
+
+class MetricsTests(TestCase):
+
+	def setUp(self):
+		metrics.reset()
+
+	def series(self, histogram, *labels):
+		return histogram.collect().get(labels, ([0], 0.0))
+
+	def test_histogram_text_format(self):
+		histogram = metrics.Histogram('test_seconds', 'Test.', ('view',),
+			buckets=(0.1, 1))
+		metrics.REGISTRY.remove(histogram)
+		for value in (0.05, 0.5, 5):
+			histogram.observe(value, 'home')
+
+		self.assertEqual(histogram.render().splitlines(), [
+			'# HELP test_seconds Test.',
+			'# TYPE test_seconds histogram',
+			'test_seconds_bucket{view="home",le="0.1"} 1',
+			'test_seconds_bucket{view="home",le="1"} 2',
+			'test_seconds_bucket{view="home",le="+Inf"} 3',
+			'test_seconds_sum{view="home"} 5.55',
+			'test_seconds_count{view="home"} 3',
+		])
+
+	def test_observations_from_every_thread_are_counted(self):
+		def observe():
+			for _ in range(1000):
+				metrics.REQUEST_QUERIES.observe(1, 'threads')
+
+		threads = [threading.Thread(target=observe) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		cumulative, total = self.series(metrics.REQUEST_QUERIES, 'threads')
+		self.assertEqual(cumulative[-1], 4000)
+		self.assertEqual(total, 4000)
+
+	def test_exited_threads_leave_no_shards_behind(self):
+		histogram = metrics.Histogram('test_seconds', 'Test.', ('view',))
+		metrics.REGISTRY.remove(histogram)
+		histogram.observe(1, 'home')
+		for _ in range(20):
+			thread = threading.Thread(target=histogram.observe,
+				args=(2, 'home'))
+			thread.start()
+			thread.join()
+
+		self.assertEqual(len(histogram._shards), 1)
+		cumulative, total = histogram.collect()[('home',)]
+		self.assertEqual((cumulative[-1], total), (21, 41))
+
+	def test_requests_are_recorded_by_view(self):
+		user = User(name='metrics', email='metrics@rocks.com')
+		user.set_password('password')
+		user.save()
+		session = self.client.session
+		session['user'] = user.pk
+		session.save()
+
+		self.client.get('/')
+
+		view = 'main.views.index'
+		cumulative, seconds = self.series(
+			metrics.REQUEST_SECONDS, view, 'GET', '200')
+		self.assertEqual(cumulative[-1], 1)
+		self.assertGreater(seconds, 0)
+		cumulative, queries = self.series(metrics.REQUEST_QUERIES, view)
+		self.assertGreaterEqual(queries, 1)
+		cumulative, rendering = self.series(
+			metrics.REQUEST_TEMPLATE_SECONDS, view)
+		self.assertGreater(rendering, 0)
+
+	@override_settings(METRICS={'SLOW_SECONDS': 0, 'TRACE_SAMPLE_RATE': 1})
+	def test_slow_requests_are_traced(self):
+		with self.assertLogs('main.metrics', 'WARNING') as logs:
+			self.client.get('/sign_in')
+
+		self.assertIn('view=payments.views.sign_in', logs.output[0])
+		self.assertIn('template_seconds=', logs.output[0])
+
+	def test_metrics_endpoint(self):
+		self.client.get('/sign_in')
+
+		resp = self.client.get('/metrics')
+		self.assertEqual(resp.status_code, 200)
+		self.assertIn(
+			b'http_request_duration_seconds_count{'
+			b'view="payments.views.sign_in",method="GET",status="200"} 1',
+			resp.content)
+
+		resp = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+		self.assertEqual(resp.status_code, 403)
+
+
+class BenchHarnessTests(TestCase):
+
+	def test_every_route_has_a_scenario(self):
+		self.assertEqual(
+			[key for key in bench.route_keys() if key not in bench.SCENARIOS], [])
+
+	def test_scenarios_run_without_errors(self):
+		stub = StripeStub().start()
+		self.addCleanup(stub.stop)
+		self.addCleanup(stripe_client.reset)
+		stripe_client.reset()
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root)
+		scale = {'users': 3, 'messages': 5, 'flatpages': 2, 'sessions': 2}
+
+		with override_settings(**bench.overrides(root)):
+			data = bench.seed(scale, stub, random.Random(0))
+			results, missing = bench.run(data, requests=2, concurrency=1)
+
+		self.assertEqual(missing, [])
+		self.assertEqual(
+			[(r['label'], r['errors']) for r in results if r['errors']], [])
+		self.assertEqual(
+			len(results), sum(len(s) for s in bench.SCENARIOS.values()))
+
+	def test_compare_flags_regressions(self):
+		def result(label, p95, queries, errors=0):
+			return {'label': label, 'p95_ms': p95, 'throughput_rps': 100,
+				'queries_per_request': queries, 'errors': errors}
+
+		baseline = {'results': [
+			result('steady', 10, 2), result('slower', 10, 2),
+			result('chattier', 10, 2), result('failing', 10, 2),
+		]}
+		rows, regressions = bench.compare([
+			result('steady', 11, 2), result('slower', 13, 2),
+			result('chattier', 10, 3), result('failing', 10, 2, errors=1),
+			result('new', 10, 2),
+		], baseline, tolerance=0.2)
+
+		self.assertEqual(regressions, ['slower', 'chattier', 'failing'])
+		self.assertEqual([r['verdict'] for r in rows],
+			['ok', 'slower', 'more queries', 'errors'])
+
+
+class StaticAssetTests(TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.root)
+		override = override_settings(STATIC_ASSETS={
+			'ROOT': self.root,
+			'BUNDLES': {'app.js': ['jquery.js', 'application.js']},
+		})
+		override.enable()
+		self.addCleanup(override.disable)
+		assets.reset()
+		self.addCleanup(assets.reset)
+
+	def render_bundle(self):
+		return Template("{% load assets %}{% bundle 'app.js' %}").render(
+			Context())
+
+	def test_unbuilt_bundle_links_its_sources(self):
+		html = self.render_bundle()
+
+		self.assertIn('src="/static/jquery.js"', html)
+		self.assertIn('src="/static/application.js"', html)
+
+	def test_build_writes_hashed_minified_bundle(self):
+		stats = assets.build()['app.js']
+
+		name = stats['name']
+		self.assertRegexpMatches(name, r'^app\.[0-9a-f]{12}\.js$')
+		with open(os.path.join(self.root, name), 'rb') as f:
+			content = f.read()
+		# jquery.min.js stands in for jquery.js
+		self.assertLess(len(content), 100000)
+		self.assertIn(b'$("#user_form")', content)
+		with gzip.open(os.path.join(self.root, name + '.gz')) as f:
+			self.assertEqual(f.read(), content)
+		self.assertEqual(assets.manifest(), {'app.js': name})
+		self.assertEqual(self.render_bundle(),
+			'<script src="/assets/%s" type="text/javascript"></script>'
+			% name)
+
+		# the same sources build the same file
+		self.assertEqual(assets.build()['app.js']['name'], name)
+
+	def test_serves_precompressed_file_for_good(self):
+		name = assets.build()['app.js']['name']
+
+		resp = self.client.get('/assets/' + name,
+			HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertEqual(resp['Vary'], 'Accept-Encoding')
+		self.assertIn('immutable', resp['Cache-Control'])
+		self.assertIn('max-age=31536000', resp['Cache-Control'])
+		self.assertEqual(int(resp['Content-Length']),
+			os.path.getsize(os.path.join(self.root, name + '.gz')))
+
+		resp = self.client.get('/assets/' + name,
+			HTTP_ACCEPT_ENCODING='gzip;q=0')
+		self.assertFalse(resp.has_header('Content-Encoding'))
+		self.assertIn('javascript', resp['Content-Type'])
+
+	def test_prefers_brotli_when_present(self):
+		name = assets.build()['app.js']['name']
+		with open(os.path.join(self.root, name + '.br'), 'wb') as f:
+			f.write(b'brotli')
+
+		resp = self.client.get('/assets/' + name,
+			HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+		self.assertEqual(resp['Content-Encoding'], 'br')
+		self.assertEqual(b''.join(resp.streaming_content), b'brotli')
+
+	def test_command_writes_minified_and_brotli_copies(self):
+		call_command('build_assets', stdout=StringIO())
+
+		name = assets.manifest()['app.js']
+		with open(os.path.join(self.root, name), 'rb') as f:
+			content = f.read()
+		# application.js, minified by rjsmin
+		self.assertNotIn(b'\n\n', content)
+		self.assertTrue(os.path.exists(os.path.join(self.root, name + '.br')))
+
+	def test_command_refuses_to_build_without_its_packages(self):
+		with mock.patch.object(assets, 'rjsmin', None):
+			with self.assertRaisesRegexp(CommandError, 'rjsmin'):
+				call_command('build_assets', stdout=StringIO())
+
+		self.assertEqual(assets.manifest(), {})
+
+	def test_unknown_names_are_not_found(self):
+		assets.build()
+
+		for name in ('app.js', 'manifest.json', '..%2Fsettings.py'):
+			self.assertEqual(
+				self.client.get('/assets/' + name).status_code, 404)
+
+
+# every alias on one LocMemCache, as they share one memcached in production
+SHARED_CACHES = dict(
+	(alias, {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'shared-state',
+		'KEY_PREFIX': alias,
+	}) for alias in settings.CACHES
+)
+
+class MultiNodeTests(TestCase):
+
+	def setUp(self):
+		caches['default'].clear()
+		flatpages.reset()
+
+	def tearDown(self):
+		caches['default'].clear()
+		flatpages.reset()
+
+	def test_multi_node_settings_share_one_store(self):
+		env = {
+			'DEPLOYMENT_MODE': 'multi',
+			'SHARED_STATE_BACKEND':
+				'django.core.cache.backends.locmem.LocMemCache',
+			'SHARED_STATE_LOCATION': 'shared-state',
+		}
+		with mock.patch.dict(os.environ, env):
+			conf = runpy.run_path(
+				os.path.join(settings.BASE_DIR, 'django_ecommerce',
+					'settings.py'))
+
+		self.assertEqual(conf['CACHES'], dict(
+			(alias, {
+				'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+				'LOCATION': 'shared-state',
+				'KEY_PREFIX': alias,
+			}) for alias in ('default', 'sessions', 'pages',
+				'template_fragments')
+		))
+		self.assertEqual(conf['SESSION_ENGINE'],
+			'django.contrib.sessions.backends.cached_db')
+		self.assertEqual(conf['SIGN_IN_RATE_LIMIT']['CACHE'], 'default')
+		self.assertTrue(conf['SIGN_IN_RATE_LIMIT']['LOCK'])
+		self.assertEqual(conf['USER_PROFILE_CACHE']['SHARED_CACHE'], 'default')
+		self.assertEqual(conf['FLATPAGE_CACHE']['SHARED_CACHE'], 'default')
+		self.assertTrue(conf['PAGE_CACHE']['SHARED_STORE'])
+
+	def test_lock_excludes_other_holders(self):
+		with locks.lock('job'):
+			with self.assertRaises(locks.LockTimeout):
+				with locks.lock('job', wait=0):
+					pass
+		with locks.lock('job', wait=0):
+			pass
+
+	def test_lapsed_lock_is_not_released_by_its_old_holder(self):
+		with locks.lock('job', timeout=10):
+			# it lapsed, and another process took it
+			caches['default'].set('lock:job', 'theirs')
+		self.assertEqual(caches['default'].get('lock:job'), 'theirs')
+
+	@override_settings(FLATPAGE_CACHE={'SHARED_CACHE': 'default'})
+	def test_flatpage_changes_reach_other_processes(self):
+		page = FlatPage.objects.create(url='/about/', title='About')
+		page.sites.add(1)
+		self.assertEqual(flatpages.lookup('/about/'), page.pk)
+
+		# another process moves the page; no signal reaches this one
+		FlatPage.objects.filter(pk=page.pk).update(url='/team/')
+		caches['default'].set(flatpages.VERSION_KEY, 'from-elsewhere')
+
+		self.assertIsNone(flatpages.lookup('/about/'))
+		self.assertEqual(flatpages.lookup('/team/'), page.pk)
+
+	@override_settings(FLATPAGE_CACHE={'SHARED_CACHE': 'default'})
+	def test_flatpage_changes_are_announced_again_on_commit(self):
+		page = FlatPage.objects.create(url='/about/', title='About')
+		page.sites.add(1)
+		flatpages.lookup('/about/')
+		with mock.patch('django.db.transaction.on_commit') as on_commit:
+			page.url = '/team/'
+			page.save()
+		# another process may reload the uncommitted index under this stamp
+		stamp = caches['default'].get(flatpages.VERSION_KEY)
+
+		for call in on_commit.call_args_list:
+			call[0][0]()
+		self.assertNotEqual(
+			caches['default'].get(flatpages.VERSION_KEY), stamp)
+		with self.assertNumQueries(0):
+			self.assertEqual(flatpages.lookup('/team/'), page.pk)
+
+	@override_settings(FLATPAGE_CACHE={'SHARED_CACHE': 'default'})
+	def test_own_flatpage_changes_keep_the_index(self):
+		page = FlatPage.objects.create(url='/about/', title='About')
+		page.sites.add(1)
+		flatpages.lookup('/about/')
+		page.url = '/team/'
+		page.save()
+
+		with self.assertNumQueries(0):
+			self.assertEqual(flatpages.lookup('/team/'), page.pk)
+
+	@override_settings(
+		CACHES=SHARED_CACHES,
+		SESSION_ENGINE='django.contrib.sessions.backends.cache',
+		PAGE_CACHE={'PATHS': [r'^/$'], 'SHARED_STORE': True},
+	)
+	def test_clearing_pages_keeps_sessions(self):
+		self.client.get('/')
+		session = self.client.session
+		session['visits'] = 1
+		session.save()
+		key = page_middleware._cache_key(RequestFactory().get('/'))
+
+		page_middleware.clear()
+
+		self.assertEqual(self.client.session['visits'], 1)
+		self.assertNotEqual(
+			page_middleware._cache_key(RequestFactory().get('/')), key)
+
+
+class StartupProfileTests(TestCase):
+
+	def test_parses_importtime_output(self):
+		modules = startup.parse_importtime(
+			'import time: self [us] | cumulative | imported package\n'
+			'import time:       120 |        120 |     stripe.error\n'
+			'import time:      2000 |       2120 |   stripe\n'
+			'Traceback (most recent call last):\n'
+		)
+
+		self.assertEqual(modules, [
+			('stripe.error', 0.00012, 0.00012, 2),
+			('stripe', 0.002, 0.00212, 1),
+		])
+
+	def test_lean_settings_serve_nothing(self):
+		with mock.patch.dict(os.environ, {'SETTINGS_PROFILE': 'lean'}):
+			conf = runpy.run_path(
+				os.path.join(settings.BASE_DIR, 'django_ecommerce',
+					'settings.py'))
+
+		self.assertEqual(conf['ROOT_URLCONF'], 'django_ecommerce.urls_lean')
+		self.assertNotIn('django.contrib.admin', conf['INSTALLED_APPS'])
+		self.assertEqual(conf['MIDDLEWARE'], [])
+
+	def test_command_refuses_interpreters_without_importtime(self):
+		with mock.patch.object(startup, 'supported', return_value=False):
+			self.assertRaises(CommandError, call_command, 'startup_profile')
+			self.assertRaises(RuntimeError, startup.run, 'command')
+
+	@unittest.skipUnless(sys.version_info >= (3, 7),
+		'python -X importtime needs Python 3.7+')
+	def test_cold_starts_leave_stripe_unimported(self):
+		for target in ('command', 'request'):
+			report = startup.profile(target)
+			names = [name for name, _, _ in report['modules']]
+
+			self.assertIn('django', names)
+			self.assertNotIn('stripe', names)
+		self.assertEqual(report['status'], '200 OK')
+		self.assertLess(report['setup'], report['ready'])
+
+
+def gunzip(content):
+	return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+class CompressionTests(TestCase):
+
+	def setUp(self):
+		caches['pages'].clear()
+		self.addCleanup(caches['pages'].clear)
+
+	def compress(self, response, accept='gzip', **meta):
+		request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+		request.META.update(meta)
+		return compression.CompressionMiddleware(lambda r: response)(request)
+
+	def test_negotiates_gzip(self):
+		plain = self.client.get('/')
+		resp = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertIn('Accept-Encoding', resp['Vary'])
+		self.assertEqual(gunzip(resp.content), plain.content)
+		self.assertEqual(int(resp['Content-Length']), len(resp.content))
+		self.assertLess(len(resp.content), len(plain.content))
+		self.assertEqual(resp['ETag'], 'W/' + plain['ETag'])
+
+		resp = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0, br;q=0')
+		self.assertFalse(resp.has_header('Content-Encoding'))
+
+	def test_prefers_brotli_when_installed(self):
+		response = HttpResponse('x' * 1000)
+		with mock.patch.object(compression, 'brotli') as brotli:
+			brotli.compress.return_value = b'brotli'
+			resp = self.compress(response, 'gzip, br')
+
+		self.assertEqual(resp['Content-Encoding'], 'br')
+		self.assertEqual(resp.content, b'brotli')
+
+	def test_small_and_encoded_responses_are_left_alone(self):
+		for response in (HttpResponse('x' * 100),
+				HttpResponse(b'\x1f\x8b', content_type='image/png')):
+			self.assertFalse(
+				self.compress(response).has_header('Content-Encoding'))
+		response = HttpResponse('x' * 1000)
+		response['Content-Encoding'] = 'br'
+		self.assertEqual(self.compress(response).content, b'x' * 1000)
+
+	def test_streaming_responses_are_compressed_in_chunks(self):
+		chunks = [b'chunk %d ' % i * 50 for i in range(5)]
+		resp = self.compress(StreamingHttpResponse(iter(chunks)))
+
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertFalse(resp.has_header('Content-Length'))
+		parts = list(resp.streaming_content)
+		self.assertGreater(len(parts), 2)
+		self.assertEqual(gunzip(b''.join(parts)), b''.join(chunks))
+
+	def test_csrf_pages_are_padded(self):
+		response = HttpResponse('<input name="csrf" value="s3cret">' * 20)
+		with mock.patch.object(compression, 'brotli'):
+			resp = self.compress(response, 'gzip, br',
+				CSRF_COOKIE_USED=True)
+
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		# FNAME is set, holding the random padding
+		self.assertTrue(bytearray(resp.content)[3] & 0x08)
+		self.assertEqual(gunzip(resp.content),
+			b'<input name="csrf" value="s3cret">' * 20)
+
+	@override_settings(COMPRESSION={'CSRF_PAGES': 'skip'})
+	def test_csrf_pages_can_be_skipped(self):
+		resp = self.client.get('/register', HTTP_ACCEPT_ENCODING='gzip')
+
+		self.assertFalse(resp.has_header('Content-Encoding'))
+		self.assertIn('Accept-Encoding', resp['Vary'])
+
+
+class ConditionalGetTests(TestCase):
+
+	def setUp(self):
+		caches['pages'].clear()
+		flatpages.reset()
+		conditional.reset()
+		self.addCleanup(caches['pages'].clear)
+		self.addCleanup(flatpages.reset)
+
+	def sign_in(self):
+		user = User(name='jj', email='j@j.com')
+		user.save()
+		session = self.client.session
+		session['user'] = user.pk
+		session.save()
+		return user
+
+	def test_signed_in_index(self):
+		user = self.sign_in()
+		resp = self.client.get('/')
+		self.assertContains(resp, 'Welcome jj.')
+
+		resp = self.client.get('/', HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 304)
+		self.assertEqual(resp.content, b'')
+		since = http_date(calendar.timegm(user.updated_at.utctimetuple()))
+		resp = self.client.get('/', HTTP_IF_MODIFIED_SINCE=since)
+		self.assertEqual(resp.status_code, 304)
+
+	def test_saving_the_user_changes_the_etag(self):
+		user = self.sign_in()
+		etag = self.client.get('/')['ETag']
+
+		user.name = 'jo'
+		user.save()
+		resp = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+		self.assertContains(resp, 'Welcome jo.')
+		self.assertNotEqual(resp['ETag'], etag)
+
+	def test_anonymous_index_from_the_page_cache(self):
+		etag = self.client.get('/')['ETag']
+
+		with self.assertNumQueries(0):
+			resp = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+
+		self.sign_in()
+		self.assertNotEqual(self.client.get('/')['ETag'], etag)
+
+	def test_flatpages(self):
+		page = FlatPage.objects.create(
+			url='/pages/about/', title='About', content='Version one'
+		)
+		page.sites.add(1)
+		resp = self.client.get('/pages/about/')
+		etag = resp['ETag']
+		self.assertTrue(resp.has_header('Last-Modified'))
+
+		resp = self.client.get('/pages/about/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+
+		page.content = 'Version two'
+		page.save()
+		resp = self.client.get('/pages/about/', HTTP_IF_NONE_MATCH=etag)
+		self.assertContains(resp, 'Version two')
+		self.assertNotEqual(resp['ETag'], etag)
+
+	def test_private_flatpages_are_not_conditional(self):
+		page = FlatPage.objects.create(
+			url='/pages/members/', title='Members', content='Hello',
+			registration_required=True,
+		)
+		page.sites.add(1)
+
+		resp = self.client.get('/pages/members/')
+		self.assertEqual(resp.status_code, 302)
+		self.assertFalse(resp.has_header('ETag'))
+		self.assertFalse(resp.has_header('Last-Modified'))
+
+	def test_pending_messages_are_shown(self):
+		self.sign_in()
+		etag = self.client.get('/')['ETag']
+
+		self.client.post('/contact/', {
+			'name': 'Sam', 'email': 'sam@example.com', 'topic': 'Hi',
+			'message': 'Hello',
+		})
+		resp = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+		self.assertContains(resp, 'Your message has been sent.')
@@ -1,14 +1,52 @@
+import mimetypes
+import os
+
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseForbidden,
+)
 from django.shortcuts import render
-from payments.models import User
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+from main import assets, conditional, metrics
+from payments.middleware import get_user_profile
 
 
+@condition(etag_func=conditional.index_etag,
+           last_modified_func=conditional.index_last_modified)
 def index(request):
-    uid = request.session.get('user')
-    if uid is None:
+    user = get_user_profile(request)
+    if user is None:
         return render(request, 'index.html')
     else:
         return render(
             request,
             'user.html',
-            {'user': User.get_by_id(uid)}
+            {'user': user}
         )
+
+
+def metrics_view(request):
+    """Histograms from main.metrics in Prometheus' text format."""
+    if request.META.get('REMOTE_ADDR') not in metrics._conf()['ALLOWED_IPS']:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+def asset(request, name):
+    """A file built by ``manage.py build_assets``, precompressed if the
+    client accepts it.  Names change with content, so clients may keep
+    each one for good."""
+    path, encoding = assets.find(
+        name, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if path is None:
+        raise Http404('No asset %r' % name)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Content-Length'] = os.path.getsize(path)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, public=True, immutable=True,
+                        max_age=assets._conf()['MAX_AGE'])
+    return response
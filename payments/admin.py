@@ -1,9 +1,30 @@
 from django.contrib import admin
-from .models import User
+from .models import User, CustomerJob, StripeCustomer, StripeEvent
 
 
 class UserAdmin(admin.ModelAdmin):
 	class Meta:
 		model = User
 
-admin.site.register(User, UserAdmin)
\ No newline at end of file
+admin.site.register(User, UserAdmin)
+
+class CustomerJobAdmin(admin.ModelAdmin):
+	list_display = ('user', 'status', 'attempts', 'run_after')
+	list_filter = ('status',)
+
+admin.site.register(CustomerJob, CustomerJobAdmin)
+
+class StripeEventAdmin(admin.ModelAdmin):
+	list_display = ('event_id', 'type', 'created', 'processed_at')
+	list_filter = ('type',)
+	search_fields = ('=event_id',)
+
+admin.site.register(StripeEvent, StripeEventAdmin)
+
+class StripeCustomerAdmin(admin.ModelAdmin):
+	list_display = ('stripe_id', 'email', 'last_4_digits', 'plan',
+		'subscription_status', 'synced_at')
+	list_filter = ('subscription_status', 'delinquent', 'deleted')
+	search_fields = ('=stripe_id', '=email')
+
+admin.site.register(StripeCustomer, StripeCustomerAdmin)
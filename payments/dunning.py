@@ -0,0 +1,122 @@
+"""Reminder notices for ``UnpaidUsers``.
+
+A row is due once its ``last_notification`` is more than ``INTERVAL`` old.
+Workers (``manage.py send_dunning_notices``) claim due rows a batch at a
+time, hand them to the configured transport, and stamp every row that was
+sent with one ``UPDATE``.  Any number of workers can run side by side.
+
+Django 1.10 has no ``select_for_update(skip_locked=True)``, and SQLite no row
+locks at all, so a batch is claimed the way ``payments.provisioning`` claims
+jobs: a conditional ``UPDATE`` that leases the candidate rows to this worker
+if they are still due and no other worker holds a live lease on them.  Rows
+that another worker took (or sent) first are simply left out of the batch,
+so workers never wait on each other's rows; a worker that dies only delays
+its batch until the lease expires.
+"""
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from payments.models import UnpaidUsers
+
+DEFAULTS = {
+    'INTERVAL': 7 * 24 * 60 * 60,  # seconds
+    'LEASE': 5 * 60,
+    'BATCH_SIZE': 500,
+    'TRANSPORT': 'payments.dunning.EmailTransport',
+    'FROM_EMAIL': None,
+}
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'DUNNING', {}))
+
+
+class EmailTransport(object):
+    """Send each notice as an email through ``EMAIL_BACKEND``.
+
+    All of a batch's messages go through one backend connection.  With a
+    local backend (console, file or locmem) nothing leaves the machine.
+    """
+
+    subject = 'Your payment is overdue'
+    body = (
+        'We could not take payment for your account. Please sign in and '
+        'update your card details to keep your membership active.'
+    )
+
+    def send(self, unpaid):
+        """Notify every row in ``unpaid``; return the pks that were sent."""
+        messages = [
+            mail.EmailMessage(self.subject, self.body,
+                              _conf()['FROM_EMAIL'], [row.email])
+            for row in unpaid
+        ]
+        with mail.get_connection() as connection:
+            connection.send_messages(messages)
+        return [row.pk for row in unpaid]
+
+
+def get_transport():
+    return import_string(_conf()['TRANSPORT'])()
+
+
+def _due(now, conf):
+    """Rows due a notice that no worker holds a live lease on."""
+    return UnpaidUsers.objects.filter(
+        last_notification__lte=now - datetime.timedelta(
+            seconds=conf['INTERVAL']),
+    ).exclude(
+        locked_until__gt=now,
+    )
+
+
+def _candidates(limit, now, conf):
+    return list(_due(now, conf).order_by(
+        'last_notification').values_list('pk', flat=True)[:limit])
+
+
+def claim(limit, now=None):
+    """Lease up to ``limit`` due rows to this worker.
+
+    Returns ``(rows, lost)``, where ``lost`` counts candidates another
+    worker claimed, or claimed and notified, between our select and our
+    update.
+    """
+    conf = _conf()
+    now = now or timezone.now()
+    candidates = _candidates(limit, now, conf)
+    if not candidates:
+        return [], 0
+
+    token = uuid.uuid4().hex
+    # the same conditions again: a row another worker has sent since our
+    # select is no longer due
+    claimed = _due(now, conf).filter(pk__in=candidates).update(
+        locked_until=now + datetime.timedelta(seconds=conf['LEASE']),
+        claim=token,
+    )
+    rows = list(UnpaidUsers.objects.filter(pk__in=candidates, claim=token))
+    return rows, len(candidates) - claimed
+
+
+def run_once(limit=None, transport=None):
+    """Claim and notify one batch; returns ``(sent, lost)``."""
+    rows, lost = claim(limit or _conf()['BATCH_SIZE'])
+    if not rows:
+        return 0, lost
+    sent = (transport or get_transport()).send(rows)
+    # rows the transport could not send keep their lease and are retried
+    # once it expires
+    UnpaidUsers.objects.filter(pk__in=sent, claim=rows[0].claim).update(
+        last_notification=timezone.now(),
+        notices_sent=F('notices_sent') + 1,
+        locked_until=None,
+        claim='',
+    )
+    return len(sent), lost
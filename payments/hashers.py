@@ -0,0 +1,39 @@
+"""Password hashers whose cost is read from ``settings.PASSWORD_HASHING``.
+
+They keep the algorithm names of Django's own hashers, so existing hashes
+still verify.  When the configured cost changes, ``must_update`` reports the
+old hashes and ``User.check_password`` re-hashes them the next time their
+owner signs in.  ``manage.py calibrate_hashers`` suggests values for a target
+time per hash on the current machine.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, PBKDF2PasswordHasher,
+)
+
+
+def _param(name, default):
+    return getattr(settings, 'PASSWORD_HASHING', {}).get(name, default)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return _param('PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Requires the optional ``argon2-cffi`` package."""
+
+    @property
+    def time_cost(self):
+        return _param('ARGON2_TIME_COST', Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return _param('ARGON2_MEMORY_COST', Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return _param('ARGON2_PARALLELISM', Argon2PasswordHasher.parallelism)
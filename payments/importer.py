@@ -0,0 +1,216 @@
+"""Bulk import of ``User`` rows from CSV or JSON-lines files.
+
+Records are read lazily and grouped into chunks.  Each chunk's passwords are
+hashed in a worker process of a ``ProcessPoolExecutor``, several chunks at a
+time, while finished chunks are written in order with one ``bulk_create``
+per chunk, each in its own transaction.  After every chunk the number of
+input records consumed is written to a checkpoint file, so an interrupted
+import resumes where it stopped; a chunk that was committed just before the
+checkpoint write is handled by the duplicate check on the next run.
+
+Each record needs ``email`` and either ``password`` (plain text, hashed with
+the current default hasher) or ``password_hash`` (an encoded hash from
+``make_password``, stored as is).  ``name``, ``last_4_digits`` and
+``stripe_id`` are optional.  An email that already has an account, ignoring
+case, is skipped, or with ``on_duplicate='update'`` overwrites the fields of
+that account the record has a value for; a missing or empty one is left
+alone, so a file without ``stripe_id`` does not unlink the Stripe customer.
+"""
+import collections
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from payments import user_cache
+from payments.models import User, normalize_email
+
+SKIP = 'skip'
+UPDATE = 'update'
+
+FIELDS = ('name', 'last_4_digits', 'stripe_id', 'password')
+
+Result = collections.namedtuple('Result', 'created updated skipped invalid')
+
+
+def read_records(path, fmt=None):
+    """Yield one dict per record of a .csv or .jsonl file."""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    with io.open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        elif fmt in ('jsonl', 'json'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError('Unknown import format %r' % fmt)
+
+
+def read_checkpoint(path):
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except IOError:
+        return 0
+
+
+def write_checkpoint(path, consumed):
+    tmp = path + '.tmp'
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        f.write(u'%d\n' % consumed)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+def hash_passwords(records):
+    """Fill in ``password`` for records that only have a plain one."""
+    for record in records:
+        if record.get('password_hash'):
+            record['password'] = record['password_hash']
+        else:
+            record['password'] = make_password(record['password'])
+    return records
+
+
+def _clean(record):
+    email = (record.get('email') or '').strip()
+    if not email or not (record.get('password') or
+                         record.get('password_hash')):
+        return None
+    return {
+        'name': record.get('name') or '',
+        'email': email,
+        'password': record.get('password') or '',
+        'password_hash': record.get('password_hash') or '',
+        'last_4_digits': record.get('last_4_digits') or None,
+        'stripe_id': record.get('stripe_id') or '',
+    }
+
+
+def _existing(records):
+    """Map email_key to the pk of accounts that already use these emails."""
+    keys = [normalize_email(r['email']) for r in records]
+    existing = dict(
+        User.objects.filter(email_key__in=keys).values_list('email_key', 'pk')
+    )
+    # accounts whose email_key is NULL predate it, see migration 0003
+    for email, pk in User.objects.filter(
+        email_key__isnull=True, email__in=[r['email'] for r in records]
+    ).values_list('email', 'pk'):
+        existing.setdefault(normalize_email(email), pk)
+    return existing
+
+
+def _write(records, on_duplicate):
+    """Store one hashed chunk; returns (created, updated, skipped)."""
+    if not records:
+        return 0, 0, 0
+    with transaction.atomic():
+        existing = _existing(records)
+        new = collections.OrderedDict()
+        updates = {}
+        for r in records:
+            key = normalize_email(r['email'])
+            if key in existing:
+                updates[existing[key]] = r
+            elif key not in new or on_duplicate == UPDATE:
+                new[key] = r
+        User.objects.bulk_create([
+            User(email=r['email'], email_key=key,
+                 **dict((f, r[f]) for f in FIELDS))
+            for key, r in new.items()
+        ])
+        if on_duplicate == UPDATE:
+            for pk, r in updates.items():
+                User.objects.filter(pk=pk).update(
+                    updated_at=timezone.now(),
+                    **dict((f, r[f]) for f in FIELDS if r[f])
+                )
+    if on_duplicate == UPDATE:
+        for pk in updates:
+            user_cache.invalidate_on_commit(pk)
+        return len(new), len(updates), len(records) - len(new) - len(updates)
+    return len(new), 0, len(records) - len(new)
+
+
+def _chunks(records, size):
+    """Yield ``(chunk, consumed)``, consumed counting every record so far."""
+    chunk = []
+    consumed = 0
+    for record in records:
+        consumed += 1
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk, consumed
+            chunk = []
+    if chunk:
+        yield chunk, consumed
+
+
+def import_users(records, chunk_size=500, workers=None, on_duplicate=SKIP,
+                 checkpoint=None, progress=None):
+    """Import ``records`` (dicts, e.g. from ``read_records``).
+
+    ``workers`` is the size of the hashing pool, the number of CPUs by
+    default; 0 hashes in this process.  Keep ``chunk_size`` under 1000 on
+    SQLite, which limits the parameters of the duplicate check's query.  ``progress`` is called with the
+    running ``Result`` and the number of records consumed after each chunk.
+    """
+    start = read_checkpoint(checkpoint) if checkpoint else 0
+    totals = collections.Counter()
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    pool = ProcessPoolExecutor(workers) if workers else None
+    # hash this many chunks ahead of the one being written
+    ahead = workers + 1
+    pending = collections.deque()
+
+    def result():
+        return Result(*(totals[f] for f in Result._fields))
+
+    def finish_oldest():
+        work, consumed = pending.popleft()
+        hashed = work.result() if pool else work
+        created, updated, skipped = _write(hashed, on_duplicate)
+        totals['created'] += created
+        totals['updated'] += updated
+        totals['skipped'] += skipped
+        if checkpoint:
+            write_checkpoint(checkpoint, start + consumed)
+        if progress:
+            progress(result(), start + consumed)
+
+    try:
+        chunks = _chunks(itertools.islice(records, start, None), chunk_size)
+        for chunk, consumed in chunks:
+            cleaned = [r for r in map(_clean, chunk) if r is not None]
+            totals['invalid'] += len(chunk) - len(cleaned)
+            if on_duplicate == SKIP and cleaned:
+                # don't spend hashes on accounts that will be skipped
+                existing = _existing(cleaned)
+                kept = [r for r in cleaned
+                        if normalize_email(r['email']) not in existing]
+                totals['skipped'] += len(cleaned) - len(kept)
+                cleaned = kept
+            if pool:
+                pending.append((pool.submit(hash_passwords, cleaned),
+                                consumed))
+            else:
+                pending.append((hash_passwords(cleaned), consumed))
+            while len(pending) > ahead:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    finally:
+        if pool:
+            pool.shutdown()
+    return result()
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments import webhooks
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Stripe webhook events to users and UnpaidUsers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Events to apply at a time (default STRIPE_WEBHOOK '
+                 'BATCH_SIZE).',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to sleep when no events are waiting.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Apply the events that are currently stored and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            applied, lost = webhooks.process_batch(options['batch_size'])
+            if applied or lost:
+                self.stdout.write('Applied %d event(s)' % applied)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
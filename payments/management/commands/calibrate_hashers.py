@@ -0,0 +1,90 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, PBKDF2PasswordHasher,
+)
+from django.core.management.base import BaseCommand, CommandError
+
+PASSWORD = 'calibration password'
+SALT = 'calibrationsalt1'
+
+
+def _median_ms(func, samples):
+    timings = []
+    for _ in range(samples):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the password hashers on this machine and print '
+        'PASSWORD_HASHING values that take about --target-ms per hash.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasher', choices=sorted(settings.PASSWORD_HASHER_CHOICES),
+            default=settings.PASSWORD_HASHER,
+        )
+        parser.add_argument('--target-ms', type=float, default=50.0)
+        parser.add_argument('--samples', type=int, default=5)
+        parser.add_argument(
+            '--memory-cost', type=int,
+            default=settings.PASSWORD_HASHING.get('ARGON2_MEMORY_COST', 512),
+            help='Argon2 memory in KiB; time cost is raised to hit the target.',
+        )
+
+    def handle(self, *args, **options):
+        if options['hasher'] == 'pbkdf2':
+            params, ms = self.calibrate_pbkdf2(options)
+        else:
+            params, ms = self.calibrate_argon2(options)
+
+        self.stdout.write('# %.1f ms per hash on this machine' % ms)
+        self.stdout.write('PASSWORD_HASHING = {')
+        for name, value in sorted(dict(settings.PASSWORD_HASHING,
+                                       **params).items()):
+            self.stdout.write('    %r: %r,' % (name, value))
+        self.stdout.write('}')
+
+    def calibrate_pbkdf2(self, options):
+        hasher = PBKDF2PasswordHasher()
+        probe = 10000
+        probe_ms = _median_ms(
+            lambda: hasher.encode(PASSWORD, SALT, probe), options['samples']
+        )
+        # PBKDF2 cost is linear in the iteration count
+        iterations = int(round(probe * options['target_ms'] / probe_ms, -3))
+        iterations = max(iterations, 1000)
+        ms = _median_ms(
+            lambda: hasher.encode(PASSWORD, SALT, iterations),
+            options['samples'],
+        )
+        return {'PBKDF2_ITERATIONS': iterations}, ms
+
+    def calibrate_argon2(self, options):
+        hasher = Argon2PasswordHasher()
+        try:
+            hasher._load_library()
+        except ValueError as e:
+            raise CommandError(str(e))
+        hasher.memory_cost = options['memory_cost']
+        hasher.parallelism = settings.PASSWORD_HASHING.get(
+            'ARGON2_PARALLELISM', Argon2PasswordHasher.parallelism
+        )
+        for time_cost in range(1, 101):
+            hasher.time_cost = time_cost
+            ms = _median_ms(
+                lambda: hasher.encode(PASSWORD, SALT), options['samples']
+            )
+            if ms >= options['target_ms']:
+                break
+        return {
+            'ARGON2_TIME_COST': hasher.time_cost,
+            'ARGON2_MEMORY_COST': hasher.memory_cost,
+            'ARGON2_PARALLELISM': hasher.parallelism,
+        }, ms
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users from a CSV or JSON-lines file, hashing passwords '
+        'across a process pool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Defaults to the file extension.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Users per bulk_create and transaction (under 1000 on '
+                 'SQLite).',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Hashing processes; defaults to the number of CPUs, '
+                 '0 hashes in this process.',
+        )
+        parser.add_argument(
+            '--on-duplicate', choices=[importer.SKIP, importer.UPDATE],
+            default=importer.SKIP,
+            help='What to do with an email that already has an account.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording progress; defaults to PATH.checkpoint.',
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore an existing checkpoint and start from the top.',
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint'] or options['path'] + '.checkpoint'
+        if options['restart']:
+            importer.write_checkpoint(checkpoint, 0)
+        start = importer.read_checkpoint(checkpoint)
+        if start:
+            self.stdout.write('Resuming after record %d' % start)
+
+        def progress(result, consumed):
+            if options['verbosity'] > 1:
+                self.stdout.write('%d records read, %d created'
+                                  % (consumed, result.created))
+
+        try:
+            result = importer.import_users(
+                importer.read_records(options['path'], options['format']),
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                on_duplicate=options['on_duplicate'],
+                checkpoint=checkpoint,
+                progress=progress,
+            )
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            'Created %d, updated %d, skipped %d duplicate(s), '
+            '%d invalid record(s)' % result
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments import provisioning
+
+
+class Command(BaseCommand):
+    help = 'Create Stripe customers for signups queued by the register view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Number of jobs to claim at a time.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to sleep when the queue is empty.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the jobs that are currently due and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            handled = provisioning.run_pending(options['batch_size'])
+            if handled:
+                self.stdout.write('Processed %d job(s)' % handled)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments import dunning
+
+
+class Command(BaseCommand):
+    help = 'Send reminder notices to unpaid users whose last one is overdue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Rows to claim at a time (default DUNNING BATCH_SIZE).',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=60.0,
+            help='Seconds to sleep when nothing is due.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Notify the rows that are currently due and exit.',
+        )
+
+    def handle(self, *args, **options):
+        transport = dunning.get_transport()
+        while True:
+            sent, lost = dunning.run_once(options['batch_size'], transport)
+            if sent or lost:
+                self.stdout.write('Sent %d notice(s)' % sent)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,42 @@
+import stripe
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import stripe_mirror
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy Stripe customers into the local StripeCustomer mirror, '
+        'fetching pages in parallel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Sync every customer, not just those created since the '
+                 'newest mirrored one, and mark vanished ones deleted.',
+        )
+        parser.add_argument(
+            '--since', type=int, default=None,
+            help='Sync customers created at or after this Unix timestamp.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Threads fetching pages (default STRIPE_MIRROR WORKERS).',
+        )
+        parser.add_argument(
+            '--page-size', type=int, default=None,
+            help='Customers per list request, at most 100.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            synced = stripe_mirror.sync(
+                full=options['full'],
+                workers=options['workers'],
+                page_size=options['page_size'],
+                since=options['since'],
+            )
+        except stripe.error.StripeError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Synced %d customer(s)' % synced)
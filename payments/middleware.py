@@ -0,0 +1,37 @@
+from functools import partial
+
+from django.utils.functional import SimpleLazyObject
+
+from payments.models import User
+
+
+def get_user_profile(request):
+    """Return the signed-in ``User`` for ``request``, or ``None``.
+
+    The lookup goes through ``payments.user_cache`` and happens at most once
+    per request; a session pointing at a deleted user counts as signed out.
+    """
+    uid = request.session.get('user')
+    cached = getattr(request, '_user_profile', None)
+    if cached is not None and cached[0] == uid:
+        return cached[1]
+    try:
+        user = User.get_by_id(uid) if uid is not None else None
+    except User.DoesNotExist:
+        user = None
+    # keyed on the session value so signing in or out mid-request is seen
+    request._user_profile = (uid, user)
+    return user
+
+
+class UserProfileMiddleware(object):
+    """Expose the signed-in user as a lazy ``request.user_profile``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_profile = SimpleLazyObject(
+            partial(get_user_profile, request)
+        )
+        return self.get_response(request)
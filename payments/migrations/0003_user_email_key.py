@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_email_key(apps, schema_editor):
+    """Fill email_key in pk-ordered batches, one short transaction each.
+
+    When several accounts differ only in the case of their email, the oldest
+    keeps the key; the others are left NULL (still found by exact email) and
+    logged so support can merge them.
+    """
+    User = apps.get_model('payments', 'User')
+    users = User.objects.using(schema_editor.connection.alias)
+    collisions = []
+    last_pk = 0
+    while True:
+        rows = list(
+            users.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'email')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        keys = [email.strip().lower() for pk, email in rows]
+        taken = set(
+            users.filter(email_key__in=keys)
+            .values_list('email_key', flat=True)
+        )
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for (pk, email), key in zip(rows, keys):
+                if key in taken:
+                    collisions.append(email)
+                    continue
+                taken.add(key)
+                users.filter(pk=pk).update(email_key=key)
+        last_pk = rows[-1][0]
+    if collisions:
+        # emails that differ only by case from an older account's
+        logger.warning('email_key left NULL count=%d emails=%s',
+                       len(collisions), ','.join(collisions))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('payments', '0002_customerjob'),
+    ]
+
+    operations = [
+        # indexed from the start so the backfill's collision checks are cheap
+        migrations.AddField(
+            model_name='user',
+            name='email_key',
+            field=models.CharField(db_index=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_email_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='email_key',
+            field=models.CharField(editable=False, max_length=255, null=True, unique=True),
+        ),
+    ]
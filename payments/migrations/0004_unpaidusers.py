@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_user_email_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnpaidUsers',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=255, unique=True)),
+                ('last_notification', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('notices_sent', models.PositiveIntegerField(default=0)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('claim', models.CharField(blank=True, max_length=32)),
+            ],
+        ),
+    ]
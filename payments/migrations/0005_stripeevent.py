@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_unpaidusers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='stripe_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('type', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('created', models.DateTimeField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('claim', models.CharField(blank=True, max_length=32)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='stripeevent',
+            index_together=set([('processed_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_stripeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeCustomer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_id', models.CharField(max_length=255, unique=True)),
+                ('email', models.CharField(blank=True, max_length=255)),
+                ('default_source', models.CharField(blank=True, max_length=255)),
+                ('last_4_digits', models.CharField(blank=True, max_length=4, null=True)),
+                ('card_brand', models.CharField(blank=True, max_length=32)),
+                ('card_exp_month', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('card_exp_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('subscription_id', models.CharField(blank=True, max_length=255)),
+                ('subscription_status', models.CharField(blank=True, max_length=32)),
+                ('plan', models.CharField(blank=True, max_length=64)),
+                ('current_period_end', models.DateTimeField(blank=True, null=True)),
+                ('delinquent', models.BooleanField(default=False)),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
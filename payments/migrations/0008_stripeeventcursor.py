@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_user_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEventCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer', models.CharField(max_length=255)),
+                ('kind', models.CharField(max_length=16)),
+                ('created', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='stripeeventcursor',
+            unique_together=set([('customer', 'kind')]),
+        ),
+    ]
@@ -1,40 +1,234 @@
 from django.db import models, IntegrityError
 from django.contrib.auth.models import AbstractBaseUser
-from datetime import datetime 
+from django.utils import timezone
+from payments import user_cache
 # from main.models import Badge
 
 
+def normalize_email(email):
+	"""The form of an email address used for uniqueness and lookups."""
+	return email.strip().lower()
+
+
 class User(AbstractBaseUser):
+	STRIPE_PENDING = 'pending'
+	STRIPE_ACTIVE = 'active'
+	STRIPE_FAILED = 'failed'
+	STRIPE_STATUS_CHOICES = (
+		(STRIPE_PENDING, 'Pending'),
+		(STRIPE_ACTIVE, 'Active'),
+		(STRIPE_FAILED, 'Failed'),
+	)
+
 	name = models.CharField(max_length=255)
 	email = models.CharField(max_length=255, unique=True)
+	# normalize_email(email); NULL only for accounts that collided with an
+	# older one when the column was introduced (see migration 0003)
+	email_key = models.CharField(
+		max_length=255, unique=True, null=True, editable=False
+	)
 	last_4_digits = models.CharField(max_length=4, blank=True, null=True)
-	stripe_id = models.CharField(max_length=255)
+	# indexed for the webhook worker, which finds users by Stripe customer
+	stripe_id = models.CharField(max_length=255, db_index=True)
+	stripe_status = models.CharField(
+		max_length=16, choices=STRIPE_STATUS_CHOICES, default=STRIPE_ACTIVE
+	)
 	created_at = models.DateTimeField(auto_now_add=True)
-	updated_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
 
 	USERNAME_FIELD = 'email'
 
 	@classmethod
 	def get_by_id(cls, uid):
-		return User.objects.get(pk=uid)
+		user = user_cache.get(uid)
+		if user is None:
+			raise cls.DoesNotExist('User matching id %r does not exist' % uid)
+		return user
 
-	def __str__(self):
-		return self.email
+	def save(self, *args, **kwargs):
+		update_fields = kwargs.get('update_fields')
+		if update_fields is None or 'email' in update_fields:
+			if self._state.adding or self.email_key is not None:
+				self.email_key = normalize_email(self.email)
+			if update_fields is not None:
+				kwargs['update_fields'] = list(update_fields) + ['email_key']
+		update_fields = kwargs.get('update_fields')
+		if update_fields is not None and 'updated_at' not in update_fields:
+			# auto_now only applies to the fields being saved; pages are
+			# cached against updated_at (see main/conditional.py)
+			kwargs['update_fields'] = list(update_fields) + ['updated_at']
+		super(User, self).save(*args, **kwargs)
+		user_cache.invalidate_on_commit(self.pk)
 
-@classmethod
-def create(cls, name, email, password, last_4_digits, stripe_id):
-	new_user = cls(name=name, email=email, last_4_digits=last_4_digits, stripe_id=st
+	@classmethod
+	def by_email(cls, email):
+		"""Case-insensitive lookup by email, served by unique indexes."""
+		return cls.objects.filter(
+			models.Q(email_key=normalize_email(email)) |
+			models.Q(email_key__isnull=True, email=email)
 		)
-	new_user.set_password(password)
 
-	new_user.save()
-	return new_user
+	@classmethod
+	def authenticate(cls, email, password):
+		"""Return the user with these credentials, or ``None``.
+
+		One indexed, case-insensitive query that loads only the email and
+		password hash.  Unknown emails still pay for a hash so that response times
+		don't reveal which addresses have accounts.
+		"""
+		# two rows only when a legacy account differs from another by case;
+		# the exact spelling wins then
+		users = list(cls.by_email(email).only('email', 'password')[:2])
+		if not users:
+			cls().set_password(password)
+			return None
+		user = next((u for u in users if u.email == email), users[0])
+		if user.check_password(password):
+			return user
+		return None
+
+	def stripe_customer(self):
+		"""This user's Stripe customer from the local mirror, or ``None``.
+
+		Reads never call Stripe unless the mirror has no (or, with
+		``STRIPE_MIRROR['MAX_AGE']``, a stale) row; see payments/stripe_mirror.py.
+		"""
+		from payments import stripe_mirror
+		return stripe_mirror.get(self.stripe_id)
+
+	@classmethod
+	def create(cls, name, email, password, last_4_digits, stripe_id):
+		new_user = cls(name=name, email=email, last_4_digits=last_4_digits,
+			stripe_id=stripe_id)
+		new_user.set_password(password)
+
+		new_user.save()
+		return new_user
+
+	def __str__(self):
+		return self.email
 
 class UnpaidUsers(models.Model):
     email = models.CharField(max_length=255, unique=True)
-    last_notification = models.DateTimeField(default=datetime.now())
+    # indexed: the dunning engine scans for rows notified long enough ago
+    last_notification = models.DateTimeField(
+        default=timezone.now, db_index=True
+    )
+    notices_sent = models.PositiveIntegerField(default=0)
+    # lease taken by a dunning worker, see payments/dunning.py
+    locked_until = models.DateTimeField(blank=True, null=True)
+    claim = models.CharField(max_length=32, blank=True)
 
     def do_save(self, throw_error=None):
         self.save()
         if throw_error:
-            raise IntegrityError
\ No newline at end of file
+            raise IntegrityError
+
+
+class CustomerJob(models.Model):
+	"""A pending Stripe customer creation for a user who signed up.
+
+	Rows are written in the same transaction as the ``User`` and drained by
+	the ``provision_customers`` management command.
+	"""
+	PENDING = 'pending'
+	RUNNING = 'running'
+	DONE = 'done'
+	FAILED = 'failed'
+	STATUS_CHOICES = (
+		(PENDING, 'Pending'),
+		(RUNNING, 'Running'),
+		(DONE, 'Done'),
+		(FAILED, 'Failed'),
+	)
+
+	user = models.OneToOneField(
+		User, on_delete=models.CASCADE, related_name='customer_job'
+	)
+	stripe_token = models.CharField(max_length=255)
+	plan = models.CharField(max_length=64, default='gold')
+	idempotency_key = models.CharField(max_length=64, unique=True)
+	status = models.CharField(
+		max_length=16, choices=STATUS_CHOICES, default=PENDING
+	)
+	attempts = models.PositiveIntegerField(default=0)
+	run_after = models.DateTimeField(default=timezone.now)
+	locked_until = models.DateTimeField(blank=True, null=True)
+	last_error = models.TextField(blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		index_together = [['status', 'run_after']]
+
+	def __str__(self):
+		return '%s (%s)' % (self.user.email, self.status)
+
+
+class StripeEvent(models.Model):
+	"""A webhook event from Stripe, stored as it was received.
+
+	The ``webhook`` view only verifies and inserts these; the
+	``apply_stripe_events`` command applies them in batches (see
+	payments/webhooks.py).
+	"""
+	event_id = models.CharField(max_length=255, unique=True)
+	type = models.CharField(max_length=255)
+	payload = models.TextField()
+	# when Stripe created the event; batches are applied in this order
+	created = models.DateTimeField()
+	received_at = models.DateTimeField(default=timezone.now)
+	processed_at = models.DateTimeField(blank=True, null=True)
+	locked_until = models.DateTimeField(blank=True, null=True)
+	claim = models.CharField(max_length=32, blank=True)
+
+	class Meta:
+		index_together = [['processed_at', 'id']]
+
+	def __str__(self):
+		return '%s (%s)' % (self.event_id, self.type)
+
+
+class StripeEventCursor(models.Model):
+	"""When Stripe created the newest event of one ``kind`` applied for a
+	customer.  Stripe may deliver events late and out of order, so older
+	events of that kind arriving in a later batch are skipped.
+	"""
+	customer = models.CharField(max_length=255)
+	# 'customer', 'card' or 'invoice'; see payments.webhooks.KINDS
+	kind = models.CharField(max_length=16)
+	created = models.DateTimeField()
+
+	class Meta:
+		unique_together = [['customer', 'kind']]
+
+	def __str__(self):
+		return '%s %s' % (self.customer, self.kind)
+
+
+class StripeCustomer(models.Model):
+	"""Local copy of a Stripe customer with its default card and subscription.
+
+	Filled by ``manage.py sync_stripe_mirror`` and kept current by webhook
+	events and by the responses to our own writes.
+	"""
+	stripe_id = models.CharField(max_length=255, unique=True)
+	email = models.CharField(max_length=255, blank=True)
+	default_source = models.CharField(max_length=255, blank=True)
+	last_4_digits = models.CharField(max_length=4, blank=True, null=True)
+	card_brand = models.CharField(max_length=32, blank=True)
+	card_exp_month = models.PositiveSmallIntegerField(blank=True, null=True)
+	card_exp_year = models.PositiveSmallIntegerField(blank=True, null=True)
+	subscription_id = models.CharField(max_length=255, blank=True)
+	subscription_status = models.CharField(max_length=32, blank=True)
+	plan = models.CharField(max_length=64, blank=True)
+	current_period_end = models.DateTimeField(blank=True, null=True)
+	delinquent = models.BooleanField(default=False)
+	deleted = models.BooleanField(default=False)
+	# when Stripe created the customer; incremental syncs start from the
+	# newest one mirrored
+	created = models.DateTimeField(db_index=True)
+	synced_at = models.DateTimeField(default=timezone.now)
+
+	def __str__(self):
+		return self.stripe_id
@@ -0,0 +1,139 @@
+"""Background creation of Stripe customers for new signups.
+
+``register`` saves the ``User`` with ``stripe_status='pending'`` and queues a
+``CustomerJob`` in the same transaction.  The ``provision_customers``
+management command claims due jobs and finishes them, retrying transient
+Stripe failures with exponential backoff.  Every attempt for a job reuses the
+job's idempotency key, so a retry after a lost response never creates a
+second customer.
+"""
+import datetime
+import socket
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from payments import stripe_client, user_cache
+from payments.models import CustomerJob, User
+
+INLINE = 'inline'
+QUEUED = 'queued'
+
+# How long a claimed job stays invisible to other workers before it is
+# considered abandoned (e.g. the worker was killed mid-request).
+LEASE = datetime.timedelta(minutes=5)
+
+
+def is_queued():
+    return getattr(settings, 'STRIPE_CUSTOMER_PROVISIONING', INLINE) == QUEUED
+
+
+def enqueue(user, stripe_token, plan='gold'):
+    return CustomerJob.objects.create(
+        user=user,
+        stripe_token=stripe_token,
+        plan=plan,
+        idempotency_key=uuid.uuid4().hex,
+    )
+
+
+def _due(now):
+    """Unfinished jobs that are due and not leased to a live worker."""
+    return CustomerJob.objects.filter(
+        status__in=[CustomerJob.PENDING, CustomerJob.RUNNING],
+        run_after__lte=now,
+    ).exclude(
+        locked_until__gt=now,
+    )
+
+
+def _candidates(limit, now):
+    return list(_due(now).order_by(
+        'run_after').values_list('pk', flat=True)[:limit])
+
+
+def claim(limit=10):
+    """Lease up to ``limit`` due jobs for this worker.
+
+    Claiming is a conditional ``UPDATE`` per row rather than
+    ``SELECT ... FOR UPDATE`` so it behaves the same on SQLite, which has no
+    row locks; a job whose update matched no rows was taken, or finished or
+    rescheduled, by another worker since we selected it.
+    """
+    now = timezone.now()
+    claimed = []
+    for pk in _candidates(limit, now):
+        won = _due(now).filter(pk=pk).update(
+            status=CustomerJob.RUNNING, locked_until=now + LEASE)
+        if won:
+            claimed.append(pk)
+    return list(
+        CustomerJob.objects.filter(pk__in=claimed).select_related('user')
+    )
+
+
+def _retry_delay(attempts):
+    base = getattr(settings, 'STRIPE_PROVISIONING_RETRY_DELAY', 30)
+    return datetime.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def process(job):
+    """Create the Stripe customer for ``job``; returns the final job status."""
+    user = job.user
+    job.attempts += 1
+    stripe = stripe_client.api()
+    try:
+        customer = stripe.Customer.create(
+            email=user.email,
+            description=user.name,
+            card=job.stripe_token,
+            plan=job.plan,
+            idempotency_key=job.idempotency_key,
+        )
+    except (stripe.error.CardError, stripe.error.InvalidRequestError,
+            stripe.error.AuthenticationError) as e:
+        # Retrying won't help: the card or the request itself is bad.
+        return _fail(job, e)
+    except (stripe.error.StripeError, socket.error) as e:
+        max_attempts = getattr(settings, 'STRIPE_PROVISIONING_MAX_ATTEMPTS', 5)
+        if job.attempts >= max_attempts:
+            return _fail(job, e)
+        job.status = CustomerJob.PENDING
+        job.last_error = str(e)
+        job.run_after = timezone.now() + _retry_delay(job.attempts)
+        job.locked_until = None
+        job.save()
+        return job.status
+
+    with transaction.atomic():
+        user.stripe_id = customer.id
+        user.stripe_status = User.STRIPE_ACTIVE
+        user.save()
+        job.status = CustomerJob.DONE
+        job.last_error = ''
+        job.locked_until = None
+        job.save()
+    return job.status
+
+
+def _fail(job, error):
+    with transaction.atomic():
+        User.objects.filter(pk=job.user_id).update(
+            stripe_status=User.STRIPE_FAILED, updated_at=timezone.now()
+        )
+        user_cache.invalidate_on_commit(job.user_id)
+        job.status = CustomerJob.FAILED
+        job.last_error = str(error)
+        job.locked_until = None
+        job.save()
+    return job.status
+
+
+def run_pending(limit=10):
+    """Process one batch of due jobs; returns how many were handled."""
+    jobs = claim(limit)
+    for job in jobs:
+        process(job)
+    return len(jobs)
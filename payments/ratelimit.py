@@ -0,0 +1,98 @@
+"""Token-bucket rate limiting for sign in attempts.
+
+Each client IP and each email address gets a bucket of ``CAPACITY`` tokens
+that refills at ``REFILL_PER_MINUTE``; an attempt spends one token from each.
+Attempts are checked before the database or the password hasher is touched,
+so a credential-stuffing flood costs a cache lookup per attempt.
+
+Buckets live in a bounded process-local LRU, or in the ``CACHE`` alias from
+``SIGN_IN_RATE_LIMIT`` when several processes must share them.  Shared
+buckets are read and written without a lock unless ``LOCK`` is set, so
+concurrent attempts can occasionally both spend the last token; that is an
+acceptable slack for a flood guard.  With ``LOCK``, each attempt holds a
+``main.locks`` lock on its bucket, at the cost of two more cache round trips;
+an attempt that cannot get the lock within ``LOCK_WAIT`` seconds is refused,
+since only a flood keeps a bucket that busy.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from main import locks
+from main.lru import LRUCache
+
+DEFAULTS = {
+    'PER_IP': {'CAPACITY': 30, 'REFILL_PER_MINUTE': 10},
+    'PER_EMAIL': {'CAPACITY': 10, 'REFILL_PER_MINUTE': 2},
+    'CACHE': None,
+    'LOCK': False,
+    'LOCK_WAIT': 1,
+    'SIZE': 100000,
+}
+
+_local = None
+_lock = threading.Lock()
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'SIGN_IN_RATE_LIMIT', {}))
+
+
+def _store():
+    global _local
+    if _local is None:
+        _local = LRUCache(_conf()['SIZE'])
+    return _local
+
+
+def take(key, capacity, refill_per_minute, now=None):
+    """Spend a token from bucket ``key``; False if the bucket is empty."""
+    now = time.time() if now is None else now
+    rate = refill_per_minute / 60.0
+    conf = _conf()
+    shared = caches[conf['CACHE']] if conf['CACHE'] else None
+    if shared is not None and conf['LOCK']:
+        try:
+            with locks.lock(key, conf['CACHE'], timeout=5,
+                            wait=conf['LOCK_WAIT']):
+                return _spend(shared, key, capacity, rate, now)
+        except locks.LockTimeout:
+            return False
+    with _lock:
+        return _spend(shared, key, capacity, rate, now)
+
+
+def _spend(shared, key, capacity, rate, now):
+    state = shared.get(key) if shared is not None else _store().get(key)
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    if shared is not None:
+        # an idle bucket is full again after this long, so let it expire
+        timeout = int((capacity - tokens) / rate) + 1 if rate else None
+        shared.set(key, (tokens, now), timeout)
+    else:
+        _store().set(key, (tokens, now))
+    return allowed
+
+
+def allow_sign_in(ip, email):
+    conf = _conf()
+    per_ip, per_email = conf['PER_IP'], conf['PER_EMAIL']
+    if not take('signin:ip:%s' % ip,
+                per_ip['CAPACITY'], per_ip['REFILL_PER_MINUTE']):
+        return False
+    digest = hashlib.sha1(email.lower().encode('utf-8')).hexdigest()
+    return take('signin:email:%s' % digest,
+                per_email['CAPACITY'], per_email['REFILL_PER_MINUTE'])
+
+
+def reset():
+    """Forget all local buckets, e.g. after changing ``SIGN_IN_RATE_LIMIT``."""
+    global _local
+    _local = None
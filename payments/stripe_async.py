@@ -0,0 +1,142 @@
+"""Non-blocking HTTP transport for Stripe calls made by the ASGI handler.
+
+``AsyncStripeClient.request()`` takes the raw request captured by
+``stripe_client.call()`` and returns ``(body, status, headers)``, the same
+triple the ``stripe`` library's HTTP clients return, so the view can replay
+it.  Connections are kept alive and shared by every request on the event
+loop, at most ``ASGI['STRIPE_CONNECTIONS']`` at a time; the circuit breaker,
+timeouts and metrics of payments/stripe_client.py apply as they do to
+threaded calls.
+
+Only HTTP/1.1 with ``Content-Length`` or chunked bodies is spoken, which is
+all the Stripe API sends.  Python 3 only.
+"""
+import asyncio
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import stripe
+
+from main import metrics
+from payments import stripe_client
+
+
+class AsyncStripeClient(object):
+
+    def __init__(self, max_connections, connect_timeout, read_timeout):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = {}  # (scheme, host, port) -> [(reader, writer)]
+        self._ssl = ssl.create_default_context()
+
+    async def request(self, method, url, headers, post_data=None):
+        breaker = stripe_client.get_client().breaker
+        breaker.before_call()
+        start = time.time()
+        status = 'error'
+        try:
+            async with self._slots:
+                body, status, rheaders = await self._request(
+                    method, url, headers, post_data)
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError) as e:
+            breaker.record_failure()
+            raise stripe.error.APIConnectionError(
+                'Could not connect to Stripe (%s: %s)' % (
+                    type(e).__name__, e))
+        finally:
+            metrics.record_stripe(method, str(status), time.time() - start)
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return body, status, rheaders
+
+    async def _request(self, method, url, headers, post_data):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        data = (post_data or '').encode('utf-8') \
+            if not isinstance(post_data, bytes) else post_data
+        lines = ['%s %s HTTP/1.1' % (method.upper(), path),
+                 'Host: %s' % parts.netloc,
+                 'Content-Length: %d' % len(data)]
+        lines.extend('%s: %s' % (k, v) for k, v in headers.items()
+                     if k.lower() not in ('host', 'content-length'))
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data
+
+        idle = self._idle.get(key)
+        reused = bool(idle)
+        reader, writer = idle.pop() if idle else await self._connect(key)
+        deadline = time.time() + self.read_timeout
+        try:
+            try:
+                writer.write(message)
+                await writer.drain()
+                status_line = await asyncio.wait_for(
+                    reader.readline(), self.read_timeout)
+                if not status_line:
+                    raise EOFError('connection closed')
+            except (EOFError, ConnectionError):
+                if not reused:
+                    raise
+                # an idle connection the server has since closed fails here,
+                # before any of the response is read; a fresh connection is
+                # worth one more try.  Nothing else is, a timeout least of
+                # all: stripe sends no Idempotency-Key, and a request Stripe
+                # is still working on would create a second customer.
+                writer.close()
+                return await self._request(method, url, headers, post_data)
+            response = await asyncio.wait_for(
+                self._read_response(reader, status_line),
+                max(deadline - time.time(), 0))
+        except BaseException:
+            writer.close()
+            raise
+        body, status, rheaders, keep_alive = response
+        if keep_alive:
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        return body, status, rheaders
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == 'https' else None),
+            self.connect_timeout)
+
+    async def _read_response(self, reader, status_line):
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        rheaders = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            rheaders[name.strip().lower()] = value.strip()
+        if rheaders.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        else:
+            body = await reader.readexactly(
+                int(rheaders.get('content-length', 0)))
+        keep_alive = (version == 'HTTP/1.1' and
+                      rheaders.get('connection', '').lower() != 'close')
+        return body.decode('utf-8'), int(status), rheaders, keep_alive
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
@@ -0,0 +1,220 @@
+"""Shared HTTP transport for every Stripe API call made by this project.
+
+Left to itself the ``stripe`` library builds a new ``requests.Session`` for
+each API call, so every call pays for a fresh TCP (and TLS) connection and the
+number of concurrent connections is unbounded.  ``api()`` installs a single
+process-wide client instead:
+
+* a bounded, blocking keep-alive connection pool (``STRIPE_HTTP['POOL_SIZE']``),
+* separate connect and read timeouts,
+* a circuit breaker that fails fast with ``APIConnectionError`` once Stripe
+  has produced ``FAILURE_THRESHOLD`` consecutive connection errors or 5xx
+  responses, and lets a single probe through after ``RECOVERY_TIMEOUT``,
+* call timings recorded in ``main.metrics``.
+
+``stats()`` reports pool usage and breaker state.  The client classes live
+in payments/stripe_http.py, which imports the ``stripe`` SDK; it is imported,
+and the API key set, on the first call, so importing this module is cheap.
+
+Views make their calls through ``call()``, so that under the ASGI handler
+(django_ecommerce/asgi_handler.py) a call can be made without holding a
+thread: the first time through it raises ``Deferred`` with the raw HTTP
+request, which a ``deferrable`` view turns into a ``DeferredResponse``.  The
+handler makes the request on its event loop and serves the view again with
+the raw response in ``request.META[RESPONSES]``; the call then returns what
+the ``stripe`` library makes of it, as if it had been made here.
+"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+DEFAULTS = {
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 30,
+    'FAILURE_THRESHOLD': 5,
+    'RECOVERY_TIMEOUT': 30,
+}
+
+# request.META keys set by the ASGI handler
+DEFER = 'ecommerce.stripe_defer'
+RESPONSES = 'ecommerce.stripe_responses'
+_CALLS = 'ecommerce.stripe_calls'
+
+_client = None
+_client_lock = threading.Lock()
+_local = threading.local()
+
+
+class Deferred(Exception):
+    """Raised by ``call()`` in place of a call the ASGI handler will make."""
+
+    def __init__(self, method, url, headers, post_data):
+        super(Deferred, self).__init__(method, url)
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.post_data = post_data
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, recovery_timeout):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if (self.state == self.OPEN and
+                    time.time() - self.opened_at >= self.recovery_timeout):
+                # let exactly one caller probe whether Stripe is back
+                self.state = self.HALF_OPEN
+                return
+            self.rejected += 1
+        from payments.stripe_http import CircuitOpen
+        raise CircuitOpen(
+            'Stripe is unavailable; not retrying for %ss' % self.recovery_timeout
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+def intercept(method, url, headers, post_data):
+    """The ASGI handler's response to this request of a ``call()``, if any.
+
+    Raises ``Deferred`` if the handler is to make the request, and returns
+    None if it is to be made here.
+    """
+    if getattr(_local, 'deferring', False):
+        raise Deferred(method, url, headers, post_data)
+    replay = getattr(_local, 'replay', None)
+    if replay is not None:
+        # made (and counted) by the ASGI handler
+        _local.replay = None
+        if isinstance(replay, Exception):
+            raise replay
+    return replay
+
+
+def _build_client():
+    from payments.stripe_http import PooledClient
+    conf = dict(DEFAULTS, **getattr(settings, 'STRIPE_HTTP', {}))
+    return PooledClient(
+        pool_size=conf['POOL_SIZE'],
+        timeout=(conf['CONNECT_TIMEOUT'], conf['READ_TIMEOUT']),
+        breaker=CircuitBreaker(
+            conf['FAILURE_THRESHOLD'], conf['RECOVERY_TIMEOUT']
+        ),
+    )
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def api():
+    """Return the ``stripe`` module with the shared client installed."""
+    import stripe
+    client = get_client()
+    if stripe.api_key is None:
+        stripe.api_key = settings.STRIPE_SECRET
+    if stripe.default_http_client is not client:
+        stripe.default_http_client = client
+    return stripe
+
+
+def call(request, path, *args, **kwargs):
+    """Call the API method at ``path`` (e.g. ``'Customer.create'``) for the
+    view serving ``request``; see the module docstring."""
+    func = api()
+    for name in path.split('.'):
+        func = getattr(func, name)
+    index = request.META.get(_CALLS, 0)
+    request.META[_CALLS] = index + 1
+    responses = request.META.get(RESPONSES) or []
+    try:
+        if index < len(responses):
+            _local.replay = responses[index]
+        elif request.META.get(DEFER):
+            _local.deferring = True
+        return func(*args, **kwargs)
+    finally:
+        _local.replay = None
+        _local.deferring = False
+
+
+class DeferredResponse(HttpResponse):
+    """What a ``deferrable`` view returns for a ``Deferred`` call."""
+    status_code = 202
+
+    def __init__(self, deferred):
+        super(DeferredResponse, self).__init__()
+        self.deferred = deferred
+
+
+def deferrable(view):
+    """Let the ASGI handler make ``view``'s Stripe calls.
+
+    The view must not write anything before its last ``call()``, since it
+    is served once more for every call.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except Deferred as e:
+            return DeferredResponse(e)
+    return wrapper
+
+
+def reset():
+    """Drop the shared client, e.g. after changing ``STRIPE_HTTP``."""
+    global _client
+    import stripe
+    with _client_lock:
+        _client = None
+    stripe.default_http_client = None
+
+
+def stats():
+    client = get_client()
+    breaker = client.breaker
+    return {
+        'pool_size': client._adapter._pool_maxsize,
+        'requests': client.requests,
+        'in_flight': client.in_flight,
+        'peak_in_flight': client.peak_in_flight,
+        'connections_opened': client.connections_opened(),
+        'circuit_state': breaker.state,
+        'circuit_failures': breaker.failures,
+        'circuit_rejected': breaker.rejected,
+    }
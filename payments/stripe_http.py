@@ -0,0 +1,73 @@
+"""The parts of payments/stripe_client.py built on the ``stripe`` SDK.
+
+Importing ``stripe`` (and ``requests`` with it) is a large share of the
+project's startup time, so nothing imported while loading the URLconf or
+running a management command imports this module; ``stripe_client`` does on
+the first Stripe call.
+"""
+import threading
+import time
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+from main import metrics
+from payments import stripe_client
+
+
+class CircuitOpen(stripe.error.APIConnectionError):
+    """Raised instead of calling Stripe while the circuit breaker is open."""
+
+
+class PooledClient(RequestsClient):
+    name = 'pooled-requests'
+
+    def __init__(self, pool_size, timeout, breaker, **kwargs):
+        session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+        )
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        super(PooledClient, self).__init__(
+            timeout=timeout, session=session, **kwargs
+        )
+        self.breaker = breaker
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers, post_data=None):
+        replay = stripe_client.intercept(method, url, headers, post_data)
+        if replay is not None:
+            return replay
+        self.breaker.before_call()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.time()
+        status = 'error'
+        try:
+            content, status, rheaders = super(PooledClient, self).request(
+                method, url, headers, post_data
+            )
+        except stripe.error.APIConnectionError:
+            self.breaker.record_failure()
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            metrics.record_stripe(method, str(status), time.time() - start)
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return content, status, rheaders
+
+    def connections_opened(self):
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
@@ -0,0 +1,239 @@
+"""A local mirror of Stripe customer, card and subscription state.
+
+Pages that show billing details read ``StripeCustomer`` rows (through
+``User.stripe_customer()``) instead of calling ``Customer.retrieve``; only
+writes go to Stripe, and the customer each write returns is stored here.
+
+The mirror is filled by ``manage.py sync_stripe_mirror``, which walks the
+customers list endpoint with ``starting_after`` cursors.  The range of
+creation times being synced is split into ``workers`` windows, each walked
+by its own thread, so pages are fetched in parallel; rows are written from
+the calling thread only.  An incremental sync starts at the newest customer
+already mirrored; changes to older customers arrive as webhook events (see
+payments/webhooks.py), and a ``full`` sync also marks customers that have
+disappeared from Stripe as deleted.
+"""
+import calendar
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from payments import stripe_client
+from payments.models import StripeCustomer
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+DEFAULTS = {
+    # seconds after which get() refreshes a row from Stripe; None trusts
+    # the mirror, which sync and webhooks keep current
+    'MAX_AGE': None,
+    'PAGE_SIZE': 100,
+    'WORKERS': 4,
+    # no customer of this account is older; where a full sync starts
+    'EPOCH': 1293840000,  # 2011-01-01
+}
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'STRIPE_MIRROR', {}))
+
+
+def _datetime(timestamp):
+    if not timestamp:
+        return None
+    return datetime.datetime.fromtimestamp(int(timestamp), timezone.utc)
+
+
+def from_stripe(customer, synced_at=None):
+    """The ``StripeCustomer`` fields for a customer object (or dict)."""
+    fields = {
+        'email': customer.get('email') or '',
+        'default_source': customer.get('default_source') or '',
+        'last_4_digits': None,
+        'card_brand': '',
+        'card_exp_month': None,
+        'card_exp_year': None,
+        'subscription_id': '',
+        'subscription_status': '',
+        'plan': '',
+        'current_period_end': None,
+        'delinquent': bool(customer.get('delinquent')),
+        'deleted': bool(customer.get('deleted')),
+        'created': _datetime(customer.get('created')) or timezone.now(),
+        'synced_at': synced_at or timezone.now(),
+    }
+    for card in (customer.get('sources') or {}).get('data') or []:
+        if card.get('id') == fields['default_source']:
+            fields.update(
+                last_4_digits=card.get('last4'),
+                card_brand=card.get('brand') or '',
+                card_exp_month=card.get('exp_month'),
+                card_exp_year=card.get('exp_year'),
+            )
+    subscriptions = (customer.get('subscriptions') or {}).get('data') or []
+    if subscriptions:
+        subscription = subscriptions[0]
+        fields.update(
+            subscription_id=subscription.get('id') or '',
+            subscription_status=subscription.get('status') or '',
+            plan=(subscription.get('plan') or {}).get('id') or '',
+            current_period_end=_datetime(
+                subscription.get('current_period_end')),
+        )
+    return fields
+
+
+def store(customers, synced_at=None):
+    """Insert or update mirror rows for Stripe customer objects.
+
+    ``synced_at`` is when the objects were fetched (default: now).  Rows
+    written since then, by a webhook or our own write, hold newer state and
+    are left as they are.
+    """
+    rows = dict((c['id'], from_stripe(c, synced_at)) for c in customers)
+    ids = list(rows)
+    for attempt in range(2):
+        # read outside the transaction: on SQLite a transaction that reads
+        # before it writes fails at once if another writer is active
+        existing = set()
+        # under SQLite's limit on query parameters
+        for i in range(0, len(ids), 500):
+            existing.update(StripeCustomer.objects.filter(
+                stripe_id__in=ids[i:i + 500],
+            ).values_list('stripe_id', flat=True))
+        try:
+            with transaction.atomic():
+                StripeCustomer.objects.bulk_create([
+                    StripeCustomer(stripe_id=stripe_id, **fields)
+                    for stripe_id, fields in rows.items()
+                    if stripe_id not in existing
+                ], batch_size=500)
+                for stripe_id in existing:
+                    StripeCustomer.objects.filter(
+                        stripe_id=stripe_id,
+                        synced_at__lt=rows[stripe_id]['synced_at'],
+                    ).update(**rows[stripe_id])
+        except IntegrityError:
+            # another process inserted one of the new customers first
+            if attempt:
+                raise
+        else:
+            break
+    return len(rows)
+
+
+def refresh(stripe_id):
+    """Fetch one customer from Stripe into the mirror; returns the row."""
+    customer = stripe_client.api().Customer.retrieve(stripe_id)
+    store([customer])
+    return StripeCustomer.objects.get(stripe_id=stripe_id)
+
+
+def get(stripe_id):
+    """The mirror row for ``stripe_id``, read through to Stripe if needed.
+
+    A row that is missing, or older than ``MAX_AGE``, is refreshed; if
+    Stripe can't be reached the row we have (possibly ``None``) is returned.
+    """
+    if not stripe_id:
+        return None
+    row = StripeCustomer.objects.filter(stripe_id=stripe_id).first()
+    max_age = _conf()['MAX_AGE']
+    if row is not None and (max_age is None or row.synced_at >=
+                            timezone.now() -
+                            datetime.timedelta(seconds=max_age)):
+        return row
+    stripe = stripe_client.api()
+    try:
+        return refresh(stripe_id)
+    except stripe.error.StripeError:
+        return row
+
+
+def _windows(start, end, count):
+    """Split ``[start, end)`` into at most ``count`` windows; each one ends
+    where the next begins, so every second belongs to exactly one."""
+    step = max(1, (end - start) // count + 1)
+    return [(lo, min(lo + step, end)) for lo in range(start, end, step)]
+
+
+def _walk(window, page_size, pages):
+    """Put ``(fetched_at, customers)`` for every page of customers created
+    in ``window`` on ``pages``."""
+    api = stripe_client.api()
+    params = {'limit': page_size,
+              'created': {'gte': window[0], 'lt': window[1]}}
+    try:
+        while True:
+            # before the request: a row written while it is in flight may
+            # be newer than the page
+            fetched_at = timezone.now()
+            page = api.Customer.list(**params)
+            if page.data:
+                pages.put((fetched_at, page.data))
+            if not page.has_more or not page.data:
+                break
+            params['starting_after'] = page.data[-1].id
+    except Exception as e:
+        pages.put(e)
+    finally:
+        pages.put(None)
+
+
+def sync(full=False, workers=None, page_size=None, since=None):
+    """Copy customers from Stripe into the mirror; returns how many.
+
+    Without ``full`` (or an explicit ``since``, a Unix timestamp) only
+    customers created since the newest mirrored one are fetched.
+    """
+    conf = _conf()
+    workers = workers or conf['WORKERS']
+    page_size = page_size or conf['PAGE_SIZE']
+    started = timezone.now()
+    if since is None:
+        newest = StripeCustomer.objects.aggregate(Max('created'))
+        if full or newest['created__max'] is None:
+            since = conf['EPOCH']
+        else:
+            since = calendar.timegm(
+                newest['created__max'].utctimetuple())
+    # up to and including the current second
+    end = int(time.time()) + 1
+
+    pages = queue.Queue(maxsize=workers * 2)
+    threads = [
+        threading.Thread(target=_walk, args=(window, page_size, pages))
+        for window in _windows(since, end, workers)
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    synced = 0
+    error = None
+    running = len(threads)
+    while running:
+        page = pages.get()
+        if page is None:
+            running -= 1
+        elif isinstance(page, Exception):
+            error = page
+        elif error is None:
+            synced += store(page[1], page[0])
+    if error is not None:
+        raise error
+
+    if full:
+        # every customer Stripe listed, or that was written since, has
+        # been synced at or after ``started``
+        StripeCustomer.objects.filter(synced_at__lt=started).update(
+            deleted=True,
+        )
+    return synced
@@ -0,0 +1,170 @@
+"""A local stand-in for the Stripe API, for benchmarks and ``manage.py bench``.
+
+``StripeStub().start()`` serves the customer endpoints this project uses from
+memory on a random local port and points the ``stripe`` library at it, so
+nothing leaves the machine.
+"""
+import json
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # benchmarks open hundreds of connections at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # clients that hit their read timeout hang up mid-response
+        pass
+
+
+class StripeStub(object):
+    """A local stand-in for ``api.stripe.com`` with injectable latency.
+
+    Supports just enough of the customers API for this project: create,
+    retrieve, update and list (with ``created`` bounds).  Creates honour
+    ``Idempotency-Key`` the way Stripe does, returning the original customer
+    for a repeated key.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.customers = {}
+        self.idempotent = {}
+        self.requests = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self, install=True):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _params(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8')
+                query = urlparse(self.path).query
+                params = parse_qs(query)
+                params.update(parse_qs(body))
+                return dict((k, v[-1]) for k, v in params.items())
+
+            def _handle(self):
+                params = self._params()
+                with stub._lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                parts = urlparse(self.path).path.strip('/').split('/')
+                if parts[:2] != ['v1', 'customers']:
+                    return self._reply(404, {'error': {
+                        'type': 'invalid_request_error',
+                        'message': 'Unrecognized request URL'}})
+                if len(parts) == 2:
+                    if self.command == 'GET':
+                        return self._reply(200, stub.list_customers(params))
+                    key = self.headers.get('Idempotency-Key')
+                    return self._reply(200, stub.create_customer(params, key))
+                customer = stub.customers.get(parts[2])
+                if customer is None:
+                    return self._reply(404, {'error': {
+                        'type': 'invalid_request_error',
+                        'message': 'No such customer: %s' % parts[2]}})
+                if self.command == 'POST':
+                    customer.update(stub._card_fields(params))
+                return self._reply(200, customer)
+
+            do_GET = do_POST = _handle
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        if install:
+            import stripe
+            stripe.api_base = self.url
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _card_fields(self, params):
+        if 'card' not in params and 'source' not in params:
+            return {}
+        card = {
+            'id': 'card_' + uuid.uuid4().hex[:14],
+            'object': 'card',
+            'last4': '4242',
+            'brand': 'Visa',
+            'exp_month': 12,
+            'exp_year': 2030,
+        }
+        return {'default_source': card['id'],
+                'sources': {'object': 'list', 'data': [card]}}
+
+    def create_customer(self, params, idempotency_key=None):
+        with self._lock:
+            if idempotency_key and idempotency_key in self.idempotent:
+                return self.idempotent[idempotency_key]
+            customer = {
+                'id': 'cus_' + uuid.uuid4().hex[:14],
+                'object': 'customer',
+                'created': int(time.time()),
+                'email': params.get('email'),
+                'description': params.get('description'),
+                'default_source': None,
+                'metadata': {},
+            }
+            customer.update(self._card_fields(params))
+            self.customers[customer['id']] = customer
+            if idempotency_key:
+                self.idempotent[idempotency_key] = customer
+            return customer
+
+    def list_customers(self, params):
+        ids = sorted(
+            i for i, c in self.customers.items()
+            if int(params.get('created[gte]', 0)) <= c['created'] and
+            c['created'] < int(params.get('created[lt]', 2 ** 62))
+        )
+        if params.get('starting_after') in self.customers:
+            ids = ids[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        page = [self.customers[i] for i in ids[:limit]]
+        return {
+            'object': 'list',
+            'url': '/v1/customers',
+            'has_more': len(ids) > limit,
+            'data': page,
+        }
@@ -8,8 +8,159 @@ from django.shortcuts import render_to_response
 from payments.forms import SigninForm, CardForm, UserForm
 import socket
 import unittest
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from main import metrics
+import django_ecommerce.settings as settings
+from payments.views import soon
+from django.test import RequestFactory, override_settings
+from payments import provisioning
+from payments.models import CustomerJob
+import stripe
+from payments.stripe_client import CircuitBreaker
+from payments.stripe_http import CircuitOpen
+from payments import user_cache
+from payments.middleware import get_user_profile, UserProfileMiddleware
+from django.core.management import call_command
+from io import StringIO
+from main import locks
+from payments import ratelimit
+from django.core.cache.utils import make_template_fragment_key
+import json
+import os
+import shutil
+import tempfile
+from django.contrib.auth.hashers import make_password
+from payments import importer
+import datetime
+from django.core import mail
+from django.utils import timezone
+from payments import dunning
+from payments.models import UnpaidUsers
+import time
+from django.test import Client
+from payments import webhooks
+from payments.models import StripeEvent, StripeEventCursor
+from payments import stripe_mirror
+from payments.models import StripeCustomer
+import asyncio
+import re
+from django.test import TransactionTestCase
+from django.utils.http import urlencode
+from django_ecommerce.asgi_handler import ASGIHandler
+from payments import stripe_client
+from payments.stripe_async import AsyncStripeClient
+from payments.stripe_stub import StripeStub
+
+class BudgetRecorder(object):
+    """Records the SQL queries, cache calls and template render time of the
+    block it wraps, and fails ``test_case`` if the block went over budget.
+
+    A budget of ``None`` is not checked.  The failure message lists every
+    query and cache call, marking with ``+`` those past the budget.
+    """
+
+    CACHE_METHODS = ('get', 'get_many', 'has_key', 'set', 'set_many', 'add',
+                     'delete', 'delete_many', 'incr', 'decr', 'clear')
+
+    def __init__(self, test_case, queries=None, cache=None, label=None):
+        self.test_case = test_case
+        self.query_budget = queries
+        self.cache_budget = cache
+        self.label = label or test_case.id()
+        self.queries = []
+        self.cache_calls = []
+        self.template_seconds = 0.0
+
+    def __enter__(self):
+        self._captures = [CaptureQueriesContext(connections[alias])
+                          for alias in connections]
+        for capture in self._captures:
+            capture.__enter__()
+        self._depth = 0
+        self._patched = []
+        for alias in django_settings.CACHES:
+            backend = caches[alias]
+            for name in self.CACHE_METHODS:
+                setattr(backend, name,
+                        self._wrap(alias, name, getattr(backend, name)))
+                self._patched.append((backend, name))
+        record_template = metrics.record_template
+
+        def timed(seconds):
+            self.template_seconds += seconds
+            return record_template(seconds)
+        self._templates = mock.patch('main.metrics.record_template', timed)
+        self._templates.start()
+        return self
+
+    def _wrap(self, alias, name, method):
+        def call(*args, **kwargs):
+            # get_many() and friends may be built on get(); count the
+            # outermost call only
+            if not self._depth:
+                self.cache_calls.append('%s.%s(%s)' % (
+                    alias, name, ', '.join(repr(a) for a in args[:1])))
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return call
 
-class ViewTesterMixin(object):
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._templates.stop()
+        for backend, name in self._patched:
+            delattr(backend, name)
+        for capture in reversed(self._captures):
+            capture.__exit__(exc_type, exc_value, traceback)
+            self.queries.extend(q['sql'] for q in capture.captured_queries)
+        if exc_type is None:
+            self.check()
+
+    def check(self):
+        over = []
+        if self.query_budget is not None and \
+                len(self.queries) > self.query_budget:
+            over.append('%d queries, over its budget of %d' % (
+                len(self.queries), self.query_budget))
+        if self.cache_budget is not None and \
+                len(self.cache_calls) > self.cache_budget:
+            over.append('%d cache calls, over its budget of %d' % (
+                len(self.cache_calls), self.cache_budget))
+        if over:
+            self.test_case.fail('%s made %s\n%s' % (
+                self.label, ' and '.join(over), self.report()))
+
+    def report(self):
+        lines = ['queries:']
+        lines.extend(self._listing(self.queries, self.query_budget))
+        lines.append('cache calls:')
+        lines.extend(self._listing(self.cache_calls, self.cache_budget))
+        lines.append('template rendering: %.1f ms' % (
+            self.template_seconds * 1000))
+        return '\n'.join(lines)
+
+    def _listing(self, items, budget):
+        return ['%s %d. %s' % ('+' if budget is not None and i > budget
+                               else ' ', i, item)
+                for i, item in enumerate(items, 1)]
+
+
+class BudgetMixin(object):
+
+    def assertWithinBudget(self, queries=None, cache=None, label=None):
+        """Fail if the ``with`` block makes more queries or cache calls."""
+        return BudgetRecorder(self, queries, cache, label)
+
+class ViewTesterMixin(BudgetMixin):
+
+    # the performance contract of the view under test: the most SQL queries
+    # and cache calls one request may make (None leaves it unchecked)
+    query_budget = None
+    cache_budget = None
 
     @classmethod
     def setupViewTester(cls, url, view_func, expected_html,
@@ -36,6 +187,10 @@ class ViewTesterMixin(object):
         resp = self.view_func(self.request)
         self.assertEqual(resp.content, self.expected_html)
 
+    def test_stays_within_budget(self):
+        with self.assertWithinBudget(self.query_budget, self.cache_budget):
+            self.view_func(self.request)
+
 class SignInPageTests(TestCase, ViewTesterMixin):
 
     @classmethod
@@ -52,6 +207,9 @@ class SignInPageTests(TestCase, ViewTesterMixin):
     
 class SignOutPageTests(TestCase, ViewTesterMixin):
 
+    query_budget = 0
+    cache_budget = 0
+
     @classmethod
     def setUpClass(cls):
         ViewTesterMixin.setupViewTester('/sign_out',
@@ -64,8 +222,6 @@ class SignOutPageTests(TestCase, ViewTesterMixin):
         #sign_out clears the session, so let's reset it everytime
         self.request.session = {"user":"dummy"}
 
-import django_ecommerce.settings as settings
-from payments.views import soon
 class RegisterPageTests(TestCase, ViewTesterMixin):
 
     @classmethod
@@ -233,4 +389,1188 @@ class RegisterPageTests(TestCase, ViewTesterMixin):
             # #check the associated table got updated.
             # unpaid = UnpaidUsers.objects.filter(email="python@rocks.com")
             # self.assertEqual(len(unpaid), 1)
-            # self.assertIsNotNone(unpaid[0].last_notification)
\ No newline at end of file
+            # self.assertIsNotNone(unpaid[0].last_notification)
+
+
+class CustomerProvisioningTests(TestCase):
+
+    def setUp(self):
+        self.user = User(name='pyRock', email='python@rocks.com',
+                         last_4_digits='4242',
+                         stripe_status=User.STRIPE_PENDING)
+        self.user.set_password('bad_password')
+        self.user.save()
+        self.job = provisioning.enqueue(self.user, 'tok_visa')
+
+    @override_settings(STRIPE_CUSTOMER_PROVISIONING='queued')
+    def test_register_queues_customer_creation(self):
+        request = RequestFactory().post('/register', {
+            'email': 'queued@rocks.com',
+            'name': 'pyRock',
+            'stripe_token': 'tok_visa',
+            'last_4_digits': '4242',
+            'password': 'bad_password',
+            'ver_password': 'bad_password',
+        })
+        request.session = {}
+
+        with mock.patch('stripe.Customer.create') as stripe_mock:
+            resp = register(request)
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(stripe_mock.call_count, 0)
+
+        user = User.objects.get(email='queued@rocks.com')
+        self.assertEqual(request.session['user'], user.pk)
+        self.assertEqual(user.stripe_id, '')
+        self.assertEqual(user.stripe_status, User.STRIPE_PENDING)
+        self.assertEqual(user.customer_job.stripe_token, 'tok_visa')
+
+    @mock.patch('stripe.Customer.create', return_value=mock.Mock(id='cus_1234'))
+    def test_worker_creates_customer(self, stripe_mock):
+        self.assertEqual(provisioning.run_pending(), 1)
+
+        stripe_mock.assert_called_once_with(
+            email='python@rocks.com', description='pyRock', card='tok_visa',
+            plan='gold', idempotency_key=self.job.idempotency_key,
+        )
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.stripe_id, 'cus_1234')
+        self.assertEqual(user.stripe_status, User.STRIPE_ACTIVE)
+        self.assertEqual(CustomerJob.objects.get().status, CustomerJob.DONE)
+
+    def test_connection_error_is_retried_later(self):
+        with mock.patch('stripe.Customer.create', side_effect=
+                        socket.error("can't connect to stripe")):
+            self.assertEqual(provisioning.run_pending(), 1)
+            #the retry is scheduled in the future, so nothing is due yet
+            self.assertEqual(provisioning.run_pending(), 0)
+
+        job = CustomerJob.objects.get()
+        self.assertEqual(job.status, CustomerJob.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.idempotency_key, self.job.idempotency_key)
+        self.assertEqual(User.objects.get().stripe_status, User.STRIPE_PENDING)
+
+    def test_card_error_fails_without_retry(self):
+        error = stripe.error.CardError('declined', 'card', 'card_declined')
+        with mock.patch('stripe.Customer.create', side_effect=error):
+            provisioning.run_pending()
+
+        self.assertEqual(CustomerJob.objects.get().status, CustomerJob.FAILED)
+        self.assertEqual(User.objects.get().stripe_status, User.STRIPE_FAILED)
+
+    def test_edit_waits_for_the_customer(self):
+        session = self.client.session
+        session['user'] = self.user.pk
+        session.save()
+
+        with mock.patch('stripe.Customer.modify') as modify_mock:
+            resp = self.client.post('/edit', {'stripe_token': 'tok_mastercard',
+                                              'last_4_digits': '4444'})
+
+        self.assertRedirects(resp, '/', fetch_redirect_response=False)
+        self.assertEqual(modify_mock.call_count, 0)
+        user = User.objects.get()
+        self.assertEqual((user.stripe_id, user.last_4_digits), ('', '4242'))
+
+    @mock.patch('stripe.Customer.create', return_value=mock.Mock(id='cus_1234'))
+    def test_jobs_finished_by_another_worker_are_not_claimed(self, stripe_mock):
+        select = provisioning._candidates
+        other = []
+
+        def stale_select(*args):
+            candidates = select(*args)
+            if not other:
+                # a second worker finishes the job between this worker's
+                # select and its update
+                other.append(None)
+                other[0] = provisioning.run_pending()
+            return candidates
+
+        with mock.patch.object(provisioning, '_candidates', stale_select):
+            self.assertEqual(provisioning.run_pending(), 0)
+
+        self.assertEqual(other, [1])
+        self.assertEqual(stripe_mock.call_count, 1)
+        self.assertEqual(CustomerJob.objects.get().status, CustomerJob.DONE)
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=30)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpen, self.breaker.before_call)
+        self.assertEqual(self.breaker.rejected, 1)
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_lets_one_probe_through_after_recovery_timeout(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        with mock.patch('time.time', return_value=self.breaker.opened_at + 31):
+            self.breaker.before_call()
+            self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+            #only the probe gets through while it is in flight
+            self.assertRaises(CircuitOpen, self.breaker.before_call)
+
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+class UserProfileCacheTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User(name='pyRock', email='python@rocks.com')
+        self.user.set_password('bad_password')
+        self.user.save()
+
+    def tearDown(self):
+        user_cache.clear()
+
+    def get_request(self, uid):
+        request = RequestFactory().get('/')
+        request.session = {'user': uid}
+        return request
+
+    def test_resolves_user_once_per_request(self):
+        request = self.get_request(self.user.pk)
+        UserProfileMiddleware(lambda r: None)(request)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user_profile.email, 'python@rocks.com')
+            self.assertEqual(request.user_profile.name, 'pyRock')
+            self.assertEqual(get_user_profile(request).pk, self.user.pk)
+
+    def test_anonymous_request_makes_no_queries(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_user_profile(request))
+
+    def test_warm_cache_skips_database(self):
+        get_user_profile(self.get_request(self.user.pk))
+
+        with self.assertNumQueries(0):
+            user = get_user_profile(self.get_request(self.user.pk))
+
+        self.assertEqual(user.pk, self.user.pk)
+        #each request gets its own instance
+        self.assertIsNot(user, get_user_profile(self.get_request(self.user.pk)))
+
+    def test_save_invalidates_cached_user(self):
+        User.get_by_id(self.user.pk)
+        self.user.name = 'pyRocks'
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(User.get_by_id(self.user.pk).name, 'pyRocks')
+
+    def test_save_invalidates_again_on_commit(self):
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            self.user.name = 'pyRocks'
+            self.user.save()
+        # before the commit, a concurrent reader cached the old row
+        User.get_by_id(self.user.pk)
+
+        on_commit.call_args[0][0]()
+        with self.assertNumQueries(1):
+            User.get_by_id(self.user.pk)
+
+    def test_unknown_user_is_signed_out(self):
+        self.assertIsNone(get_user_profile(self.get_request(self.user.pk + 1)))
+        self.assertRaises(User.DoesNotExist, User.get_by_id, self.user.pk + 1)
+
+    @override_settings(
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }},
+        USER_PROFILE_CACHE={'SHARED_CACHE': 'default'},
+    )
+    def test_shared_cache_version_retires_local_entries(self):
+        caches['default'].clear()
+        User.get_by_id(self.user.pk)
+
+        #another process saved the user: only the shared version changes
+        User.objects.filter(pk=self.user.pk).update(name='pyRocks')
+        caches['default'].set('user-profile-version:%s' % self.user.pk, 'v2')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(User.get_by_id(self.user.pk).name, 'pyRocks')
+
+
+class PasswordHashingTests(TestCase):
+
+    def create_user(self):
+        user = User(name='pyRock', email='python@rocks.com')
+        user.set_password('bad_password')
+        user.save()
+        return user
+
+    @override_settings(PASSWORD_HASHING={'PBKDF2_ITERATIONS': 1000})
+    def test_new_passwords_use_configured_cost(self):
+        user = self.create_user()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_sign_in_rehashes_password_with_new_cost(self):
+        with override_settings(PASSWORD_HASHING={'PBKDF2_ITERATIONS': 1000}):
+            self.create_user()
+
+        request = RequestFactory().post('/sign_in', {
+            'email': 'python@rocks.com', 'password': 'bad_password',
+        })
+        request.session = {}
+        with override_settings(PASSWORD_HASHING={'PBKDF2_ITERATIONS': 2000}):
+            resp = sign_in(request)
+
+        self.assertEqual(resp.status_code, 302)
+        user = User.objects.get(email='python@rocks.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(user.check_password('bad_password'))
+
+    def test_calibrate_hashers_prints_settings(self):
+        out = StringIO()
+        call_command('calibrate_hashers', hasher='pbkdf2', target_ms=1,
+                     samples=1, stdout=out)
+
+        self.assertIn("'PBKDF2_ITERATIONS':", out.getvalue())
+
+
+class SignInAuthenticationTests(TestCase):
+
+    def setUp(self):
+        ratelimit.reset()
+        self.user = User(name='pyRock', email='python@rocks.com')
+        self.user.set_password('bad_password')
+        self.user.save()
+
+    def tearDown(self):
+        ratelimit.reset()
+
+    def sign_in_request(self, email='python@rocks.com',
+                        password='bad_password'):
+        request = RequestFactory().post('/sign_in', {
+            'email': email, 'password': password,
+        })
+        request.session = {}
+        return request
+
+    def test_authenticate_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            user = User.authenticate('python@rocks.com', 'bad_password')
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIsNone(User.authenticate('python@rocks.com', 'wrong'))
+
+    def test_unknown_email_still_hashes(self):
+        with mock.patch.object(User, 'set_password') as hash_mock:
+            self.assertIsNone(User.authenticate('nobody@rocks.com', 'pw'))
+
+        hash_mock.assert_called_once_with('pw')
+
+    def test_token_bucket_refills_over_time(self):
+        for i in range(3):
+            self.assertTrue(ratelimit.take('k', 3, 60, now=100))
+        self.assertFalse(ratelimit.take('k', 3, 60, now=100))
+        #one token per second comes back
+        self.assertTrue(ratelimit.take('k', 3, 60, now=101))
+        self.assertFalse(ratelimit.take('k', 3, 60, now=101))
+
+    @override_settings(SIGN_IN_RATE_LIMIT={
+        'PER_IP': {'CAPACITY': 2, 'REFILL_PER_MINUTE': 0},
+        'PER_EMAIL': {'CAPACITY': 100, 'REFILL_PER_MINUTE': 0},
+    })
+    def test_flood_is_rejected_before_the_database(self):
+        for i in range(2):
+            resp = sign_in(self.sign_in_request('user%d@rocks.com' % i))
+            self.assertEqual(resp.status_code, 200)
+
+        with self.assertNumQueries(0):
+            resp = sign_in(self.sign_in_request())
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn(b'Too many sign in attempts', resp.content)
+
+    @override_settings(SIGN_IN_RATE_LIMIT={
+        'PER_IP': {'CAPACITY': 100, 'REFILL_PER_MINUTE': 0},
+        'PER_EMAIL': {'CAPACITY': 1, 'REFILL_PER_MINUTE': 0},
+    })
+    def test_repeated_attempts_on_one_email_are_rejected(self):
+        self.assertEqual(sign_in(self.sign_in_request()).status_code, 302)
+        self.assertEqual(sign_in(self.sign_in_request()).status_code, 429)
+        self.assertEqual(
+            sign_in(self.sign_in_request('other@rocks.com')).status_code, 200
+        )
+
+    @override_settings(SIGN_IN_RATE_LIMIT={'CACHE': 'default', 'LOCK': True,
+                                           'LOCK_WAIT': 0})
+    def test_shared_bucket_is_spent_under_a_lock(self):
+        caches['default'].clear()
+        self.assertTrue(ratelimit.take('k', 1, 0, now=100))
+        self.assertFalse(ratelimit.take('k', 1, 0, now=100))
+
+        # a bucket another process is busy with refuses the attempt
+        with locks.lock('other'):
+            self.assertFalse(ratelimit.take('other', 1, 0, now=100))
+        self.assertTrue(ratelimit.take('other', 1, 0, now=100))
+
+
+class CaseInsensitiveEmailTests(TestCase):
+
+    def setUp(self):
+        ratelimit.reset()
+        self.user = User(name='pyRock', email='Python@Rocks.com')
+        self.user.set_password('bad_password')
+        self.user.save()
+
+    def test_email_key_is_normalized_on_save(self):
+        self.assertEqual(User.objects.get().email_key, 'python@rocks.com')
+
+    def test_lookup_ignores_case(self):
+        self.assertEqual(User.by_email('PYTHON@rocks.COM').get().pk,
+                         self.user.pk)
+        self.assertEqual(
+            User.authenticate(' python@rocks.com', 'bad_password').pk,
+            self.user.pk
+        )
+
+    def test_email_differing_only_by_case_is_a_duplicate(self):
+        user = User(name='pyRock', email='python@rocks.com')
+        self.assertRaises(IntegrityError, user.save)
+
+    def test_legacy_account_without_key_is_found_by_exact_email(self):
+        User.objects.filter(pk=self.user.pk).update(email_key=None)
+
+        self.assertEqual(User.by_email('Python@Rocks.com').get().pk,
+                         self.user.pk)
+        user = User.objects.get()
+        user.name = 'pyRocks'
+        user.save()
+        self.assertIsNone(User.objects.get().email_key)
+
+
+class CardFormFragmentCacheTests(TestCase):
+
+    def setUp(self):
+        self.fragments = caches['template_fragments']
+        self.fragments.clear()
+
+    def tearDown(self):
+        self.fragments.clear()
+
+    def get(self, view=register):
+        request = RequestFactory().get('/register')
+        request.session = {}
+        return view(request)
+
+    def test_card_widgets_are_rendered_once(self):
+        first = self.get()
+        key = make_template_fragment_key(
+            'card_widgets',
+            [soon()['month'], soon()['year'], settings.LANGUAGE_CODE]
+        )
+        self.assertIn('expiry_month', self.fragments.get(key))
+
+        with mock.patch('payments.views.MONTHS', ()):
+            # served from the cache, so the empty option list is not used
+            second = self.get()
+        self.assertIn(b'<option value="11"', first.content)
+        self.assertIn(b'<option value="11"', second.content)
+
+    def test_fragment_is_keyed_on_expiry_date(self):
+        with mock.patch('payments.views.soon',
+                        return_value={'month': 3, 'year': 2020}):
+            self.assertIn(b'<option value="3" selected>', self.get().content)
+        with mock.patch('payments.views.soon',
+                        return_value={'month': 4, 'year': 2020}):
+            self.assertIn(b'<option value="4" selected>', self.get().content)
+
+    def test_bound_form_fields_are_not_cached(self):
+        request = RequestFactory().post('/register', {'name': 'Cached Bob'})
+        request.session = {}
+        self.assertIn(b'Cached Bob', register(request).content)
+
+        self.assertNotIn(b'Cached Bob', self.get().content)
+
+
+class ImportUsersTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        user_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        user_cache.clear()
+
+    def write(self, records, name='users.jsonl'):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        return path
+
+    def records(self, count, start=0):
+        return [{'name': 'user %d' % i, 'email': 'user%d@rocks.com' % i,
+                 'password': 'secret %d' % i}
+                for i in range(start, start + count)]
+
+    def import_users(self, path, **options):
+        out = StringIO()
+        call_command('import_users', path, stdout=out, workers=0, **options)
+        return out.getvalue()
+
+    def test_imports_users_with_hashed_passwords(self):
+        out = self.import_users(self.write(self.records(3)), chunk_size=2)
+
+        self.assertIn('Created 3', out)
+        user = User.objects.get(email='user1@rocks.com')
+        self.assertTrue(user.check_password('secret 1'))
+        self.assertEqual(user.email_key, 'user1@rocks.com')
+
+    def test_duplicate_emails_are_skipped_or_updated(self):
+        User.create('old', 'User0@Rocks.com', 'old', None, '')
+        records = self.records(2) + [dict(self.records(1)[0], name='again')]
+        path = self.write(records)
+
+        self.assertIn('skipped 2', self.import_users(path))
+        self.assertEqual(User.by_email('user0@rocks.com').get().name, 'old')
+
+        out = self.import_users(path, on_duplicate='update', restart=True)
+        self.assertIn('updated 2', out)
+        user = User.by_email('user0@rocks.com').get()
+        self.assertEqual(user.name, 'again')
+        self.assertTrue(user.check_password('secret 0'))
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_update_keeps_fields_the_record_does_not_have(self):
+        User.create('old', 'user0@rocks.com', 'old', '4242', 'cus_1')
+        path = self.write([{'email': 'user0@rocks.com', 'password': 'new',
+                            'name': ''}])
+
+        self.assertIn('updated 1',
+                      self.import_users(path, on_duplicate='update'))
+        user = User.by_email('user0@rocks.com').get()
+        self.assertEqual((user.name, user.last_4_digits, user.stripe_id),
+                         ('old', '4242', 'cus_1'))
+        self.assertTrue(user.check_password('new'))
+
+    def test_resumes_from_checkpoint(self):
+        path = self.write(self.records(5))
+        importer.write_checkpoint(path + '.checkpoint', 3)
+
+        self.assertIn('Resuming after record 3', self.import_users(path))
+        self.assertEqual(
+            sorted(User.objects.values_list('email', flat=True)),
+            ['user3@rocks.com', 'user4@rocks.com']
+        )
+        self.assertEqual(importer.read_checkpoint(path + '.checkpoint'), 5)
+
+    def test_keeps_existing_hashes_and_hashes_in_a_pool(self):
+        records = self.records(4)
+        records[0] = {'email': 'hashed@rocks.com',
+                      'password_hash': make_password('from elsewhere')}
+        path = self.write(records)
+
+        result = importer.import_users(importer.read_records(path),
+                                       chunk_size=2, workers=2)
+
+        self.assertEqual(result, importer.Result(4, 0, 0, 0))
+        user = User.objects.get(email='hashed@rocks.com')
+        self.assertTrue(user.check_password('from elsewhere'))
+
+
+class DunningTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.overdue = self.now - datetime.timedelta(days=8)
+        for i in range(3):
+            UnpaidUsers.objects.create(email='late%d@rocks.com' % i,
+                                       last_notification=self.overdue)
+        UnpaidUsers.objects.create(email='recent@rocks.com')
+
+    def test_due_rows_are_notified_and_stamped(self):
+        self.assertEqual(dunning.run_once(), (3, 0))
+
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ['late0@rocks.com', 'late1@rocks.com',
+                          'late2@rocks.com'])
+        late = UnpaidUsers.objects.get(email='late0@rocks.com')
+        self.assertGreater(late.last_notification, self.now)
+        self.assertEqual(late.notices_sent, 1)
+        self.assertIsNone(late.locked_until)
+        self.assertEqual(dunning.run_once(), (0, 0))
+
+    def test_rows_leased_by_another_worker_are_skipped(self):
+        UnpaidUsers.objects.filter(email='late0@rocks.com').update(
+            locked_until=self.now + datetime.timedelta(minutes=1)
+        )
+        rows, lost = dunning.claim(10)
+        self.assertEqual(sorted(r.email for r in rows),
+                         ['late1@rocks.com', 'late2@rocks.com'])
+
+        # a second worker finds nothing left to claim
+        self.assertEqual(dunning.claim(10), ([], 0))
+
+    def test_unsent_rows_are_retried_after_the_lease(self):
+        class FlakyTransport(object):
+            def send(self, rows):
+                return [rows[0].pk]
+
+        self.assertEqual(dunning.run_once(10, FlakyTransport()), (1, 0))
+        self.assertEqual(dunning.claim(10), ([], 0))
+
+        later = self.now + datetime.timedelta(minutes=10)
+        rows, lost = dunning.claim(10, now=later)
+        self.assertEqual(len(rows), 2)
+
+    def test_rows_sent_by_another_worker_are_not_sent_again(self):
+        select = dunning._candidates
+        other = []
+
+        def stale_select(*args):
+            candidates = select(*args)
+            if not other:
+                # a second worker claims, sends and releases the same rows
+                # between this worker's select and its update
+                other.append(None)
+                other[0] = dunning.run_once()
+            return candidates
+
+        with mock.patch.object(dunning, '_candidates', stale_select):
+            self.assertEqual(dunning.run_once(), (0, 3))
+
+        self.assertEqual(other, [(3, 0)])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(sorted(UnpaidUsers.objects.values_list(
+            'notices_sent', flat=True)), [0, 1, 1, 1])
+
+    def test_new_rows_are_stamped_when_created(self):
+        row = UnpaidUsers.objects.create(email='new@rocks.com')
+        self.assertGreaterEqual(row.last_notification, self.now)
+
+
+@override_settings(STRIPE_WEBHOOK={'SECRET': 'whsec_test'})
+class StripeWebhookTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            name='paying', email='paying@rocks.com', stripe_id='cus_1',
+            last_4_digits='1111',
+        )
+        self.created = int(time.time()) - 60
+
+    def event(self, type, obj, event_id=None, created=None):
+        self.created += 1
+        return json.dumps({
+            'id': event_id or 'evt_%d' % self.created,
+            'type': type,
+            'created': created or self.created,
+            'data': {'object': obj},
+        }).encode('utf-8')
+
+    def deliver(self, payload, secret='whsec_test', timestamp=None):
+        return Client().post(
+            '/payments/webhook', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=webhooks.sign(payload, secret, timestamp),
+        )
+
+    def test_events_are_stored_once(self):
+        payload = self.event('invoice.payment_failed',
+                             {'customer': 'cus_1'}, event_id='evt_dup')
+        self.assertEqual(self.deliver(payload).status_code, 200)
+        self.assertEqual(self.deliver(payload).status_code, 200)
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertFalse(UnpaidUsers.objects.exists())
+
+    def test_bad_signatures_are_refused(self):
+        payload = self.event('invoice.payment_failed', {'customer': 'cus_1'})
+        self.assertEqual(self.deliver(payload, secret='whsec_other')
+                         .status_code, 400)
+        self.assertEqual(self.deliver(payload, timestamp=time.time() - 3600)
+                         .status_code, 400)
+        resp = Client().post('/payments/webhook', payload,
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_batches_apply_the_latest_state(self):
+        failed = self.event('invoice.payment_failed', {'customer': 'cus_1'})
+        paid = self.event('invoice.payment_succeeded', {'customer': 'cus_1'})
+        old_card = self.event('customer.source.updated', {
+            'object': 'card', 'customer': 'cus_1', 'last4': '2222'})
+        new_card = self.event('customer.source.updated', {
+            'object': 'card', 'customer': 'cus_1', 'last4': '4242'})
+        ignored = self.event('charge.succeeded', {'customer': 'cus_1'})
+        # Stripe does not promise to deliver events in order
+        for payload in (new_card, paid, ignored, old_card, failed):
+            self.deliver(payload)
+
+        self.assertEqual(webhooks.process_batch(), (5, 0))
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_4_digits,
+                         '4242')
+        self.assertFalse(UnpaidUsers.objects.exists())
+        self.assertFalse(StripeEvent.objects.filter(
+            processed_at__isnull=True).exists())
+        self.assertEqual(webhooks.process_batch(), (0, 0))
+
+    def test_older_events_in_later_batches_are_skipped(self):
+        self.deliver(self.event('customer.source.updated', {
+            'object': 'card', 'customer': 'cus_1', 'last4': '4242'}))
+        self.deliver(self.event('invoice.payment_failed',
+                                {'customer': 'cus_1'}))
+        webhooks.process_batch()
+
+        old = self.created - 10
+        self.deliver(self.event('customer.source.updated', {
+            'object': 'card', 'customer': 'cus_1', 'last4': '2222'},
+            created=old))
+        self.deliver(self.event('invoice.payment_succeeded',
+                                {'customer': 'cus_1'}, created=old))
+        # a newer event of another kind still applies
+        self.deliver(self.event('customer.deleted', {'id': 'cus_2'}))
+        self.assertEqual(webhooks.process_batch(), (3, 0))
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_4_digits,
+                         '4242')
+        self.assertTrue(UnpaidUsers.objects.filter(
+            email='paying@rocks.com').exists())
+        self.assertTrue(StripeEventCursor.objects.filter(
+            customer='cus_2', kind='customer').exists())
+
+    def test_events_applied_by_another_worker_are_not_claimed(self):
+        self.deliver(self.event('customer.source.updated', {
+            'object': 'card', 'customer': 'cus_1', 'last4': '4242'}))
+        select = webhooks._candidates
+        other = []
+
+        def stale_select(*args):
+            candidates = select(*args)
+            if not other:
+                # a second worker applies the same events between this
+                # worker's select and its update
+                other.append(None)
+                other[0] = webhooks.process_batch()
+            return candidates
+
+        with mock.patch.object(webhooks, '_candidates', stale_select), \
+                mock.patch.object(webhooks, 'apply') as apply_mock:
+            self.assertEqual(webhooks.process_batch(), (0, 1))
+
+        self.assertEqual(other, [(1, 0)])
+        self.assertEqual(apply_mock.call_count, 1)
+
+    def test_failed_renewals_mark_users_unpaid(self):
+        self.deliver(self.event('invoice.payment_failed',
+                                {'customer': 'cus_1'}))
+        self.deliver(self.event('invoice.payment_failed',
+                                {'customer': 'cus_unknown'}))
+        call_command('apply_stripe_events', '--once', stdout=StringIO())
+
+        self.assertEqual(
+            list(UnpaidUsers.objects.values_list('email', flat=True)),
+            ['paying@rocks.com'],
+        )
+
+        self.deliver(self.event('invoice.payment_succeeded',
+                                {'customer': 'cus_1'}))
+        webhooks.process_batch()
+        self.assertFalse(UnpaidUsers.objects.exists())
+
+    def test_customers_are_linked_and_unlinked(self):
+        pending = User.objects.create(name='new', email='New@rocks.com')
+        self.deliver(self.event('customer.created',
+                                {'id': 'cus_2', 'email': 'new@rocks.com'}))
+        self.deliver(self.event('customer.deleted', {'id': 'cus_1'}))
+        webhooks.process_batch()
+
+        self.assertEqual(User.objects.get(pk=pending.pk).stripe_id, 'cus_2')
+        self.assertEqual(User.objects.get(pk=self.user.pk).stripe_id, '')
+
+
+def stripe_customer(id, last4='4242', created=1490000000, **extra):
+    card = {'id': 'card_' + id, 'object': 'card', 'last4': last4,
+            'brand': 'Visa', 'exp_month': 12, 'exp_year': 2030}
+    return dict({
+        'id': id, 'object': 'customer', 'email': id + '@rocks.com',
+        'created': created, 'default_source': card['id'],
+        'sources': {'object': 'list', 'data': [card]},
+        'subscriptions': {'object': 'list', 'data': [{
+            'id': 'sub_' + id, 'status': 'active', 'plan': {'id': 'gold'},
+            'current_period_end': created + 30 * 86400,
+        }]},
+    }, **extra)
+
+class StripeMirrorTests(TestCase):
+
+    def setUp(self):
+        self.user = User(name='pyRock', email='python@rocks.com',
+                         stripe_id='cus_1', last_4_digits='4242')
+        self.user.set_password('bad_password')
+        self.user.save()
+        self.client.post('/sign_in', {'email': 'python@rocks.com',
+                                      'password': 'bad_password'})
+
+    def test_edit_reads_the_mirror(self):
+        stripe_mirror.store([stripe_customer('cus_1', last4='1881')])
+
+        with mock.patch('stripe.Customer.retrieve') as retrieve_mock:
+            resp = self.client.get('/edit')
+
+        self.assertEqual(retrieve_mock.call_count, 0)
+        self.assertContains(resp, 'ends in 1881, expiring 12/2030')
+
+    def test_missing_rows_are_read_through_once(self):
+        with mock.patch('stripe.Customer.retrieve',
+                        return_value=stripe_customer('cus_1')) as retrieve_mock:
+            self.assertEqual(self.user.stripe_customer().plan, 'gold')
+            self.assertEqual(self.user.stripe_customer().plan, 'gold')
+
+        self.assertEqual(retrieve_mock.call_count, 1)
+
+    @override_settings(STRIPE_MIRROR={'MAX_AGE': 60})
+    def test_stale_rows_are_served_when_stripe_is_down(self):
+        stripe_mirror.store([stripe_customer('cus_1', last4='1881')])
+        StripeCustomer.objects.update(
+            synced_at=timezone.now() - datetime.timedelta(hours=1))
+        error = stripe.error.APIConnectionError('down')
+
+        with mock.patch('stripe.Customer.retrieve', side_effect=error):
+            self.assertEqual(self.user.stripe_customer().last_4_digits,
+                             '1881')
+
+    def test_edit_only_writes_to_stripe(self):
+        updated = stripe.Customer.construct_from(
+            stripe_customer('cus_1', last4='5555'), 'sk_test')
+        with mock.patch('stripe.Customer.retrieve') as retrieve_mock, \
+                mock.patch('stripe.Customer.modify',
+                           return_value=updated) as modify_mock:
+            resp = self.client.post('/edit', {'stripe_token': 'tok_visa',
+                                              'last_4_digits': '5555'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(retrieve_mock.call_count, 0)
+        modify_mock.assert_called_once_with('cus_1', card='tok_visa')
+        self.assertEqual(
+            StripeCustomer.objects.get(stripe_id='cus_1').last_4_digits,
+            '5555',
+        )
+
+    def list_customers(self, customers):
+        def list_customers(limit, created, starting_after=None):
+            page = sorted(
+                (c for c in customers
+                 if created['gte'] <= c['created'] < created['lt']),
+                key=lambda c: c['id'],
+            )
+            if starting_after:
+                page = [c for c in page if c['id'] > starting_after]
+            return stripe.ListObject.construct_from({
+                'object': 'list', 'data': page[:limit],
+                'has_more': len(page) > limit,
+            }, 'sk_test')
+        return list_customers
+
+    def test_sync_pages_through_every_window(self):
+        customers = [stripe_customer('cus_%02d' % i, created=1490000000 + i)
+                     for i in range(25)]
+
+        with mock.patch('stripe.Customer.list',
+                        side_effect=self.list_customers(customers)):
+            synced = stripe_mirror.sync(full=True, workers=3, page_size=4,
+                                        since=1490000000)
+
+        self.assertEqual(synced, 25)
+        self.assertEqual(StripeCustomer.objects.count(), 25)
+
+    def test_full_sync_keeps_customers_on_window_boundaries(self):
+        customers = [stripe_customer('cus_%02d' % i, created=1490000000 + i)
+                     for i in range(25)]
+        stripe_mirror.store(customers, timezone.now() -
+                            datetime.timedelta(days=1))
+        # windows [0, 9), [9, 18) and [18, 25) seconds after since
+        self.assertEqual(
+            stripe_mirror._windows(1490000000, 1490000025, 3),
+            [(1490000000, 1490000009), (1490000009, 1490000018),
+             (1490000018, 1490000025)])
+
+        with mock.patch('stripe.Customer.list',
+                        side_effect=self.list_customers(customers)), \
+                mock.patch('time.time', return_value=1490000024.5):
+            stripe_mirror.sync(full=True, workers=3, page_size=4,
+                               since=1490000000)
+
+        self.assertFalse(StripeCustomer.objects.filter(deleted=True).exists())
+
+    def test_sync_keeps_rows_written_after_the_fetch(self):
+        store = stripe_mirror.store
+
+        def store_after_webhook(customers, synced_at=None):
+            # a webhook updates the card after the page was fetched
+            store([stripe_customer('cus_1', last4='9999')])
+            return store(customers, synced_at)
+
+        list_customers = self.list_customers([stripe_customer('cus_1')])
+        with mock.patch('stripe.Customer.list', side_effect=list_customers), \
+                mock.patch.object(stripe_mirror, 'store', store_after_webhook):
+            stripe_mirror.sync(full=True, workers=1, since=1490000000)
+
+        row = StripeCustomer.objects.get(stripe_id='cus_1')
+        self.assertEqual(row.last_4_digits, '9999')
+        self.assertFalse(row.deleted)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+class ViewBudgetTests(TestCase, BudgetMixin):
+    """Query and cache budgets of the hot paths, through the full stack.
+
+    Sessions are pinned to the database engine, so loading one is a query;
+    writes inside the test transaction add a SAVEPOINT and its RELEASE.
+    """
+
+    def setUp(self):
+        caches['pages'].clear()
+        user_cache.clear()
+        self.user = User(name='pyRock', email='python@rocks.com',
+                         stripe_id='cus_budget')
+        self.user.set_password('bad_password')
+        self.user.save()
+        StripeCustomer.objects.create(
+            stripe_id='cus_budget',
+            **stripe_mirror.from_stripe(stripe_customer('cus_budget')))
+
+    def tearDown(self):
+        caches['pages'].clear()
+        user_cache.clear()
+
+    def sign_in(self):
+        session = self.client.session
+        session['user'] = self.user.pk
+        session.save()
+        # a warm user profile cache, as on any request after the first
+        self.client.get('/')
+
+    def test_anonymous_index(self):
+        self.client.get('/')
+        with self.assertWithinBudget(queries=0, cache=1):
+            self.client.get('/')
+
+    def test_signed_in_index(self):
+        self.sign_in()
+        # the session; the user comes from the profile cache
+        with self.assertWithinBudget(queries=1, cache=0):
+            self.client.get('/')
+
+    def test_sign_in_page(self):
+        with self.assertWithinBudget(queries=0, cache=0):
+            self.client.get('/sign_in')
+
+    def test_register_page(self):
+        # the form field and card widget fragments, cached by the first
+        # render
+        self.client.get('/register')
+        with self.assertWithinBudget(queries=0, cache=2):
+            self.client.get('/register')
+
+    def test_sign_in(self):
+        # the user, then creating the session
+        with self.assertWithinBudget(queries=5, cache=0):
+            resp = self.client.post('/sign_in', {
+                'email': 'python@rocks.com', 'password': 'bad_password',
+            })
+        self.assertEqual(resp.status_code, 302)
+
+    def test_edit_page(self):
+        self.sign_in()
+        # the session and the mirrored customer; the card form fragment is
+        # rendered once and cached
+        with self.assertWithinBudget(queries=2, cache=2):
+            resp = self.client.get('/edit')
+        self.assertContains(resp, 'ends in 4242')
+
+    def test_edit(self):
+        self.sign_in()
+        customer = stripe.Customer.construct_from(
+            stripe_customer('cus_budget', last4='1881'), 'sk_test')
+        with mock.patch('stripe.Customer.modify', return_value=customer):
+            # the session, storing the customer Stripe returned and saving
+            # the user; no Stripe reads
+            with self.assertWithinBudget(queries=6, cache=0):
+                resp = self.client.post('/edit', {
+                    'stripe_token': 'tok_visa', 'last_4_digits': '1881',
+                })
+        self.assertEqual(resp.status_code, 302)
+
+    def test_report_lists_queries_over_budget(self):
+        with self.assertRaises(AssertionError) as raised:
+            with self.assertWithinBudget(queries=1, label='two lookups'):
+                list(User.objects.filter(name='a'))
+                list(User.objects.filter(name='b'))
+
+        message = str(raised.exception)
+        self.assertIn('two lookups made 2 queries, over its budget of 1',
+                      message)
+        lines = message.splitlines()
+        self.assertTrue([l for l in lines if l.startswith('  1. SELECT')])
+        self.assertTrue([l for l in lines if l.startswith('+ 2. SELECT')])
+        self.assertIn('template rendering:', message)
+
+
+@override_settings(STRIPE_CUSTOMER_PROVISIONING='inline')
+class ASGIHandlerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, stripe, 'api_base', stripe.api_base)
+        self.stub = StripeStub().start()
+        self.addCleanup(self.stub.stop)
+        stripe_client.reset()
+        self.addCleanup(stripe_client.reset)
+        user_cache.clear()
+        self.app = ASGIHandler()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.addCleanup(lambda: self.app.executor().shutdown(wait=True))
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        body = urlencode(data or {}).encode('ascii')
+        headers = [(b'host', b'testserver')]
+        if self.cookies:
+            headers.append((b'cookie', '; '.join(
+                '%s=%s' % c for c in self.cookies.items()).encode('ascii')))
+        if data is not None:
+            headers.append(
+                (b'content-type', b'application/x-www-form-urlencoded'))
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': b'', 'headers': headers,
+                 'client': ('127.0.0.1', 50000)}
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        status = sent[0]['status']
+        headers = [(k.decode('latin-1'), v.decode('latin-1'))
+                   for k, v in sent[0]['headers']]
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                cookie = value.strip().split(';', 1)[0].split('=', 1)
+                self.cookies[cookie[0]] = cookie[1]
+        return status, dict(headers), sent[1]['body']
+
+    def csrf_token(self, path):
+        status, _, body = self.request('GET', path)
+        self.assertEqual(status, 200)
+        # Django 1.10 quotes the attributes with ', later versions with "
+        return re.search(
+            br'name=["\']csrfmiddlewaretoken["\'] value=["\']([^"\']+)',
+            body).group(1).decode('ascii')
+
+    def register(self, email):
+        return self.request('POST', '/register', {
+            'csrfmiddlewaretoken': self.csrf_token('/register'),
+            'name': 'pyRock', 'email': email, 'stripe_token': 'tok_visa',
+            'last_4_digits': '4242', 'password': 'bad_password',
+            'ver_password': 'bad_password',
+        })
+
+    def test_register_calls_stripe_from_the_event_loop(self):
+        # the threaded transport goes through requests
+        with mock.patch('requests.Session.request',
+                        side_effect=AssertionError('blocking call')):
+            status, headers, _ = self.register('python@rocks.com')
+
+        self.assertEqual(status, 302)
+        self.assertEqual(headers['Location'], '/')
+        user = User.objects.get(email='python@rocks.com')
+        self.assertEqual(self.stub.customers[user.stripe_id]['email'],
+                         'python@rocks.com')
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_deferred_requests_are_counted_once(self):
+        metrics.reset()
+        self.register('python@rocks.com')
+
+        posts = dict((labels, series) for labels, series
+                     in metrics.REQUEST_SECONDS.collect().items()
+                     if labels[1] == 'POST')
+        self.assertEqual([labels[2] for labels in posts], ['302'])
+        self.assertEqual([cumulative[-1] for cumulative, _
+                          in posts.values()], [1])
+
+    def test_edit_updates_the_card(self):
+        self.register('python@rocks.com')
+        user = User.objects.get(email='python@rocks.com')
+
+        status, _, _ = self.request('POST', '/edit', {
+            'csrfmiddlewaretoken': self.csrf_token('/edit'),
+            'stripe_token': 'tok_visa', 'last_4_digits': '4242',
+        })
+
+        self.assertEqual(status, 302)
+        self.assertEqual(
+            StripeCustomer.objects.get(stripe_id=user.stripe_id).last_4_digits,
+            '4242')
+
+    def test_disconnect_mid_body_serves_nothing(self):
+        scope = {'type': 'http', 'method': 'POST', 'path': '/register',
+                 'query_string': b'', 'headers': [
+                     (b'host', b'testserver'),
+                     (b'content-type', b'application/x-www-form-urlencoded'),
+                 ]}
+        messages = [
+            {'type': 'http.request', 'more_body': True,
+             'body': b'name=pyRock&email=python%40rocks.com'},
+            {'type': 'http.disconnect'},
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        with mock.patch.object(self.app, 'serve') as serve:
+            self.loop.run_until_complete(self.app(scope, receive, send))
+
+        self.assertFalse(serve.called)
+        self.assertEqual(sent, [])
+
+    def test_invalid_form_makes_no_stripe_call(self):
+        status, _, body = self.request('POST', '/register', {
+            'csrfmiddlewaretoken': self.csrf_token('/register'),
+            'email': 'not an email',
+        })
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.stub.requests, 0)
+        self.assertFalse(User.objects.exists())
+
+    def test_stripe_errors_reach_the_view(self):
+        request = RequestFactory().post('/register')
+        request.META[stripe_client.RESPONSES] = [
+            stripe.error.APIConnectionError('down')]
+
+        with self.assertRaises(stripe.error.APIConnectionError):
+            stripe_client.call(request, 'Customer.create', email='a@b.com')
+
+    def test_deferred_call_writes_nothing(self):
+        request = RequestFactory().post('/register', {
+            'name': 'pyRock', 'email': 'python@rocks.com',
+            'stripe_token': 'tok_visa', 'last_4_digits': '4242',
+            'password': 'bad_password', 'ver_password': 'bad_password',
+        })
+        request.session = {}
+        request.META[stripe_client.DEFER] = True
+
+        resp = register(request)
+
+        self.assertIsInstance(resp, stripe_client.DeferredResponse)
+        self.assertEqual(resp.deferred.method, 'post')
+        self.assertTrue(resp.deferred.url.endswith('/v1/customers'))
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(self.stub.requests, 0)
+
+
+class AsyncStripeClientTests(unittest.TestCase):
+
+    OK = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'
+
+    def setUp(self):
+        stripe_client.reset()
+        self.addCleanup(stripe_client.reset)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.received = []
+
+    def run_against(self, respond, calls):
+        """Answer each request the client sends with ``respond(n, writer)``,
+        n counting requests from 1 over all connections, until it returns
+        False; then make ``calls`` with a client reading for 0.2s.
+        ``self.release`` is set once they have been made.
+        """
+        handlers = []
+
+        async def handle(reader, writer):
+            finished = asyncio.Future()
+            handlers.append(finished)
+            try:
+                while True:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    await reader.readexactly(int(re.search(
+                        br'Content-Length: (\d+)', head).group(1)))
+                    self.received.append(head.split(b' ', 1)[0])
+                    if not await respond(len(self.received), writer):
+                        break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+                finished.set_result(None)
+
+        async def run():
+            self.release = asyncio.Event()
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            url = 'http://127.0.0.1:%d/v1/customers' % (
+                server.sockets[0].getsockname()[1])
+            client = AsyncStripeClient(10, 1, 0.2)
+            try:
+                for method in calls:
+                    response = await client.request(method, url, {}, 'a=b')
+            finally:
+                client.close()
+                self.release.set()
+                server.close()
+                await asyncio.gather(*handlers)
+                await server.wait_closed()
+            return response
+
+        return self.loop.run_until_complete(run())
+
+    def test_stalled_post_on_a_kept_alive_connection_is_not_sent_again(self):
+        async def respond(n, writer):
+            if n > 1:
+                # Stripe is still creating the customer
+                await self.release.wait()
+            writer.write(self.OK)
+            return True
+
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.run_against(respond, ['get', 'post'])
+
+        self.assertEqual(self.received, [b'GET', b'POST'])
+
+    def test_idle_connection_closed_by_the_server_is_replaced(self):
+        async def respond(n, writer):
+            writer.write(self.OK)
+            # closes the connection after answering, without saying so
+            return False
+
+        body, status, _ = self.run_against(respond, ['get', 'post'])
+
+        self.assertEqual((body, status), ('{}', 200))
+        self.assertEqual(self.received, [b'GET', b'POST'])
@@ -0,0 +1,131 @@
+"""Process-local (and optionally shared) cache of ``payments.models.User`` rows.
+
+Entries hold the row's field values rather than model instances, so every
+caller gets a fresh ``User`` it is free to modify.
+
+With ``USER_PROFILE_CACHE['SHARED_CACHE']`` naming an alias in ``CACHES``,
+each user also has a version stamp in that cache.  ``invalidate()`` replaces
+the stamp, which retires the entry in every process's local LRU at once;
+without a shared cache, other processes see the change once their local entry
+expires after ``LOCAL_TIMEOUT`` seconds.
+
+Writers call ``invalidate_on_commit()``: until their transaction commits,
+another request can still load the old row and cache it under the new stamp,
+so the entry is invalidated again once the new row is visible.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from main.lru import LRUCache
+
+DEFAULTS = {
+    'SIZE': 1024,
+    'LOCAL_TIMEOUT': 60,
+    'SHARED_CACHE': None,
+    'SHARED_TIMEOUT': 300,
+}
+
+_local = None
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'USER_PROFILE_CACHE', {}))
+
+
+def _local_cache():
+    global _local
+    if _local is None:
+        _local = LRUCache(_conf()['SIZE'])
+    return _local
+
+
+def _shared_cache():
+    alias = _conf()['SHARED_CACHE']
+    return caches[alias] if alias else None
+
+
+def _version_key(uid):
+    return 'user-profile-version:%s' % uid
+
+
+def _entry_key(uid, version):
+    return 'user-profile:%s:%s' % (uid, version)
+
+
+def _field_names():
+    from payments.models import User
+    return [f.attname for f in User._meta.concrete_fields]
+
+
+def _load(uid):
+    from payments.models import User
+    values = User.objects.filter(pk=uid).values_list(*_field_names()).first()
+    return tuple(values) if values is not None else None
+
+
+def _build(values):
+    from payments.models import User
+    return User.from_db(DEFAULT_DB_ALIAS, _field_names(), values)
+
+
+def get(uid):
+    """Return the ``User`` with primary key ``uid``, or ``None``."""
+    try:
+        key = int(uid)
+    except (TypeError, ValueError):
+        return None
+    conf = _conf()
+    local = _local_cache()
+    shared = _shared_cache()
+    version = shared.get(_version_key(key), 0) if shared is not None else 0
+
+    entry = local.get(key)
+    if entry is not None:
+        expires, entry_version, values = entry
+        if entry_version == version and expires > time.time():
+            return _build(values)
+
+    values = None
+    if shared is not None:
+        values = shared.get(_entry_key(key, version))
+    if values is None:
+        values = _load(key)
+        if values is None:
+            return None
+        if shared is not None:
+            shared.set(_entry_key(key, version), values,
+                       conf['SHARED_TIMEOUT'])
+    local.set(key, (time.time() + conf['LOCAL_TIMEOUT'], version, values))
+    return _build(values)
+
+
+def invalidate(uid):
+    if uid is None:
+        return
+    _local_cache().delete(int(uid))
+    shared = _shared_cache()
+    if shared is not None:
+        # a random version can't collide with one an older entry was
+        # stored under, even if the stamp itself gets evicted
+        shared.set(_version_key(int(uid)), uuid.uuid4().hex, None)
+
+
+def invalidate_on_commit(uid):
+    """Invalidate ``uid`` now, for reads later in this transaction, and
+    again when it commits."""
+    invalidate(uid)
+    transaction.on_commit(lambda: invalidate(uid))
+
+
+def clear():
+    _local_cache().clear()
+
+
+def reset():
+    """Drop the local LRU, e.g. after changing ``USER_PROFILE_CACHE``."""
+    global _local
+    _local = None
@@ -1,15 +1,29 @@
-import stripe
 import datetime
+import logging
 
-from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseRedirect,
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from django.shortcuts import render, redirect
 from payments.forms import SigninForm, CardForm, UserForm
+from payments.middleware import get_user_profile
 from payments.models import User
+from payments import (
+    provisioning, ratelimit, stripe_client, stripe_mirror, webhooks,
+)
 import django_ecommerce.settings as settings
 
-stripe.api_key = settings.STRIPE_SECRET
+logger = logging.getLogger(__name__)
+
+
+# options for the card expiry selects in cardform.html
+MONTHS = tuple(range(1, 12))
+YEARS = tuple(range(2011, 2036))
 
 
 def soon():
@@ -17,24 +31,42 @@ def soon():
     return {'month': soon.month, 'year': soon.year}
 
 
+def card_context():
+    """Context shared by every page that includes cardform.html."""
+    return {
+        'months': MONTHS,
+        'publishable': settings.STRIPE_PUBLISHABLE,
+        'soon': soon(),
+        'years': YEARS,
+    }
+
+
 def sign_in(request):
     user = None
+    status = 200
     if request.method == 'POST':
         form = SigninForm(request.POST)
         if form.is_valid():
-            results = User.objects.filter(email=form.cleaned_data['email'])
-            if len(results) == 1:
-                if results[0].check_password(form.cleaned_data['password']):
-                    request.session['user'] = results[0].pk
+            email = form.cleaned_data['email']
+            if not ratelimit.allow_sign_in(request.META.get('REMOTE_ADDR'),
+                                           email):
+                form.addError('Too many sign in attempts, try again later')
+                status = 429
+            else:
+                found = User.authenticate(
+                    email, form.cleaned_data['password']
+                )
+                if found is not None:
+                    request.session['user'] = found.pk
                     return redirect('/')
                 else:
                     form.addError('Incorrect email address or password')
-            else:
-                form.addError('Incorrect email address or password')
     else:
         form = SigninForm()
 
-    print(form.non_field_errors())
+    if form.non_field_errors():
+        logger.info('sign_in rejected status=%d reason=%r', status,
+                    form.non_field_errors().as_text())
 
     return render(
         request,
@@ -42,7 +74,8 @@ def sign_in(request):
         {
             'form': form,
             'user': user
-        }
+        },
+        status=status,
     )
 
 
@@ -51,48 +84,61 @@ def sign_out(request):
     return redirect('/')
 
 
+@stripe_client.deferrable
 def register(request):
     user = None
     if request.method == 'POST':
         form = UserForm(request.POST)
-        print("@@@@@@@@@@@@@@@@@@@@@@@@@@@")
-        print(request)
-        print("@@@@@@@@@@@@@@@@@@@@@@@@@@@")
-        print(form)
         if form.is_valid():
-            # update based on your billing method (subscription vs one time)
-            customer = stripe.Customer.create(
-                email=form.cleaned_data['email'],
-                description=form.cleaned_data['name'],
-                card=form.cleaned_data['stripe_token'],
-                plan="gold",
-
-            )
-            # customer = stripe.Charge.create(
-            #     description = form.cleaned_data['email'],
-            #     card = form.cleaned_data['stripe_token'],
-            #     amount="5000",
-            #     currency="usd"
-            # )
-
             user = User(
                 name=form.cleaned_data['name'],
                 email=form.cleaned_data['email'],
                 last_4_digits=form.cleaned_data['last_4_digits'],
-                stripe_id=customer.id,
             )
 
+            queued = provisioning.is_queued()
+            if queued:
+                # the provision_customers worker creates the Stripe customer
+                user.stripe_status = User.STRIPE_PENDING
+            else:
+                # update based on your billing method (subscription vs one time)
+                customer = stripe_client.call(
+                    request, 'Customer.create',
+                    email=form.cleaned_data['email'],
+                    description=form.cleaned_data['name'],
+                    card=form.cleaned_data['stripe_token'],
+                    plan="gold",
+
+                )
+                # customer = stripe.Charge.create(
+                #     description = form.cleaned_data['email'],
+                #     card = form.cleaned_data['stripe_token'],
+                #     amount="5000",
+                #     currency="usd"
+                # )
+                user.stripe_id = customer.id
+
             # ensure encrypted password
             user.set_password(form.cleaned_data['password'])
 
             try:
-                user.save()
+                with transaction.atomic():
+                    user.save()
+                    if queued:
+                        provisioning.enqueue(
+                            user, form.cleaned_data['stripe_token']
+                        )
             except IntegrityError:
+                logger.info('register rejected reason=duplicate_email')
                 form.addError(user.email + ' is already a member')
                 user = None
             else:
                 request.session['user'] = user.pk
                 return HttpResponseRedirect('/')
+        elif logger.isEnabledFor(logging.DEBUG):
+            # field names only: the values include passwords
+            logger.debug('register rejected invalid_fields=%s',
+                         ','.join(sorted(form.errors)))
 
     else:
         form = UserForm()
@@ -100,32 +146,36 @@ def register(request):
     return render(
         request,
         'register.html',
-        {
-            'form': form,
-            'months': range(1, 12),
-            'publishable': settings.STRIPE_PUBLISHABLE,
-            'soon': soon(),
-            'user': user,
-            'years': range(2011, 2036),
-        },
+        dict(card_context(), form=form, user=user),
     )
 
 
+@stripe_client.deferrable
 def edit(request):
-    uid = request.session.get('user')
+    user = get_user_profile(request)
 
-    if uid is None:
+    if user is None:
         return HttpResponseRedirect('/')
 
-    user = User.objects.get(pk=uid)
-
     if request.method == 'POST':
+        if user.stripe_status != User.STRIPE_ACTIVE or not user.stripe_id:
+            # the provision_customers worker has not created the customer
+            # yet, or could not; modifying '' would create a second one
+            messages.add_message(
+                request, messages.ERROR,
+                'Your card cannot be changed until your account is set up.',
+                fail_silently=True,
+            )
+            return redirect('/')
         form = CardForm(request.POST)
         if form.is_valid():
 
-            customer = stripe.Customer.retrieve(user.stripe_id)
-            customer.card = form.cleaned_data['stripe_token']
-            customer.save()
+            # one write; the mirror is updated from the response
+            customer = stripe_client.call(
+                request, 'Customer.modify',
+                user.stripe_id, card=form.cleaned_data['stripe_token'],
+            )
+            stripe_mirror.store([customer])
 
             user.last_4_digits = form.cleaned_data['last_4_digits']
             user.stripe_id = customer.id
@@ -136,14 +186,19 @@ def edit(request):
     else:
         form = CardForm()
 
-    return render(
-        request,
-        'edit.html',
-        {
-            'form': form,
-            'publishable': settings.STRIPE_PUBLISHABLE,
-            'soon': soon(),
-            'months': range(1, 12),
-            'years': range(2011, 2036)
-        },
-    )
\ No newline at end of file
+    return render(request, 'edit.html', dict(
+        card_context(), customer=user.stripe_customer(), form=form,
+    ))
+
+
+@csrf_exempt
+@require_POST
+def webhook(request):
+    """Store a Stripe event for the ``apply_stripe_events`` worker."""
+    try:
+        webhooks.receive(request.body,
+                         request.META.get('HTTP_STRIPE_SIGNATURE'))
+    except webhooks.SignatureError as e:
+        return HttpResponseBadRequest(str(e))
+    # a redelivered event is acknowledged too, so Stripe stops retrying it
+    return HttpResponse(status=200)